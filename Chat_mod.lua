@@ -3,7 +3,8 @@
 -- chatmaid.
 @mod "chatmaid - include chatmaid.lua"
 @after last glob "require \"?*\""
-@include "chatmaid.lua"
+@include minified "chatmaid_tables.lua"
+@include minified "chatmaid.lua"
 
 @mod "chatmaid - sanitize message"
 @after "function lf.ProcessChatMessageArgs(args)"
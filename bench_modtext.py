@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark modtext for parsing and applying mods at scale.
+
+The benchmark generates synthetic Lua sources and mod rules of various
+sizes, measures wall time, peak memory and processed lines for each phase,
+and optionally compares the result with a stored baseline so that
+regressions fail loudly.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import modtext
+
+_log = logging.getLogger('bench_modtext')
+
+# Number of source lines and number of mods for the default benchmark.
+_QUICK_LINE_COUNTS = (1000, 10000, 100000)
+_QUICK_MOD_COUNTS = (1, 10, 100)
+
+# Additional sizes for the full benchmark.
+_FULL_LINE_COUNTS = _QUICK_LINE_COUNTS + (1000000,)
+_FULL_MOD_COUNTS = _QUICK_MOD_COUNTS + (1000,)
+
+# Every n-th mod includes a file instead of using its own text lines.
+_INCLUDE_MOD_INTERVAL = 10
+_INCLUDE_FILE_COUNT = 5
+_INCLUDE_LINE_COUNT = 50
+
+# Phases that take less than this many seconds are too noisy to compare.
+_MIN_SECONDS_TO_COMPARE = 0.005
+
+_PHASES = ('parse', 'parse_cached', 'index', 'resolve', 'apply', 'apply_streamed', 'apply_mapped', 'apply_sharded')
+
+# Number of shards for the "apply_sharded" phase.
+_SHARD_COUNT = max(2, os.cpu_count() or 1)
+
+# Size of the source and rules the command line interface is started for
+# to measure how long a build script has to wait for each file.
+_COLD_START_CASE_KEY = 'cold_start'
+_COLD_START_LINE_COUNT = 1000
+_COLD_START_MOD_COUNT = 10
+_COLD_START_PHASES = ('import', 'cli', 'cli_uncached')
+
+
+def _sourceLine(lineNumber):
+    return 'local value_%d = %d' % (lineNumber, lineNumber)
+
+
+def _writeSource(sourcePath, lineCount):
+    with open(sourcePath, 'w', encoding='utf-8') as sourceFile:
+        for lineNumber in range(lineCount):
+            sourceFile.write(_sourceLine(lineNumber))
+            sourceFile.write('\n')
+
+
+def _writeIncludes(folder):
+    result = []
+    for includeNumber in range(_INCLUDE_FILE_COUNT):
+        includePath = os.path.join(folder, 'include_%d.lua' % includeNumber)
+        with open(includePath, 'w', encoding='utf-8') as includeFile:
+            includeFile.write('-- Include %d.\n' % includeNumber)
+            for lineNumber in range(_INCLUDE_LINE_COUNT - 1):
+                includeFile.write('local include_%d_%d = %d\n' % (includeNumber, lineNumber, lineNumber))
+        result.append(includePath)
+    return result
+
+
+def _writeRules(rulesPath, lineCount, modCount, includePaths):
+    """
+    Write rules with ``modCount`` mods whose anchors are spread evenly over
+    a source with ``lineCount`` lines as written by `_writeSource()`. The
+    mods cycle through exact, contains, glob and last finders.
+    """
+    assert lineCount >= 4 * modCount
+
+    step = lineCount // (modCount + 1)
+    with open(rulesPath, 'w', encoding='utf-8') as rulesFile:
+        rulesFile.write('-- Synthetic rules for %d mods on %d lines.\n' % (modCount, lineCount))
+        for modNumber in range(modCount):
+            anchorLineNumber = (modNumber + 1) * step
+            anchorLine = _sourceLine(anchorLineNumber)
+            rulesFile.write('@mod "mod %d"\n' % modNumber)
+            finderKind = modNumber % 4
+            if finderKind == 0:
+                rulesFile.write('@after "%s"\n' % anchorLine)
+            elif finderKind == 1:
+                rulesFile.write('@before contains "value_%d ="\n' % anchorLineNumber)
+            elif finderKind == 2:
+                rulesFile.write('@before glob "local value_%d = *"\n' % anchorLineNumber)
+            else:
+                rulesFile.write('@before last "%s"\n' % anchorLine)
+            if modNumber % _INCLUDE_MOD_INTERVAL == 0:
+                includePath = includePaths[modNumber % len(includePaths)]
+                rulesFile.write('@include "%s"\n' % includePath.replace('\\', '\\\\'))
+            else:
+                for textLineNumber in range(3):
+                    rulesFile.write('-- mod %d, line %d\n' % (modNumber, textLineNumber))
+            rulesFile.write('\n')
+
+
+def _measured(function, repeatCount):
+    """
+    ``(seconds, peakBytes, result)`` of calling ``function``, where seconds
+    is the fastest of ``repeatCount`` calls. The peak memory is measured
+    during an additional call because tracing slows down the code.
+    """
+    assert repeatCount >= 1
+
+    seconds = None
+    for _ in range(repeatCount):
+        startTime = time.perf_counter()
+        result = function()
+        duration = time.perf_counter() - startTime
+        if (seconds is None) or (duration < seconds):
+            seconds = duration
+    tracemalloc.start()
+    try:
+        function()
+        _, peakBytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peakBytes, result
+
+
+def _benchmarkCase(folder, lineCount, modCount, includePaths, repeatCount):
+    sourcePath = os.path.join(folder, 'source_%d.lua' % lineCount)
+    if not os.path.exists(sourcePath):
+        _writeSource(sourcePath, lineCount)
+    rulesPath = os.path.join(folder, 'rules_%d_%d.lua' % (lineCount, modCount))
+    _writeRules(rulesPath, lineCount, modCount, includePaths)
+    targetPath = os.path.join(folder, 'target.lua')
+    with open(rulesPath, 'r', encoding='utf-8') as rulesFile:
+        ruleLineCount = sum(1 for _ in rulesFile)
+    includedLineCount = _INCLUDE_LINE_COUNT * len(range(0, modCount, _INCLUDE_MOD_INTERVAL))
+
+    result = {}
+
+    def parsed():
+        return modtext.ModRules(rulesPath)
+
+    seconds, peakBytes, rules = _measured(parsed, repeatCount)
+    result['parse'] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': ruleLineCount + includedLineCount}
+
+    cachePath = os.path.join(folder, 'rules_%d_%d.pickle' % (lineCount, modCount))
+    modtext.cachedRules(rulesPath, cachePath)
+
+    def loaded():
+        return modtext.cachedRules(rulesPath, cachePath)
+
+    seconds, peakBytes, _ = _measured(loaded, repeatCount)
+    result['parse_cached'] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': ruleLineCount + includedLineCount}
+
+    sourceLines = list(rules._sourceLines(sourcePath))
+
+    def indexed():
+        return modtext._LineIndex(sourceLines, rules._termMatcher)
+
+    seconds, peakBytes, sourceIndex = _measured(indexed, repeatCount)
+    result['index'] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': lineCount}
+
+    def resolved():
+        return [mod.modded(sourceIndex)[0] for mod in rules.mods]
+
+    seconds, peakBytes, _ = _measured(resolved, repeatCount)
+    candidateLineCount = sum(
+        len(sourceIndex.lineNumbers(finder)) for mod in rules.mods for finder in mod.finders)
+    result['resolve'] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': candidateLineCount}
+
+    for phase, streamed in (('apply', False), ('apply_streamed', True)):
+        seconds, peakBytes, _ = _measured(lambda: rules.apply(sourcePath, targetPath, streamed), repeatCount)
+        # Streamed reads the source twice.
+        sourceLineCount = 2 * lineCount if streamed else lineCount
+        result[phase] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': sourceLineCount}
+    seconds, peakBytes, _ = _measured(lambda: rules.apply(sourcePath, targetPath, mapped=True), repeatCount)
+    result['apply_mapped'] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': lineCount}
+    # The peak memory only covers the main process, not the shard processes.
+    seconds, peakBytes, _ = _measured(lambda: rules.apply(sourcePath, targetPath, shards=_SHARD_COUNT), repeatCount)
+    result['apply_sharded'] = {'seconds': seconds, 'peakBytes': peakBytes, 'lines': lineCount}
+    return result
+
+
+def _coldStartCase(folder, includePaths, repeatCount):
+    """
+    Measurements for starting a new Python process that imports modtext or
+    applies rules using the command line interface. The memory of the
+    child processes is not measured.
+    """
+    sourcePath = os.path.join(folder, 'cold_start_source.lua')
+    _writeSource(sourcePath, _COLD_START_LINE_COUNT)
+    rulesPath = os.path.join(folder, 'cold_start_rules.lua')
+    _writeRules(rulesPath, _COLD_START_LINE_COUNT, _COLD_START_MOD_COUNT, includePaths)
+    targetPath = os.path.join(folder, 'cold_start_target.lua')
+    modtextFolder = os.path.dirname(os.path.abspath(modtext.__file__))
+    phaseToArgumentsMap = {
+        'import': ['-c', 'import modtext'],
+        'cli': ['-m', 'modtext', rulesPath, sourcePath, targetPath],
+        'cli_uncached': ['-m', 'modtext', '--no-cache', rulesPath, sourcePath, targetPath],
+    }
+
+    def started(arguments):
+        subprocess.run([sys.executable] + arguments, cwd=modtextFolder, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Write the rules cache the "cli" phase reads.
+    started(phaseToArgumentsMap['cli'])
+    result = {}
+    for phase in _COLD_START_PHASES:
+        seconds = None
+        for _ in range(repeatCount):
+            startTime = time.perf_counter()
+            started(phaseToArgumentsMap[phase])
+            duration = time.perf_counter() - startTime
+            if (seconds is None) or (duration < seconds):
+                seconds = duration
+        lineCount = 0 if phase == 'import' else _COLD_START_LINE_COUNT
+        result[phase] = {'seconds': seconds, 'peakBytes': 0, 'lines': lineCount}
+    return result
+
+
+def _caseKey(lineCount, modCount):
+    return 'lines=%d,mods=%d' % (lineCount, modCount)
+
+
+def benchmarks(lineCounts, modCounts, repeatCount=3):
+    """
+    Map of case keys to the measurements of each phase for all combinations
+    of ``lineCounts`` and ``modCounts`` where the source is large enough to
+    hold distinct anchors for all mods, and the key ``'cold_start'`` to the
+    measurements of starting the command line interface.
+    """
+    result = {}
+    with tempfile.TemporaryDirectory(prefix='bench_modtext_') as folder:
+        includePaths = _writeIncludes(folder)
+        _log.info('benchmark %s', _COLD_START_CASE_KEY)
+        result[_COLD_START_CASE_KEY] = _coldStartCase(folder, includePaths, repeatCount)
+        for lineCount in lineCounts:
+            for modCount in modCounts:
+                if lineCount >= 4 * modCount:
+                    caseKey = _caseKey(lineCount, modCount)
+                    _log.info('benchmark %s', caseKey)
+                    result[caseKey] = _benchmarkCase(folder, lineCount, modCount, includePaths, repeatCount)
+    return result
+
+
+def regressions(caseToPhasesMap, baselineCaseToPhasesMap, tolerance):
+    """
+    List of texts describing measurements in ``caseToPhasesMap`` that are
+    worse than in ``baselineCaseToPhasesMap`` by more than ``tolerance``,
+    for example 0.25 for 25%.
+    """
+    assert tolerance >= 0
+
+    result = []
+    for caseKey, phaseToMeasurementsMap in sorted(caseToPhasesMap.items()):
+        baselinePhaseToMeasurementsMap = baselineCaseToPhasesMap.get(caseKey, {})
+        for phase, measurements in sorted(phaseToMeasurementsMap.items()):
+            baselineMeasurements = baselinePhaseToMeasurementsMap.get(phase)
+            if baselineMeasurements is not None:
+                for key in ('seconds', 'peakBytes'):
+                    actual = measurements[key]
+                    expected = baselineMeasurements[key]
+                    isComparable = (key != 'seconds') or (max(actual, expected) >= _MIN_SECONDS_TO_COMPARE)
+                    if isComparable and (actual > expected * (1 + tolerance)):
+                        result.append('%s, %s: %s increased from %s to %s' % (caseKey, phase, key, expected, actual))
+    return result
+
+
+def _report(caseToPhasesMap):
+    lines = ['%-24s %-15s %12s %12s %10s %14s' % ('case', 'phase', 'seconds', 'peak KiB', 'lines', 'lines/second')]
+    for caseKey, phaseToMeasurementsMap in caseToPhasesMap.items():
+        for phase in _PHASES + _COLD_START_PHASES:
+            measurements = phaseToMeasurementsMap.get(phase)
+            if measurements is not None:
+                seconds = measurements['seconds']
+                linesPerSecond = measurements['lines'] / seconds if seconds > 0 else 0
+                lines.append('%-24s %-15s %12.6f %12d %10d %14.0f' % (
+                    caseKey, phase, seconds, measurements['peakBytes'] // 1024, measurements['lines'],
+                    linesPerSecond))
+    return '\n'.join(lines)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='benchmark modtext for parsing and applying mods at scale')
+    parser.add_argument('--full', action='store_true',
+        help='include sources with 1,000,000 lines and rules with 1,000 mods')
+    parser.add_argument('--repeat', type=int, default=3, metavar='COUNT',
+        help='number of runs per phase to take the fastest from (default: %(default)s)')
+    parser.add_argument('--baseline', metavar='PATH',
+        help='JSON file with previous results to compare with; regressions result in exit code 1')
+    parser.add_argument('--tolerance', type=float, default=0.25, metavar='RATIO',
+        help='ratio by which a measurement may exceed the baseline (default: %(default)s)')
+    parser.add_argument('--save', metavar='PATH', help='JSON file to store the results in, for example as new baseline')
+    args = parser.parse_args(arguments)
+
+    lineCounts, modCounts = (_FULL_LINE_COUNTS, _FULL_MOD_COUNTS) if args.full else (_QUICK_LINE_COUNTS, _QUICK_MOD_COUNTS)
+    caseToPhasesMap = benchmarks(lineCounts, modCounts, args.repeat)
+    print(_report(caseToPhasesMap))
+    if args.save is not None:
+        _log.info('write results to %s', args.save)
+        with open(args.save, 'w', encoding='utf-8') as resultFile:
+            json.dump(caseToPhasesMap, resultFile, indent=2, sort_keys=True)
+    result = 0
+    if args.baseline is not None:
+        _log.info('compare with baseline %s', args.baseline)
+        with open(args.baseline, 'r', encoding='utf-8') as baselineFile:
+            baselineCaseToPhasesMap = json.load(baselineFile)
+        for regression in regressions(caseToPhasesMap, baselineCaseToPhasesMap, args.tolerance):
+            _log.error('regression: %s', regression)
+            result = 1
+    return result
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('modtext').setLevel(logging.WARNING)
+    sys.exit(main())
@@ -5,16 +5,25 @@ Build Firefall chatmaid mod.
 
 # Ensure Python is current enough.
 import sys
-if sys.version_info < (3, 3):
-    raise EnvironmentError('Python 3.3 or later must be installed')
+if sys.version_info < (3, 8):
+    raise EnvironmentError('Python 3.8 or later must be installed')
 
+import argparse
+import collections
+import concurrent.futures
 import errno
+import hashlib
+import io
+import json
 import logging
 import os
 import shutil
 import string
+import time
 import zipfile
 
+import chatlog
+import luamin
 import modtext
 
 __version__ = '0.4'
@@ -30,75 +39,344 @@ _MelderSymbols = {
     'ChatmaidVersion': __version__,
     'FirefallVersion': _FirefallVersion,
 }
-_buildFolder = os.path.abspath('build')
-_distFolder = os.path.abspath('dist')
 
-_FirefallChatFolderPath = r'C:\Program Files (x86)\Red 5 Studios\Firefall\system\gui\components\MainUI\HUD\Chat'
-_ChatOptionsLuaPath = os.path.join(_FirefallChatFolderPath, 'ChatOptions.lua')
-_ChatLuaPath = os.path.join(_FirefallChatFolderPath, 'Chat.lua')
-_modifiedChatLuaPath = os.path.join(_buildFolder, 'Chat.lua')
-_modifiedChatOptionsLuaPath = os.path.join(_buildFolder, 'ChatOptions.lua')
+# Manifest describing what to build; see `_plannedSteps()` for its format.
+_ManifestPath = 'build_manifest.json'
 
-_log = logging.getLogger('build_chatmaid')
+# Default compression level for archives, from 0 (none) to 9 (best); archives
+# in the manifest can use a different "compressLevel".
+_ZipCompressLevel = 9
 
+_log = logging.getLogger('build_chatmaid')
 
-def _backupPath(sourcePath):
-    _, sourceName = os.path.split(sourcePath)
-    baseName, suffix = os.path.splitext(sourceName)
-    backupName = baseName + '_backup' + suffix
-    result = os.path.join(_buildFolder, backupName)
-    return result
+# Errors of broken or half saved rules and sources that `_Watcher` reports
+# without stopping to watch; besides `modtext.ModError` and missing files
+# these include `ValueError`s such as `UnicodeDecodeError`.
+_WatchErrors = (ValueError, EnvironmentError)
 
 
-def _possiblyBuildBackup(sourcePath):
-    backupPath = _backupPath(sourcePath)
+def _possiblyBuildBackup(sourcePath, backupPath):
+    """
+    Copy ``sourcePath`` to ``backupPath`` unless the backup already exists,
+    so the backup keeps the original even after the source was modded.
+    """
     if os.path.exists(backupPath):
         _log.info('preserve existing backup: %s', backupPath)
+        result = False
     else:
         _log.info('build backup: %s', backupPath)
         shutil.copy2(sourcePath, backupPath)
+        result = True
+    return result
 
 
-def _slurped(pathToRead):
+def _slurped(pathToRead, encoding='utf-8'):
     _log.info('read %s', pathToRead)
     result = []
-    with open(pathToRead, 'r', encoding='utf-8') as fileToRead:
+    with open(pathToRead, 'r', encoding=encoding) as fileToRead:
         for line in fileToRead:
             result.append(line.rstrip('\n\r\t '))
     return result
 
 
-def _buildModifiedLuaFiles():
-    chatOptionsRules = modtext.ModRules(os.path.abspath('ChatOptions_mod.lua'))
-    chatOptionsRules.apply(_backupPath(_ChatOptionsLuaPath), _modifiedChatOptionsLuaPath)
-    chatRules = modtext.ModRules(os.path.abspath('Chat_mod.lua'))
-    chatRules.apply(_backupPath(_ChatLuaPath), _modifiedChatLuaPath)
+def _digest(paths, values=()):
+    """
+    SHA-256 hex digest of the content of all files in ``paths`` and the
+    JSON representation of ``values``. Missing files yield a digest
+    different from any existing file.
+    """
+    result = hashlib.sha256()
+    for path in paths:
+        result.update(os.path.abspath(path).encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as fileToHash:
+                result.update(hashlib.sha256(fileToHash.read()).digest())
+        except FileNotFoundError:
+            result.update(b'\0missing')
+    result.update(json.dumps(values, sort_keys=True).encode('utf-8'))
+    return result.hexdigest()
+
+
+class _BuildCache(object):
+    """
+    Digests of the inputs each target was built from during the previous
+    build, so targets whose inputs did not change can be skipped.
+    """
+    def __init__(self, path):
+        assert path is not None
+
+        self._path = path
+        self._hasChanged = False
+        try:
+            with open(path, 'r', encoding='utf-8') as cacheFile:
+                self._targetToEntryMap = json.load(cacheFile)
+            if not isinstance(self._targetToEntryMap, dict) or not all(
+                    isinstance(entry, dict) and isinstance(entry.get('digest'), str)
+                    for entry in self._targetToEntryMap.values()):
+                raise ValueError('build cache must map each target to an object with a "digest"')
+        except FileNotFoundError:
+            self._targetToEntryMap = {}
+        except (EnvironmentError, ValueError) as error:
+            _log.warning('ignore broken build cache %s: %s', path, error)
+            self._targetToEntryMap = {}
+
+    def isCurrent(self, targetPath, digest):
+        """
+        ``True`` if ``targetPath`` exists and was built from inputs with
+        ``digest``.
+        """
+        entry = self._targetToEntryMap.get(targetPath)
+        return (entry is not None) and (entry['digest'] == digest) and os.path.exists(targetPath)
+
+    def update(self, targetPath, digest, dependencyPaths=()):
+        self._targetToEntryMap[targetPath] = {
+            'dependencies': list(dependencyPaths),
+            'digest': digest,
+        }
+        self._hasChanged = True
+
+    def write(self):
+        if self._hasChanged:
+            _log.info('write build cache %s', self._path)
+            with open(self._path, 'w', encoding='utf-8') as cacheFile:
+                json.dump(self._targetToEntryMap, cacheFile, indent=2, sort_keys=True)
+            self._hasChanged = False
+
+
+class _Watcher(object):
+    """
+    Keeps the mod rules, their includes and the indexed sources of all
+    ``jobs`` in memory, and re-applies only the jobs affected by a changed
+    rules, include or source file.
+    """
+    def __init__(self, jobs, buildCache):
+        assert jobs is not None
+        assert buildCache is not None
+
+        self._jobs = list(jobs)
+        self._buildCache = buildCache
+        self._rulesPathToRulesMap = {}
+        self._rulesPathToIncludedPathsMap = {}
+        self._sourcePaths = set(sourcePath for _, sourcePath, _ in self._jobs)
+        # Lines of each source together with the encoding they were read
+        # with, which is the encoding option of the rules applied to it.
+        self._sourcePathToEncodingAndLinesMap = {}
+        # Indexed sources together with the lines they index, which tell
+        # whether the source was read again since.
+        self._jobToLinesAndSourceIndexMap = {}
+        for rulesPath in set(rulesPath for rulesPath, _, _ in self._jobs):
+            self._readRules(rulesPath)
+        for rulesPath, sourcePath, _ in self._jobs:
+            rules = self._rulesPathToRulesMap[rulesPath]
+            if rules is not None:
+                try:
+                    self._sourceLines(sourcePath, rules.options.getOption('encoding'))
+                except _WatchErrors as error:
+                    _log.error('cannot read source "%s": %s', sourcePath, error)
+        self._pathToStatMap = {path: self._stat(path) for path in self._watchedPaths()}
+
+    def _readRules(self, rulesPath):
+        for job in list(self._jobToLinesAndSourceIndexMap.keys()):
+            if job[0] == rulesPath:
+                del self._jobToLinesAndSourceIndexMap[job]
+        try:
+            rules = modtext.ModRules(rulesPath)
+            self._rulesPathToIncludedPathsMap[rulesPath] = [
+                os.path.abspath(includedPath) for includedPath in rules.includedPaths]
+        except _WatchErrors as error:
+            _log.error('cannot read mods from "%s": %s', rulesPath, error)
+            rules = None
+            # Keep watching the previous includes so fixing them is noticed.
+            self._rulesPathToIncludedPathsMap.setdefault(rulesPath, [])
+        self._rulesPathToRulesMap[rulesPath] = rules
 
+    def _sourceLines(self, sourcePath, encoding):
+        encodingAndLines = self._sourcePathToEncodingAndLinesMap.get(sourcePath)
+        if (encodingAndLines is None) or (encodingAndLines[0] != encoding):
+            encodingAndLines = (encoding, _slurped(sourcePath, encoding))
+            self._sourcePathToEncodingAndLinesMap[sourcePath] = encodingAndLines
+        return encodingAndLines[1]
 
-def _buildChatmaidZip():
-    melderInfoTemplatePath = 'melder_info_template.ini'
-    _log.info('read template for melder info from %s', melderInfoTemplatePath)
-    with open(melderInfoTemplatePath, 'r', encoding='utf-8') as melderInfoTemplateFile:
-        melderInfoTemplate = string.Template(melderInfoTemplateFile.read())
+    def _watchedPaths(self):
+        result = set(self._sourcePaths)
+        for rulesPath, includedPaths in self._rulesPathToIncludedPathsMap.items():
+            result.add(rulesPath)
+            result.update(includedPaths)
+        return sorted(result)
 
-    melderInfoPath = os.path.join(_buildFolder, 'melder_info.ini')
-    _log.info('write melder info to %s', melderInfoPath)
-    textToWrite = melderInfoTemplate.substitute(_MelderSymbols)
-    with open(melderInfoPath, 'w', encoding='utf-8') as melderInfoFile:
-        melderInfoFile.write(textToWrite)
+    @staticmethod
+    def _stat(path):
+        try:
+            pathStat = os.stat(path)
+            result = (pathStat.st_mtime_ns, pathStat.st_size)
+        except FileNotFoundError:
+            result = None
+        return result
 
-    targetZipName = 'Chatmaid_v' + __version__ + '.zip'
-    targetZipPath = os.path.join(_distFolder, targetZipName)
-    _log.info('write distribution archive to %s', targetZipPath)
-    with zipfile.ZipFile(targetZipPath, 'w') as targetZipFile:
-        for pathToAdd in (_modifiedChatOptionsLuaPath, _modifiedChatLuaPath, melderInfoPath):
+    def changedPaths(self):
+        """
+        Paths of watched files that changed since the previous call.
+        """
+        result = []
+        for path in self._watchedPaths():
+            pathStat = self._stat(path)
+            if self._pathToStatMap.get(path) != pathStat:
+                self._pathToStatMap[path] = pathStat
+                result.append(path)
+        return result
+
+    def update(self, changedPaths):
+        """
+        Re-read the rules and sources affected by ``changedPaths`` and
+        re-apply all jobs depending on them. Return the number of
+        targets whose content changed.
+        """
+        assert changedPaths is not None
+
+        changedPaths = set(changedPaths)
+        rulesPathsToRead = set(
+            rulesPath for rulesPath, includedPaths in self._rulesPathToIncludedPathsMap.items()
+            if (rulesPath in changedPaths) or not changedPaths.isdisjoint(includedPaths))
+        sourcePathsToRead = changedPaths.intersection(self._sourcePaths)
+        for rulesPath in sorted(rulesPathsToRead):
+            self._readRules(rulesPath)
+        for sourcePath in sourcePathsToRead:
+            # Read the source again when a job needs it.
+            self._sourcePathToEncodingAndLinesMap.pop(sourcePath, None)
+        # Watch includes that were added or removed.
+        for path in self._watchedPaths():
+            if path not in self._pathToStatMap:
+                self._pathToStatMap[path] = self._stat(path)
+
+        result = 0
+        for job in self._jobs:
+            rulesPath, sourcePath, targetPath = job
+            if (rulesPath in rulesPathsToRead) or (sourcePath in sourcePathsToRead):
+                rules = self._rulesPathToRulesMap[rulesPath]
+                if rules is not None:
+                    try:
+                        sourceLines = self._sourceLines(sourcePath, rules.options.getOption('encoding'))
+                        linesAndSourceIndex = self._jobToLinesAndSourceIndexMap.get(job)
+                        if (linesAndSourceIndex is None) or (linesAndSourceIndex[0] is not sourceLines):
+                            linesAndSourceIndex = (sourceLines, rules.indexedSource(sourceLines))
+                            self._jobToLinesAndSourceIndexMap[job] = linesAndSourceIndex
+                        hasTargetChanged = rules.applyIndexed(linesAndSourceIndex[1], targetPath)
+                        modStep = _modStep(targetPath, rulesPath, sourcePath, targetPath)
+                        for outputPath in modStep.outputPaths:
+                            self._buildCache.update(outputPath, modStep.digest(), modStep.inputPaths)
+                        if hasTargetChanged:
+                            result += 1
+                    except _WatchErrors as error:
+                        _log.error('cannot apply "%s" to "%s": %s', rulesPath, sourcePath, error)
+        return result
+
+
+def _watch(plannedSteps, buildCache, interval):
+    """
+    Re-build the modified Lua files and everything depending on them
+    whenever one of the files they depend on changes, until interrupted by
+    Control-C. ``plannedSteps`` is a function returning the current build
+    steps.
+    """
+    assert interval > 0
+
+    jobs = [step.arguments for step in plannedSteps() if step.action is _possiblyApplyRules]
+    watcher = _Watcher(jobs, buildCache)
+    _log.info('watch for changes every %.3f seconds; press Control-C to stop', interval)
+    try:
+        while True:
+            time.sleep(interval)
+            changedPaths = watcher.changedPaths()
+            if changedPaths != []:
+                startTime = time.perf_counter()
+                _log.info('detected changes in: %s', ', '.join(changedPaths))
+                if watcher.update(changedPaths) > 0:
+                    # Only few steps remain, which run faster without a process pool.
+                    _runSteps(plannedSteps(), buildCache, 1)
+                else:
+                    _log.info('modified Lua files are unchanged, skipping later steps')
+                buildCache.write()
+                _log.info('updated in %.3f seconds', time.perf_counter() - startTime)
+    except KeyboardInterrupt:
+        _log.info('stop watching')
+
+
+def _archiveDateTime():
+    """
+    Time stamp for all archive members, which is taken from the environment
+    variable SOURCE_DATE_EPOCH if set and otherwise is the earliest time a
+    ZIP archive supports. Either way, building the same files twice yields
+    the same archive.
+    """
+    sourceDateEpoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if sourceDateEpoch is not None:
+        result = tuple(time.gmtime(max(int(sourceDateEpoch), 315532800))[:6])
+    else:
+        result = (1980, 1, 1, 0, 0, 0)
+    return result
+
+
+def _archiveData(pathsToAdd, compressLevel, dateTime):
+    """
+    Content of a reproducible ZIP archive containing ``pathsToAdd`` sorted
+    by name, deflated with ``compressLevel`` and using the time stamp
+    ``dateTime`` and the same permissions for all members.
+    """
+    assert 0 <= compressLevel <= 9
+    assert len(dateTime) == 6
+
+    nameToPathMap = {os.path.basename(pathToAdd): pathToAdd for pathToAdd in pathsToAdd}
+    result = io.BytesIO()
+    with zipfile.ZipFile(result, 'w') as targetZipFile:
+        for nameToAdd in sorted(nameToPathMap.keys()):
+            pathToAdd = nameToPathMap[nameToAdd]
             _log.info('  add %s', pathToAdd)
-            targetZipFile.write(pathToAdd, os.path.basename(pathToAdd))
+            with open(pathToAdd, 'rb') as fileToAdd:
+                dataToAdd = fileToAdd.read()
+            zipInfo = zipfile.ZipInfo(nameToAdd, tuple(dateTime))
+            zipInfo.compress_type = zipfile.ZIP_DEFLATED
+            zipInfo.create_system = 0
+            zipInfo.external_attr = 0o644 << 16
+            targetZipFile.writestr(zipInfo, dataToAdd, compresslevel=compressLevel)
+    return result.getvalue()
+
 
-    melderAddonsPath = os.path.expandvars(os.path.join('${LOCALAPPDATA}', 'Melder', 'addons'))
-    melderZipPath = os.path.join(melderAddonsPath, targetZipName)
-    _log.info('copy melder addon to %s', melderZipPath)
-    shutil.copy2(targetZipPath, melderZipPath)
+def _possiblyWriteArchive(targetZipPath, archiveData):
+    """
+    Write ``archiveData`` to ``targetZipPath`` unless it already contains
+    exactly that data, so that its modification time and thus downstream
+    caches and mirrors remain untouched.
+    """
+    archiveDigest = hashlib.sha256(archiveData).digest()
+    try:
+        with open(targetZipPath, 'rb') as existingZipFile:
+            existingDigest = hashlib.sha256(existingZipFile.read()).digest()
+    except FileNotFoundError:
+        existingDigest = None
+    if existingDigest == archiveDigest:
+        _log.info('preserve identical archive %s', targetZipPath)
+        result = False
+    else:
+        _log.info('write distribution archive to %s', targetZipPath)
+        temporaryZipPath = targetZipPath + '.tmp'
+        with open(temporaryZipPath, 'wb') as temporaryZipFile:
+            temporaryZipFile.write(archiveData)
+        os.replace(temporaryZipPath, targetZipPath)
+        result = True
+    return result
+
+
+def _possiblyWriteArchives(memberPaths, targetZipPaths, compressLevel, dateTime):
+    """
+    Write a reproducible archive containing ``memberPaths`` to all
+    ``targetZipPaths`` that do not already contain it.
+    """
+    archiveData = _archiveData(memberPaths, compressLevel, dateTime)
+    result = False
+    for targetZipPath in targetZipPaths:
+        if _possiblyWriteArchive(targetZipPath, archiveData):
+            result = True
+    return result
 
 
 def _logMelderButton():
@@ -126,20 +404,465 @@ def _permutations(pools):
                 hasAdvanced = True
     
 
-def _logLuaSmilies():
-    smilies = ['"' + ''.join(smilie) + '"' for smilie in _permutations((':;8BX', '-^o', ')(PD'))]
-    _log.info('lua code for smilies:\nlocal _SMILIES = Set{' + ', '.join(smilies) + '}')
-    
+def _smilies():
+    return sorted(''.join(smilie) for smilie in _permutations((':;8BX', '-^o', ')(PD')))
+
+
+def _luaString(text):
+    result = '"'
+    for c in text.encode('utf-8'):
+        if c in b'"\\':
+            result += '\\' + chr(c)
+        elif 32 <= c < 127:
+            result += chr(c)
+        else:
+            result += '\\%d' % c
+    return result + '"'
+
+
+def _luaTableLines(name, keyToValueMap, comment):
+    """
+    Lines of Lua code assigning a table with all items in ``keyToValueMap``
+    sorted by key to ``chatmaid_tables.<name>``.
+    """
+    def luaValue(value):
+        if isinstance(value, bool):
+            result = 'true' if value else 'false'
+        elif isinstance(value, int):
+            result = str(value)
+        else:
+            result = _luaString(value)
+        return result
+
+    result = ['', '-- ' + comment, 'chatmaid_tables.%s = {' % name]
+    line = ''
+    for key in sorted(keyToValueMap.keys()):
+        item = '[%s]=%s,' % (luaValue(key), luaValue(keyToValueMap[key]))
+        if (line != '') and (len(line) + 1 + len(item) > 78):
+            result.append(line)
+            line = ''
+        line += (' ' if line != '' else '    ') + item
+    if line != '':
+        result.append(line)
+    result.append('}')
+    return result
+
+
+def _chatmaidTablesLuaLines():
+    """
+    Lines of a Lua module with precomputed lookup tables for chatmaid.lua.
+    """
+    utf8SequenceLengths = {}
+    utf8LeadValues = {}
+    for code in range(256):
+        if code >= 0xfc:
+            sequenceLength = 6
+        elif code >= 0xf8:
+            sequenceLength = 5
+        elif code >= 0xf0:
+            sequenceLength = 4
+        elif code >= 0xe0:
+            sequenceLength = 3
+        elif code >= 0xc0:
+            sequenceLength = 2
+        else:
+            sequenceLength = 1
+        utf8SequenceLengths[code] = sequenceLength
+        utf8LeadValues[code] = code if sequenceLength == 1 else code & (0x7f >> sequenceLength)
+
+    def setMap(items):
+        return {item: True for item in items}
+
+    result = [
+        '-- Lookup tables for chatmaid.lua.',
+        '--',
+        '-- Generated by build_chatmaid.py using the word lists in chatlog.py; do not',
+        '-- edit.',
+        'chatmaid_tables = {}',
+    ]
+    result += _luaTableLines('UTF8_SEQUENCE_LENGTHS', utf8SequenceLengths,
+        'Number of bytes in an UTF-8 sequence starting with a certain byte.')
+    result += _luaTableLines('UTF8_LEAD_VALUES', utf8LeadValues,
+        'Bits of the first byte of an UTF-8 sequence that are part of the unicode.')
+    result += _luaTableLines('LANGUAGES', chatlog.CODE_TO_LANGUAGE_MAP,
+        'Language indicated by unicodes of non ASCII letters; other non ASCII unicodes indicate "xx".')
+    result += _luaTableLines('VALID_SINGLE_CHARACTERS', setMap(chatlog.VALID_SINGLE_CHARACTERS),
+        'Single characters that are valid messages.')
+    result += _luaTableLines('COMMON_NON_ENGLISH_WORDS', setMap(chatlog.COMMON_NON_ENGLISH_WORDS),
+        'Common non English words using only basic latin alphabet.')
+    result += _luaTableLines('THANKS', setMap(chatlog.THANKS), 'Messages to be considered thanks.')
+    result += _luaTableLines('SMILIES', setMap(_smilies()), 'Smilies.')
+    return result
+
+
+# Functions returning the lines of files that can be generated using
+# "generated" in the manifest.
+_GeneratorNameToLinesFunctionMap = {
+    'chatmaid_tables': _chatmaidTablesLuaLines,
+}
+
+
+def _possiblyWriteText(targetPath, textToWrite, newline=None):
+    """
+    Write ``textToWrite`` to ``targetPath`` unless it already contains
+    it, so the build cache can skip steps depending on it.
+    """
+    try:
+        with open(targetPath, 'r', encoding='utf-8') as existingFile:
+            existingText = existingFile.read()
+    except FileNotFoundError:
+        existingText = None
+    if existingText == textToWrite:
+        _log.info('preserve unchanged %s', targetPath)
+        result = False
+    else:
+        _log.info('write %s', targetPath)
+        with open(targetPath, 'w', encoding='utf-8', newline=newline) as targetFile:
+            targetFile.write(textToWrite)
+        result = True
+    return result
+
+
+def _possiblyWriteGenerated(generatorName, targetPath):
+    lines = _GeneratorNameToLinesFunctionMap[generatorName]()
+    return _possiblyWriteText(targetPath, '\n'.join(lines) + '\n', '\n')
+
+
+def _possiblyWriteTemplate(templatePath, targetPath, symbols):
+    _log.info('read template %s', templatePath)
+    with open(templatePath, 'r', encoding='utf-8') as templateFile:
+        template = string.Template(templateFile.read())
+    return _possiblyWriteText(targetPath, template.substitute(symbols))
+
+
+def _possiblyApplyRules(rulesPath, sourcePath, targetPath):
+    _log.info('read mods from "%s"', rulesPath)
+    return modtext.cachedRules(rulesPath).apply(sourcePath, targetPath)
+
+
+class _BuildStep(object):
+    """
+    Node of the build graph that builds ``outputPaths`` from ``inputPaths``
+    by calling ``action`` with ``arguments``; the action returns ``True``
+    if it changed any output. Cached steps are skipped if the content of
+    their inputs and their arguments are the same as during the previous
+    build. Other steps always run and decide on their own whether to write
+    anything.
+
+    ``dependencies`` holds the steps building any of the inputs.
+    """
+    def __init__(self, name, action, arguments, inputPaths, outputPaths, isCached=True):
+        assert name is not None
+        assert action is not None
+        assert outputPaths != []
+
+        self.name = name
+        self.action = action
+        self.arguments = tuple(arguments)
+        self.inputPaths = list(inputPaths)
+        self.outputPaths = list(outputPaths)
+        self.isCached = isCached
+        self.dependencies = []
+
+    def digest(self):
+        return _digest(self.inputPaths, [self.action.__name__, self.arguments, modtext.__version__])
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.name)
+
+
+def _modStep(name, rulesPath, sourcePath, targetPath):
+    """
+    Step to apply ``rulesPath`` to ``sourcePath``, which also depends on
+    the files the rules include and on modtext and luamin themselves.
+    """
+    includedPaths = [os.path.abspath(includedPath) for includedPath in modtext.rulesIncludedPaths(rulesPath)]
+    inputPaths = [rulesPath, sourcePath, os.path.abspath(modtext.__file__), os.path.abspath(luamin.__file__)] + includedPaths
+    return _BuildStep(name, _possiblyApplyRules, (rulesPath, sourcePath, targetPath), inputPaths, [targetPath])
+
+
+def _expanded(text, variables):
+    """
+    ``text`` with each ``${name}`` replaced by the value of ``name`` in
+    ``variables`` or, if it is missing there, in the environment.
+    """
+    try:
+        result = string.Template(text).substitute(collections.ChainMap(variables, os.environ))
+    except KeyError as error:
+        raise ValueError('variable ${%s} used in %r must be defined' % (error.args[0], text))
+    return result
+
+
+def _manifestVariables(manifest, definitions, environment=None):
+    """
+    Map of variable names to values for ``manifest``. These are the Melder
+    symbols, the ``definitions`` from the command line and the variables of
+    the manifest. A manifest variable is only a default: the value of an
+    equally named variable in ``environment``, which defaults to
+    ``os.environ``, takes precedence over it, and a definition takes
+    precedence over both.
+    """
+    if environment is None:
+        environment = os.environ
+    result = {name: str(value) for name, value in _MelderSymbols.items()}
+    result.update(definitions)
+    for name, value in manifest.get('variables', {}).items():
+        if name not in definitions:
+            if name in environment:
+                result[name] = environment[name]
+            else:
+                result[name] = _expanded(value, result)
+    return result
+
+
+def _plannedSteps(manifest, variables):
+    """
+    Steps to build all addons in ``manifest`` with their dependencies
+    derived from the paths they read and write.
+
+    The manifest is a JSON object with ``variables`` to use as ``${name}``
+    in paths, the path of the build ``cache`` and a list of ``addons``.
+    Each addon has a ``name`` and lists of ``backups`` (``source`` and
+    ``target``), ``generated`` files (``generator`` and ``target``),
+    ``mods`` (``rules``, ``source`` and ``target``), ``templates``
+    (``template`` and ``target``) and ``archives`` (``target``, ``members``,
+    ``copies`` and optionally ``compressLevel``, which defaults to
+    `_ZipCompressLevel`).
+    """
+    def path(text):
+        return os.path.abspath(_expanded(text, variables))
+
+    result = []
+    for addon in manifest['addons']:
+        addonName = addon['name']
+        for backup in addon.get('backups', []):
+            sourcePath = path(backup['source'])
+            backupPath = path(backup['target'])
+            result.append(_BuildStep(
+                '%s: backup %s' % (addonName, backupPath), _possiblyBuildBackup, (sourcePath, backupPath),
+                [sourcePath], [backupPath], isCached=False))
+        for generated in addon.get('generated', []):
+            generatorName = generated['generator']
+            if generatorName not in _GeneratorNameToLinesFunctionMap:
+                raise ValueError('generator %r must be changed to one of: %s' % (
+                    generatorName, sorted(_GeneratorNameToLinesFunctionMap.keys())))
+            targetPath = path(generated['target'])
+            result.append(_BuildStep(
+                '%s: generate %s' % (addonName, targetPath), _possiblyWriteGenerated, (generatorName, targetPath),
+                [], [targetPath], isCached=False))
+        for mod in addon.get('mods', []):
+            targetPath = path(mod['target'])
+            result.append(_modStep(
+                '%s: mod %s' % (addonName, targetPath), path(mod['rules']), path(mod['source']), targetPath))
+        for template in addon.get('templates', []):
+            templatePath = path(template['template'])
+            targetPath = path(template['target'])
+            result.append(_BuildStep(
+                '%s: template %s' % (addonName, targetPath), _possiblyWriteTemplate,
+                (templatePath, targetPath, variables), [templatePath], [targetPath]))
+        for archive in addon.get('archives', []):
+            memberPaths = [path(member) for member in archive['members']]
+            targetZipPaths = [path(archive['target'])] + [path(copy) for copy in archive.get('copies', [])]
+            compressLevel = archive.get('compressLevel', _ZipCompressLevel)
+            if (type(compressLevel) is not int) or not (0 <= compressLevel <= 9):
+                raise ValueError('compressLevel of archive %s must be changed to an integer between 0 and 9: %r' % (
+                    archive['target'], compressLevel))
+            result.append(_BuildStep(
+                '%s: archive %s' % (addonName, targetZipPaths[0]), _possiblyWriteArchives,
+                (memberPaths, targetZipPaths, compressLevel, list(_archiveDateTime())),
+                memberPaths, targetZipPaths))
+    _linkDependencies(result)
+    return result
+
+
+def _linkDependencies(steps):
+    outputPathToStepMap = {}
+    for step in steps:
+        for outputPath in step.outputPaths:
+            existingStep = outputPathToStepMap.get(outputPath)
+            if existingStep is not None:
+                raise ValueError('%s must be built by only one step but "%s" and "%s" both do' % (
+                    outputPath, existingStep.name, step.name))
+            outputPathToStepMap[outputPath] = step
+    for step in steps:
+        step.dependencies = []
+        for inputPath in step.inputPaths:
+            dependency = outputPathToStepMap.get(inputPath)
+            if (dependency is not None) and (dependency is not step) and (dependency not in step.dependencies):
+                step.dependencies.append(dependency)
+    _sortedSteps(steps)
+
+
+def _sortedSteps(steps):
+    """
+    ``steps`` sorted so that each step comes after its dependencies.
+    """
+    result = []
+    stepToPendingCountMap = {step: len(step.dependencies) for step in steps}
+    stepToDependentsMap = _stepToDependentsMap(steps)
+    readySteps = [step for step in steps if step.dependencies == []]
+    while readySteps != []:
+        step = readySteps.pop(0)
+        result.append(step)
+        for dependent in stepToDependentsMap[step]:
+            stepToPendingCountMap[dependent] -= 1
+            if stepToPendingCountMap[dependent] == 0:
+                readySteps.append(dependent)
+    if len(result) != len(steps):
+        raise ValueError('steps must not depend on each other in a cycle: %s' % ', '.join(
+            step.name for step in steps if step not in result))
+    return result
+
+
+def _stepToDependentsMap(steps):
+    result = {step: [] for step in steps}
+    for step in steps:
+        for dependency in step.dependencies:
+            result[dependency].append(step)
+    return result
+
+
+class _InlineExecutor(object):
+    """
+    Executor that runs each submitted function right away in the current
+    process, which avoids the overhead of a process pool for one worker.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, errorType, error, traceback):
+        pass
+
+    def submit(self, function, *arguments):
+        result = concurrent.futures.Future()
+        try:
+            result.set_result(function(*arguments))
+        except Exception as error:
+            result.set_exception(error)
+        return result
+
+
+def _timedStepResult(action, arguments):
+    startTime = time.perf_counter()
+    result = action(*arguments)
+    return result, time.perf_counter() - startTime
+
+
+def _runSteps(steps, buildCache, workers):
+    """
+    Run each of ``steps`` as soon as all its dependencies are done, with up
+    to ``workers`` independent steps running concurrently in separate
+    processes. Return the number of steps that changed any of their
+    outputs.
+    """
+    assert workers >= 1
+
+    result = 0
+    startTime = time.perf_counter()
+    stepToPendingCountMap = {step: len(step.dependencies) for step in steps}
+    stepToDependentsMap = _stepToDependentsMap(steps)
+    stepToSecondsMap = {}
+    readySteps = [step for step in steps if step.dependencies == []]
+    futureToStepAndDigestMap = {}
+
+    def finish(step, seconds):
+        stepToSecondsMap[step] = seconds
+        for dependent in stepToDependentsMap[step]:
+            stepToPendingCountMap[dependent] -= 1
+            if stepToPendingCountMap[dependent] == 0:
+                readySteps.append(dependent)
+
+    workers = min(workers, len(steps))
+    executor = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else _InlineExecutor()
+    with executor:
+        try:
+            while (readySteps != []) or (futureToStepAndDigestMap != {}):
+                while readySteps != []:
+                    step = readySteps.pop(0)
+                    digest = step.digest() if step.isCached else None
+                    if step.isCached and all(
+                            buildCache.isCurrent(outputPath, digest) for outputPath in step.outputPaths):
+                        _log.info('preserve unchanged: %s', step.name)
+                        finish(step, 0.0)
+                    else:
+                        _log.info('start: %s', step.name)
+                        for outputPath in step.outputPaths:
+                            os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+                        future = executor.submit(_timedStepResult, step.action, step.arguments)
+                        futureToStepAndDigestMap[future] = (step, digest)
+                if futureToStepAndDigestMap != {}:
+                    doneFutures, _ = concurrent.futures.wait(
+                        futureToStepAndDigestMap, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in doneFutures:
+                        step, digest = futureToStepAndDigestMap.pop(future)
+                        hasChanged, seconds = future.result()
+                        _log.info('finished in %.3f seconds: %s', seconds, step.name)
+                        if hasChanged:
+                            result += 1
+                        if step.isCached:
+                            for outputPath in step.outputPaths:
+                                buildCache.update(outputPath, digest, step.inputPaths)
+                        finish(step, seconds)
+        except BaseException:
+            for future in futureToStepAndDigestMap:
+                future.cancel()
+            raise
+
+    # The critical path is the longest chain of steps depending on each
+    # other; with enough workers it determines the wall time.
+    stepToCriticalSecondsMap = {}
+    for step in _sortedSteps(steps):
+        stepToCriticalSecondsMap[step] = stepToSecondsMap[step] + max(
+            [stepToCriticalSecondsMap[dependency] for dependency in step.dependencies] + [0.0])
+    _log.info('ran %d steps in %.3f seconds; critical path: %.3f seconds, sum of steps: %.3f seconds',
+        len(steps), time.perf_counter() - startTime, max(list(stepToCriticalSecondsMap.values()) + [0.0]),
+        sum(stepToSecondsMap.values()))
+    return result
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='build Firefall chatmaid mod')
+    parser.add_argument('--manifest', default=_ManifestPath, metavar='PATH',
+        help='JSON file describing what to build (default: %(default)s)')
+    parser.add_argument('--define', action='append', default=[], metavar='NAME=VALUE',
+        help='set a variable of the manifest, for example FirefallChatFolder, overriding the manifest and the '
+        'environment; can be specified multiple times')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, metavar='COUNT',
+        help='number of steps to run concurrently (default: %(default)s)')
+    parser.add_argument('--watch', action='store_true',
+        help='after building, keep rebuilding whenever a mod rules, include or source file changes')
+    parser.add_argument('--interval', type=float, default=0.05, metavar='SECONDS',
+        help='time between checks for changes with --watch (default: %(default)s)')
+    args = parser.parse_args(arguments)
+    definitions = {}
+    for definition in args.define:
+        name, separator, value = definition.partition('=')
+        if separator == '':
+            parser.error('--define must have the form NAME=VALUE: %s' % definition)
+        definitions[name] = value
 
-if __name__ == '__main__':
-    logging.basicConfig(level=logging.INFO)
     _log.info('build chatmaid v' + __version__)
-    os.makedirs(_buildFolder, exist_ok=True)
-    os.makedirs(_distFolder, exist_ok=True)
-    _possiblyBuildBackup(_ChatOptionsLuaPath)
-    _possiblyBuildBackup(_ChatLuaPath)
-    _buildModifiedLuaFiles()
-    _buildChatmaidZip()
+    _log.info('read manifest %s', args.manifest)
+    with open(args.manifest, 'r', encoding='utf-8') as manifestFile:
+        manifest = json.load(manifestFile)
+    variables = _manifestVariables(manifest, definitions)
+
+    def plannedSteps():
+        return _plannedSteps(manifest, variables)
+
+    buildCachePath = os.path.abspath(_expanded(manifest['cache'], variables))
+    os.makedirs(os.path.dirname(buildCachePath), exist_ok=True)
+    buildCache = _BuildCache(buildCachePath)
+    try:
+        _runSteps(plannedSteps(), buildCache, max(1, args.jobs))
+    finally:
+        buildCache.write()
     _logMelderButton()
-    _logLuaSmilies()
+    if args.watch:
+        _watch(plannedSteps, buildCache, args.interval)
     _log.info('finished')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
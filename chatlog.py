@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Sanitize archived chat logs the same way chatmaid.lua sanitizes messages in
+game, for example to tune the word lists using real conversations.
+
+Logs are JSONL files where each line holds an object with at least
+``channel`` and ``message``. The sanitized log holds the same objects with
+the additional keys ``sanitized`` (``null`` if chatmaid would hide the
+message) and ``action`` (``null`` if chatmaid would leave it untouched).
+"""
+import argparse
+import collections
+import itertools
+import json
+import logging
+import multiprocessing
+import re
+import sys
+
+_log = logging.getLogger('chatlog')
+
+# The following sets are also used for chatmaid.lua by generating
+# chatmaid_tables.lua from them with build_chatmaid.py.
+VALID_SINGLE_CHARACTERS = frozenset([
+    'k',  # ok
+    'n',  # no
+    'r',  # ready
+    'y',  # yes
+    '?',  # confused
+])
+
+COMMON_NON_ENGLISH_WORDS = frozenset([
+    # French
+    'alors', 'avoir', 'faire', 'merci', 'moi', 'nous', 'oui', 'pour', 'que', 'sans', 'tout', 'voir', 'vous',
+    # German
+    'aber', 'auch', 'dann', 'dein', 'deine', 'deiner', 'du', 'durch', 'ein', 'eine', 'einer', 'ich', 'ist',
+    'kann', 'kannst', 'mein', 'meine', 'meiner', 'musst', 'nicht', 'noch', 'sein', 'sind', 'und', 'wer',
+    'werden', 'wie', 'wird', 'wo',
+])
+
+GERMAN_UNICODES = frozenset([196, 214, 220, 223, 228, 246, 252])
+
+FRENCH_UNICODES = frozenset([156, 224, 226, 230, 231, 232, 233, 234, 235, 238, 239, 244, 249, 251, 255])
+
+CYRILLIC_UNICODE_RANGE = range(0x0400, 0x04ff + 1)
+
+THANKS = frozenset([
+    'danke', 'merci', 'thank you', 'thanks', 'thx', 'thx u', 'thx you', 'tnx', 'txh', 'ty',
+])
+
+# Settings used by Chat_mod.lua with the default options.
+DEFAULT_SETTINGS = {
+    'cleanMultiplePunctuation': True,
+    'cleanupWhitespace': True,
+    'hideCommonNonEnglish': False,
+    'hideCyrillic': True,
+    'hideFrench': False,
+    'hideGeDuNo': False,
+    'hideNonAscii': False,
+    'hideSingleCharacters': True,
+    'hideThanks': True,
+}
+
+# Map of non ASCII code points to the language GuessedLanguage() in
+# chatmaid.lua derives from them; all others are 'xx'.
+CODE_TO_LANGUAGE_MAP = {}
+CODE_TO_LANGUAGE_MAP.update((code, 'de') for code in GERMAN_UNICODES)
+CODE_TO_LANGUAGE_MAP.update((code, 'fr') for code in FRENCH_UNICODES)
+CODE_TO_LANGUAGE_MAP.update((code, 'ru') for code in CYRILLIC_UNICODE_RANGE)
+
+# Lua's "%s" only matches ASCII white space.
+_WHITESPACE_REGEX = re.compile('[ \t\n\v\f\r]+')
+_MULTIPLE_EXCLAMATION_MARKS_REGEX = re.compile('!+')
+_MULTIPLE_QUESTION_MARKS_REGEX = re.compile(r'\?+')
+_NON_ASCII_REGEX = re.compile('[^\x00-\x7f]')
+
+# Letters as defined by isLetter() in chatmaid.lua.
+_LETTERS = 'A-Za-z\x80-\U0010ffff'
+_LETTERED_WORD_REGEX = re.compile('[%s]+' % _LETTERS)
+_COMMON_NON_ENGLISH_WORD_REGEX = re.compile('(?<![%s])(?:%s)(?![%s])' % (
+    _LETTERS, '|'.join(sorted(COMMON_NON_ENGLISH_WORDS, key=lambda word: (-len(word), word))), _LETTERS))
+
+# Number of log lines each worker process sanitizes at once.
+_CHUNK_SIZE = 10000
+
+
+def cleanedWhitespace(text):
+    """
+    Similar to ``text`` but without leading, trailing and redundant white
+    space.
+    """
+    return _WHITESPACE_REGEX.sub(' ', text).strip(' ')
+
+
+def cleanedPunctuation(text):
+    """
+    Similar to ``text`` but without redundant exclamation and question marks.
+    """
+    return _MULTIPLE_QUESTION_MARKS_REGEX.sub('?', _MULTIPLE_EXCLAMATION_MARKS_REGEX.sub('!', text))
+
+
+def guessedLanguage(text):
+    """
+    A (cursory) guess for the language in which ``text`` is written based on
+    its first non ASCII character: 'ru', 'fr', 'de', 'xx' (unknown non
+    English language) or 'en'.
+    """
+    match = _NON_ASCII_REGEX.search(text)
+    if match is not None:
+        result = CODE_TO_LANGUAGE_MAP.get(ord(match.group()), 'xx')
+    else:
+        result = 'en'
+    return result
+
+
+def letteredWords(text):
+    """
+    Words in ``text`` consisting of letters only.
+    """
+    return _LETTERED_WORD_REGEX.findall(text)
+
+
+def sanitized(channel, text, settings):
+    """
+    Tuple ``(message, action)`` as returned by ``sanitized()`` in
+    chatmaid.lua for ``text`` sent to ``channel``. If the message should be
+    hidden, message is ``None``. If no action applies, action is ``None``.
+    """
+    assert channel is not None
+    assert text is not None
+    assert settings is not None
+
+    actions = []
+    isPublicChannel = channel in ('zone', 'local')
+
+    cleanedText = cleanedWhitespace(text)
+    if cleanedText == '':
+        return None, 'hide empty'
+    elif cleanedText != text:
+        actions.append('cleanup whitespace')
+
+    previousText = cleanedText
+    cleanedText = cleanedPunctuation(cleanedText)
+    if cleanedText != previousText:
+        actions.append('cleanup punctuation')
+
+    # Hide single characters; chatmaid.lua counts UTF-8 bytes, so non ASCII
+    # characters never are single characters.
+    if settings.get('hideSingleCharacters'):
+        isSingleCharacter = (len(cleanedText) == 1) and (cleanedText < '\x80')
+        isDigit = '0' <= cleanedText <= '9'
+        if isSingleCharacter and not isDigit and (cleanedText not in VALID_SINGLE_CHARACTERS):
+            return None, 'hide single character'
+
+    # Hide undesired alphabets.
+    if isPublicChannel:
+        language = guessedLanguage(cleanedText)
+        if settings.get('hideCyrillic') and (language == 'ru'):
+            return None, 'hide cyrillic'
+        elif settings.get('hideFrench') and (language == 'fr'):
+            return None, 'hide french'
+        elif settings.get('hideGeDuNo') and (language == 'de'):
+            return None, 'hide german/dutch/nordic'
+        elif settings.get('hideNonAscii') and (language != 'en'):
+            return None, 'hide non ascii'
+
+    if isPublicChannel and settings.get('hideCommonNonEnglish'):
+        if _COMMON_NON_ENGLISH_WORD_REGEX.search(cleanedText) is not None:
+            return None, 'hide common non english'
+
+    if (channel == 'zone') and settings.get('hideThanks') and (cleanedText in THANKS):
+        return None, 'hide thanks'
+
+    return cleanedText, '; '.join(actions) if actions != [] else None
+
+
+def _sanitizedLogLines(logLines, settings):
+    """
+    Tuple ``(sanitizedLogLines, actionToCountMap)`` for ``logLines`` where
+    each JSON line has the sanitized message and action added.
+    """
+    sanitizedLogLines = []
+    actionToCountMap = collections.Counter()
+    for logLine in logLines:
+        record = json.loads(logLine)
+        message, action = sanitized(record['channel'], record['message'], settings)
+        record['sanitized'] = message
+        record['action'] = action
+        sanitizedLogLines.append(json.dumps(record, ensure_ascii=False))
+        actionToCountMap[action] += 1
+    return sanitizedLogLines, actionToCountMap
+
+
+def _sanitizedLogChunk(logLinesAndSettings):
+    logLines, settings = logLinesAndSettings
+    return _sanitizedLogLines(logLines, settings)
+
+
+def _logLineChunks(logFile, chunkSize):
+    chunk = list(itertools.islice(logFile, chunkSize))
+    while chunk != []:
+        yield [logLine for logLine in chunk if logLine.strip() != '']
+        chunk = list(itertools.islice(logFile, chunkSize))
+
+
+def sanitizeLog(sourcePath, targetPath, settings=None, workers=1, chunkSize=_CHUNK_SIZE):
+    """
+    Write the sanitized JSONL log ``targetPath`` for ``sourcePath`` and
+    return a `collections.Counter` of the actions taken, where ``None``
+    counts the messages left untouched. With more than one
+    ``workers``, chunks of ``chunkSize`` lines are processed in parallel
+    processes; the target keeps the order of the source either way.
+    """
+    assert sourcePath is not None
+    assert targetPath is not None
+    assert workers >= 1
+    assert chunkSize >= 1
+
+    if settings is None:
+        settings = DEFAULT_SETTINGS
+    result = collections.Counter()
+    _log.info('sanitize "%s" to "%s"', sourcePath, targetPath)
+    with open(sourcePath, 'r', encoding='utf-8') as sourceFile:
+        with open(targetPath, 'w', encoding='utf-8') as targetFile:
+            chunks = ((chunk, settings) for chunk in _logLineChunks(sourceFile, chunkSize))
+            if workers == 1:
+                sanitizedChunks = map(_sanitizedLogChunk, chunks)
+                pool = None
+            else:
+                pool = multiprocessing.Pool(workers)
+                sanitizedChunks = pool.imap(_sanitizedLogChunk, chunks)
+            try:
+                for sanitizedLogLines, actionToCountMap in sanitizedChunks:
+                    for sanitizedLogLine in sanitizedLogLines:
+                        targetFile.write(sanitizedLogLine)
+                        targetFile.write('\n')
+                    result.update(actionToCountMap)
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+    _log.info('  sanitized %d messages', sum(result.values()))
+    return result
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='sanitize JSONL chat logs the same way chatmaid does')
+    parser.add_argument('--enable', action='append', default=[], metavar='SETTING', choices=sorted(DEFAULT_SETTINGS),
+        help='enable a setting, for example hideFrench; can be specified multiple times')
+    parser.add_argument('--disable', action='append', default=[], metavar='SETTING', choices=sorted(DEFAULT_SETTINGS),
+        help='disable a setting, for example hideThanks; can be specified multiple times')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), metavar='COUNT',
+        help='number of processes to sanitize with (default: %(default)s)')
+    parser.add_argument('source', help='JSONL log to sanitize')
+    parser.add_argument('target', help='JSONL log to write')
+    args = parser.parse_args(arguments)
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((setting, True) for setting in args.enable)
+    settings.update((setting, False) for setting in args.disable)
+    actionToCountMap = sanitizeLog(args.source, args.target, settings, max(1, args.workers))
+    for action, count in actionToCountMap.most_common():
+        print('%9d %s' % (count, action if action is not None else '(none)'))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -77,164 +77,37 @@ function trimmed(s)
     return s:match('^()%s*$') and '' or s:match('^%s*(.*%S)')
 end
 
--- Bitwise and operator for 8 bit. Lua 5.1 does not yet support bit32.band().
-function bit8and(a, b)
-    local result = 0
-    for i = 0, 7 do
-        if (a % 2)  + (b % 2) == 2 then
-            result = result + 2 ^ i
-        end
-        a = math.floor(a / 2)
-        b = math.floor(b / 2)
-    end
-    return result
-end
-
-local VALID_SINGLE_CHARACTERS = Set{
-    "k", -- ok
-    "n", -- no
-    "r", -- ready
-    "y", -- yes
-    "?", -- confused
-}
-
--- Common non english words using only basic latin alphabet for
--- hideCommonNonEnglish.
+-- Lookup tables generated by build_chatmaid.py as chatmaid_tables.lua, which
+-- has to be loaded before this file. To change the word lists, edit
+-- chatlog.py and rebuild.
 --
--- These words must not be "proper" English words too.
--- For example, the German "hat" (meaning "has") or "war" (meaning "was")
--- would be invalid because there is also an English word with the same
--- letters but a different meaning.
---
--- The languages on this list are derived from intuitively watching the zone
--- chat on eu-west servers and only includes languages that show up on a
--- regular base.
-local COMMON_NON_ENGLISH_WORDS = Set{
-    -- French; see also: http://french.about.com/od/vocabulary/ss/mostcommonwords.htm.
-    "alors",
-    "avoir",
-    "faire",
-    "merci",
-    "moi",
-    "nous",
-    "oui",
-    "pour",
-    "que",
-    "sans",
-    "tout",
-    "voir",
-    "vous",
--- German, see also: http://german.about.com/library/blwfreq_t50.htm.
-    "aber",
-    "auch",
-    "dann",
-    "dein",
-    "deine",
-    "deiner",
-    "du",
-    "durch",
-    "ein",
-    "eine",
-    "einer",
-    "ich",
-    "ist",
-    "kann",
-    "kannst",
-    "mein",
-    "meine",
-    "meiner",
-    "musst",
-    "nicht",
-    "noch",
-    "sein",
-    "sind",
-    "und",
-    "wer",
-    "werden",
-    "wie",
-    "wird",
-    "wo",
-}
-
--- Unicodes for to detect certain languages.
--- See also: http://en.wikipedia.org/wiki/ISO_basic_Latin_alphabet.
-local GERMAN_UNICODES = Set{
-    196, -- Ä
-    214, -- Ö
-    220, -- Ü
-    223, -- ß
-    228, -- ä
-    246, -- ö
-    252, -- ü
-}
-
-local FRENCH_UNICODES = Set{
-    156, -- œ
-    224, -- à
-    226, -- â
-    230, -- æ
-    231, -- ç
-    232, -- è
-    233, -- é
-    234, -- ê
-    235, -- ë
-    238, -- î
-    239, -- ï
-    244, -- ô
-    249, -- ù
-    251, -- û
-    -- 252, -- ü: excluded because it is used to detect German.
-    255, -- ÿ
-}
-
--- List of words to be considered thanks.
-local THANKS = Set{
-    "danke", -- German
-    "merci", -- French
-    "thank you",
-    "thanks",
-    "thx",
-    "thx u",
-    "thx you",
-    "tnx",
-    "txh", -- common typo
-    "ty",
-}
-
--- List of (integer) unicodes for characters found in UTF-8 encoded utf8text.
-local function unicodes(utf8text)
-    -- TODO: Convert this to an iterator.
-    local result = {}
-    local resultIndex = 1
-    local utf8textIndex = 1
-    while utf8textIndex <= utf8text:len() do
-        local code = utf8text:byte(utf8textIndex)
-        -- TODO: Remove: print(resultIndex..";"..utf8textIndex..":"..code)
-        if code >= 0xc0 then -- 110xxxxx
-            if code >= 0xfc then -- 1111110x
-                code = bit8and(code, 0x01)
-            elseif code >= 0xf8 then -- 111110xx
-                code = bit8and(code, 0x03)
-            elseif code >= 0xf0 then -- 11110xxx
-                code = bit8and(code, 0x07)
-            elseif code >= 0xe0 then -- 1110xxxx
-                code = bit8and(code, 0x0f)
-            else -- 110xxxxx
-                code = bit8and(code, 0x1f)
-            end
-            utf8textIndex = utf8textIndex + 1
-            while (utf8textIndex <= utf8text:len()) and (utf8text:byte(utf8textIndex) >= 0x80) and (utf8text:byte(utf8textIndex) < 0xc0) do -- 10000000 resp. 110xxxxx
-                -- TODO: Remove: print("  "..code.."*64 + "..bit8and(utf8text:byte(utf8textIndex), 0x3f).." ("..utf8text:byte(utf8textIndex)..")")
-                code = (code * 64) + bit8and(utf8text:byte(utf8textIndex), 0x3f) -- 00111111
-                -- TODO: Remove: print("  --> "..code)
-                utf8textIndex = utf8textIndex + 1
-            end
+-- Common non English words use only basic latin alphabet and must not be
+-- "proper" English words too. For example, the German "hat" (meaning "has")
+-- or "war" (meaning "was") would be invalid because there is also an English
+-- word with the same letters but a different meaning.
+local VALID_SINGLE_CHARACTERS = chatmaid_tables.VALID_SINGLE_CHARACTERS
+local COMMON_NON_ENGLISH_WORDS = chatmaid_tables.COMMON_NON_ENGLISH_WORDS
+local THANKS = chatmaid_tables.THANKS
+local LANGUAGES = chatmaid_tables.LANGUAGES
+local UTF8_SEQUENCE_LENGTHS = chatmaid_tables.UTF8_SEQUENCE_LENGTHS
+local UTF8_LEAD_VALUES = chatmaid_tables.UTF8_LEAD_VALUES
+
+-- The unicode of the UTF-8 sequence starting at index in utf8text and the
+-- index after it.
+local function decodedUnicode(utf8text, index)
+    local code = utf8text:byte(index)
+    local result = UTF8_LEAD_VALUES[code]
+    local lastIndex = index + UTF8_SEQUENCE_LENGTHS[code] - 1
+    index = index + 1
+    while index <= lastIndex do
+        code = utf8text:byte(index)
+        if (code == nil) or (code < 0x80) or (code >= 0xc0) then -- not 10xxxxxx
+            break
         end
-        result[resultIndex] = code
-        utf8textIndex = utf8textIndex + 1
-        resultIndex = resultIndex + 1
+        result = (result * 64) + code - 0x80
+        index = index + 1
     end
-    return result
+    return result, index
 end
 
 local function isAscii(code)
@@ -242,11 +115,6 @@ local function isAscii(code)
     return (code <= 0x7f)
 end
 
-local function isCyrillic(code)
-    -- True if code indicates a unicode for a Cyrillic letter.
-    return (code >= 0x0400) and (code <= 0x4ff)
-end
-
 local function isUpper(text)
     -- True if text is all upper case.
     --
@@ -354,27 +222,14 @@ function cleanedPunctuation(text)
 end
 
 function GuessedLanguage(utf8text)
-    -- A (cursory) guess for the language in which utf8text is written.
-    local result
-    local codes = unicodes(utf8text)
-    local codeIndex = 1
-    while (codeIndex <= #codes) and (result == nil) do
-        local code = codes[codeIndex]
-        if isCyrillic(code) then
-            result = "ru"
-        elseif FRENCH_UNICODES[code] ~= nil then
-            result = "fr"
-        elseif GERMAN_UNICODES[code] ~= nil then
-            result = "de"
-        elseif code >= 128 then
-            -- Unknown, non english language.
-            result = "xx"
-        else
-            codeIndex = codeIndex + 1
-        end
-    end
-    if result == nil then
-      result = "en"
+    -- A (cursory) guess for the language in which utf8text is written based
+    -- on its first non ASCII character.
+    local result = "en"
+    local nonAsciiIndex = utf8text:find("[\128-\255]")
+    if nonAsciiIndex ~= nil then
+        local code = decodedUnicode(utf8text, nonAsciiIndex)
+        -- Unknown non English languages result in "xx".
+        result = LANGUAGES[code] or "xx"
     end
     return result
 end
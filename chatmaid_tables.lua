@@ -0,0 +1,181 @@
+-- Lookup tables for chatmaid.lua.
+--
+-- Generated by build_chatmaid.py using the word lists in chatlog.py; do not
+-- edit.
+chatmaid_tables = {}
+
+-- Number of bytes in an UTF-8 sequence starting with a certain byte.
+chatmaid_tables.UTF8_SEQUENCE_LENGTHS = {
+    [0]=1, [1]=1, [2]=1, [3]=1, [4]=1, [5]=1, [6]=1, [7]=1, [8]=1, [9]=1,
+    [10]=1, [11]=1, [12]=1, [13]=1, [14]=1, [15]=1, [16]=1, [17]=1, [18]=1,
+    [19]=1, [20]=1, [21]=1, [22]=1, [23]=1, [24]=1, [25]=1, [26]=1, [27]=1,
+    [28]=1, [29]=1, [30]=1, [31]=1, [32]=1, [33]=1, [34]=1, [35]=1, [36]=1,
+    [37]=1, [38]=1, [39]=1, [40]=1, [41]=1, [42]=1, [43]=1, [44]=1, [45]=1,
+    [46]=1, [47]=1, [48]=1, [49]=1, [50]=1, [51]=1, [52]=1, [53]=1, [54]=1,
+    [55]=1, [56]=1, [57]=1, [58]=1, [59]=1, [60]=1, [61]=1, [62]=1, [63]=1,
+    [64]=1, [65]=1, [66]=1, [67]=1, [68]=1, [69]=1, [70]=1, [71]=1, [72]=1,
+    [73]=1, [74]=1, [75]=1, [76]=1, [77]=1, [78]=1, [79]=1, [80]=1, [81]=1,
+    [82]=1, [83]=1, [84]=1, [85]=1, [86]=1, [87]=1, [88]=1, [89]=1, [90]=1,
+    [91]=1, [92]=1, [93]=1, [94]=1, [95]=1, [96]=1, [97]=1, [98]=1, [99]=1,
+    [100]=1, [101]=1, [102]=1, [103]=1, [104]=1, [105]=1, [106]=1, [107]=1,
+    [108]=1, [109]=1, [110]=1, [111]=1, [112]=1, [113]=1, [114]=1, [115]=1,
+    [116]=1, [117]=1, [118]=1, [119]=1, [120]=1, [121]=1, [122]=1, [123]=1,
+    [124]=1, [125]=1, [126]=1, [127]=1, [128]=1, [129]=1, [130]=1, [131]=1,
+    [132]=1, [133]=1, [134]=1, [135]=1, [136]=1, [137]=1, [138]=1, [139]=1,
+    [140]=1, [141]=1, [142]=1, [143]=1, [144]=1, [145]=1, [146]=1, [147]=1,
+    [148]=1, [149]=1, [150]=1, [151]=1, [152]=1, [153]=1, [154]=1, [155]=1,
+    [156]=1, [157]=1, [158]=1, [159]=1, [160]=1, [161]=1, [162]=1, [163]=1,
+    [164]=1, [165]=1, [166]=1, [167]=1, [168]=1, [169]=1, [170]=1, [171]=1,
+    [172]=1, [173]=1, [174]=1, [175]=1, [176]=1, [177]=1, [178]=1, [179]=1,
+    [180]=1, [181]=1, [182]=1, [183]=1, [184]=1, [185]=1, [186]=1, [187]=1,
+    [188]=1, [189]=1, [190]=1, [191]=1, [192]=2, [193]=2, [194]=2, [195]=2,
+    [196]=2, [197]=2, [198]=2, [199]=2, [200]=2, [201]=2, [202]=2, [203]=2,
+    [204]=2, [205]=2, [206]=2, [207]=2, [208]=2, [209]=2, [210]=2, [211]=2,
+    [212]=2, [213]=2, [214]=2, [215]=2, [216]=2, [217]=2, [218]=2, [219]=2,
+    [220]=2, [221]=2, [222]=2, [223]=2, [224]=3, [225]=3, [226]=3, [227]=3,
+    [228]=3, [229]=3, [230]=3, [231]=3, [232]=3, [233]=3, [234]=3, [235]=3,
+    [236]=3, [237]=3, [238]=3, [239]=3, [240]=4, [241]=4, [242]=4, [243]=4,
+    [244]=4, [245]=4, [246]=4, [247]=4, [248]=5, [249]=5, [250]=5, [251]=5,
+    [252]=6, [253]=6, [254]=6, [255]=6,
+}
+
+-- Bits of the first byte of an UTF-8 sequence that are part of the unicode.
+chatmaid_tables.UTF8_LEAD_VALUES = {
+    [0]=0, [1]=1, [2]=2, [3]=3, [4]=4, [5]=5, [6]=6, [7]=7, [8]=8, [9]=9,
+    [10]=10, [11]=11, [12]=12, [13]=13, [14]=14, [15]=15, [16]=16, [17]=17,
+    [18]=18, [19]=19, [20]=20, [21]=21, [22]=22, [23]=23, [24]=24, [25]=25,
+    [26]=26, [27]=27, [28]=28, [29]=29, [30]=30, [31]=31, [32]=32, [33]=33,
+    [34]=34, [35]=35, [36]=36, [37]=37, [38]=38, [39]=39, [40]=40, [41]=41,
+    [42]=42, [43]=43, [44]=44, [45]=45, [46]=46, [47]=47, [48]=48, [49]=49,
+    [50]=50, [51]=51, [52]=52, [53]=53, [54]=54, [55]=55, [56]=56, [57]=57,
+    [58]=58, [59]=59, [60]=60, [61]=61, [62]=62, [63]=63, [64]=64, [65]=65,
+    [66]=66, [67]=67, [68]=68, [69]=69, [70]=70, [71]=71, [72]=72, [73]=73,
+    [74]=74, [75]=75, [76]=76, [77]=77, [78]=78, [79]=79, [80]=80, [81]=81,
+    [82]=82, [83]=83, [84]=84, [85]=85, [86]=86, [87]=87, [88]=88, [89]=89,
+    [90]=90, [91]=91, [92]=92, [93]=93, [94]=94, [95]=95, [96]=96, [97]=97,
+    [98]=98, [99]=99, [100]=100, [101]=101, [102]=102, [103]=103, [104]=104,
+    [105]=105, [106]=106, [107]=107, [108]=108, [109]=109, [110]=110,
+    [111]=111, [112]=112, [113]=113, [114]=114, [115]=115, [116]=116,
+    [117]=117, [118]=118, [119]=119, [120]=120, [121]=121, [122]=122,
+    [123]=123, [124]=124, [125]=125, [126]=126, [127]=127, [128]=128,
+    [129]=129, [130]=130, [131]=131, [132]=132, [133]=133, [134]=134,
+    [135]=135, [136]=136, [137]=137, [138]=138, [139]=139, [140]=140,
+    [141]=141, [142]=142, [143]=143, [144]=144, [145]=145, [146]=146,
+    [147]=147, [148]=148, [149]=149, [150]=150, [151]=151, [152]=152,
+    [153]=153, [154]=154, [155]=155, [156]=156, [157]=157, [158]=158,
+    [159]=159, [160]=160, [161]=161, [162]=162, [163]=163, [164]=164,
+    [165]=165, [166]=166, [167]=167, [168]=168, [169]=169, [170]=170,
+    [171]=171, [172]=172, [173]=173, [174]=174, [175]=175, [176]=176,
+    [177]=177, [178]=178, [179]=179, [180]=180, [181]=181, [182]=182,
+    [183]=183, [184]=184, [185]=185, [186]=186, [187]=187, [188]=188,
+    [189]=189, [190]=190, [191]=191, [192]=0, [193]=1, [194]=2, [195]=3,
+    [196]=4, [197]=5, [198]=6, [199]=7, [200]=8, [201]=9, [202]=10, [203]=11,
+    [204]=12, [205]=13, [206]=14, [207]=15, [208]=16, [209]=17, [210]=18,
+    [211]=19, [212]=20, [213]=21, [214]=22, [215]=23, [216]=24, [217]=25,
+    [218]=26, [219]=27, [220]=28, [221]=29, [222]=30, [223]=31, [224]=0,
+    [225]=1, [226]=2, [227]=3, [228]=4, [229]=5, [230]=6, [231]=7, [232]=8,
+    [233]=9, [234]=10, [235]=11, [236]=12, [237]=13, [238]=14, [239]=15,
+    [240]=0, [241]=1, [242]=2, [243]=3, [244]=4, [245]=5, [246]=6, [247]=7,
+    [248]=0, [249]=1, [250]=2, [251]=3, [252]=0, [253]=1, [254]=0, [255]=1,
+}
+
+-- Language indicated by unicodes of non ASCII letters; other non ASCII unicodes indicate "xx".
+chatmaid_tables.LANGUAGES = {
+    [156]="fr", [196]="de", [214]="de", [220]="de", [223]="de", [224]="fr",
+    [226]="fr", [228]="de", [230]="fr", [231]="fr", [232]="fr", [233]="fr",
+    [234]="fr", [235]="fr", [238]="fr", [239]="fr", [244]="fr", [246]="de",
+    [249]="fr", [251]="fr", [252]="de", [255]="fr", [1024]="ru", [1025]="ru",
+    [1026]="ru", [1027]="ru", [1028]="ru", [1029]="ru", [1030]="ru",
+    [1031]="ru", [1032]="ru", [1033]="ru", [1034]="ru", [1035]="ru",
+    [1036]="ru", [1037]="ru", [1038]="ru", [1039]="ru", [1040]="ru",
+    [1041]="ru", [1042]="ru", [1043]="ru", [1044]="ru", [1045]="ru",
+    [1046]="ru", [1047]="ru", [1048]="ru", [1049]="ru", [1050]="ru",
+    [1051]="ru", [1052]="ru", [1053]="ru", [1054]="ru", [1055]="ru",
+    [1056]="ru", [1057]="ru", [1058]="ru", [1059]="ru", [1060]="ru",
+    [1061]="ru", [1062]="ru", [1063]="ru", [1064]="ru", [1065]="ru",
+    [1066]="ru", [1067]="ru", [1068]="ru", [1069]="ru", [1070]="ru",
+    [1071]="ru", [1072]="ru", [1073]="ru", [1074]="ru", [1075]="ru",
+    [1076]="ru", [1077]="ru", [1078]="ru", [1079]="ru", [1080]="ru",
+    [1081]="ru", [1082]="ru", [1083]="ru", [1084]="ru", [1085]="ru",
+    [1086]="ru", [1087]="ru", [1088]="ru", [1089]="ru", [1090]="ru",
+    [1091]="ru", [1092]="ru", [1093]="ru", [1094]="ru", [1095]="ru",
+    [1096]="ru", [1097]="ru", [1098]="ru", [1099]="ru", [1100]="ru",
+    [1101]="ru", [1102]="ru", [1103]="ru", [1104]="ru", [1105]="ru",
+    [1106]="ru", [1107]="ru", [1108]="ru", [1109]="ru", [1110]="ru",
+    [1111]="ru", [1112]="ru", [1113]="ru", [1114]="ru", [1115]="ru",
+    [1116]="ru", [1117]="ru", [1118]="ru", [1119]="ru", [1120]="ru",
+    [1121]="ru", [1122]="ru", [1123]="ru", [1124]="ru", [1125]="ru",
+    [1126]="ru", [1127]="ru", [1128]="ru", [1129]="ru", [1130]="ru",
+    [1131]="ru", [1132]="ru", [1133]="ru", [1134]="ru", [1135]="ru",
+    [1136]="ru", [1137]="ru", [1138]="ru", [1139]="ru", [1140]="ru",
+    [1141]="ru", [1142]="ru", [1143]="ru", [1144]="ru", [1145]="ru",
+    [1146]="ru", [1147]="ru", [1148]="ru", [1149]="ru", [1150]="ru",
+    [1151]="ru", [1152]="ru", [1153]="ru", [1154]="ru", [1155]="ru",
+    [1156]="ru", [1157]="ru", [1158]="ru", [1159]="ru", [1160]="ru",
+    [1161]="ru", [1162]="ru", [1163]="ru", [1164]="ru", [1165]="ru",
+    [1166]="ru", [1167]="ru", [1168]="ru", [1169]="ru", [1170]="ru",
+    [1171]="ru", [1172]="ru", [1173]="ru", [1174]="ru", [1175]="ru",
+    [1176]="ru", [1177]="ru", [1178]="ru", [1179]="ru", [1180]="ru",
+    [1181]="ru", [1182]="ru", [1183]="ru", [1184]="ru", [1185]="ru",
+    [1186]="ru", [1187]="ru", [1188]="ru", [1189]="ru", [1190]="ru",
+    [1191]="ru", [1192]="ru", [1193]="ru", [1194]="ru", [1195]="ru",
+    [1196]="ru", [1197]="ru", [1198]="ru", [1199]="ru", [1200]="ru",
+    [1201]="ru", [1202]="ru", [1203]="ru", [1204]="ru", [1205]="ru",
+    [1206]="ru", [1207]="ru", [1208]="ru", [1209]="ru", [1210]="ru",
+    [1211]="ru", [1212]="ru", [1213]="ru", [1214]="ru", [1215]="ru",
+    [1216]="ru", [1217]="ru", [1218]="ru", [1219]="ru", [1220]="ru",
+    [1221]="ru", [1222]="ru", [1223]="ru", [1224]="ru", [1225]="ru",
+    [1226]="ru", [1227]="ru", [1228]="ru", [1229]="ru", [1230]="ru",
+    [1231]="ru", [1232]="ru", [1233]="ru", [1234]="ru", [1235]="ru",
+    [1236]="ru", [1237]="ru", [1238]="ru", [1239]="ru", [1240]="ru",
+    [1241]="ru", [1242]="ru", [1243]="ru", [1244]="ru", [1245]="ru",
+    [1246]="ru", [1247]="ru", [1248]="ru", [1249]="ru", [1250]="ru",
+    [1251]="ru", [1252]="ru", [1253]="ru", [1254]="ru", [1255]="ru",
+    [1256]="ru", [1257]="ru", [1258]="ru", [1259]="ru", [1260]="ru",
+    [1261]="ru", [1262]="ru", [1263]="ru", [1264]="ru", [1265]="ru",
+    [1266]="ru", [1267]="ru", [1268]="ru", [1269]="ru", [1270]="ru",
+    [1271]="ru", [1272]="ru", [1273]="ru", [1274]="ru", [1275]="ru",
+    [1276]="ru", [1277]="ru", [1278]="ru", [1279]="ru",
+}
+
+-- Single characters that are valid messages.
+chatmaid_tables.VALID_SINGLE_CHARACTERS = {
+    ["?"]=true, ["k"]=true, ["n"]=true, ["r"]=true, ["y"]=true,
+}
+
+-- Common non English words using only basic latin alphabet.
+chatmaid_tables.COMMON_NON_ENGLISH_WORDS = {
+    ["aber"]=true, ["alors"]=true, ["auch"]=true, ["avoir"]=true,
+    ["dann"]=true, ["dein"]=true, ["deine"]=true, ["deiner"]=true,
+    ["du"]=true, ["durch"]=true, ["ein"]=true, ["eine"]=true, ["einer"]=true,
+    ["faire"]=true, ["ich"]=true, ["ist"]=true, ["kann"]=true,
+    ["kannst"]=true, ["mein"]=true, ["meine"]=true, ["meiner"]=true,
+    ["merci"]=true, ["moi"]=true, ["musst"]=true, ["nicht"]=true,
+    ["noch"]=true, ["nous"]=true, ["oui"]=true, ["pour"]=true, ["que"]=true,
+    ["sans"]=true, ["sein"]=true, ["sind"]=true, ["tout"]=true, ["und"]=true,
+    ["voir"]=true, ["vous"]=true, ["wer"]=true, ["werden"]=true, ["wie"]=true,
+    ["wird"]=true, ["wo"]=true,
+}
+
+-- Messages to be considered thanks.
+chatmaid_tables.THANKS = {
+    ["danke"]=true, ["merci"]=true, ["thank you"]=true, ["thanks"]=true,
+    ["thx"]=true, ["thx u"]=true, ["thx you"]=true, ["tnx"]=true,
+    ["txh"]=true, ["ty"]=true,
+}
+
+-- Smilies.
+chatmaid_tables.SMILIES = {
+    ["8-("]=true, ["8-)"]=true, ["8-D"]=true, ["8-P"]=true, ["8^("]=true,
+    ["8^)"]=true, ["8^D"]=true, ["8^P"]=true, ["8o("]=true, ["8o)"]=true,
+    ["8oD"]=true, ["8oP"]=true, [":-("]=true, [":-)"]=true, [":-D"]=true,
+    [":-P"]=true, [":^("]=true, [":^)"]=true, [":^D"]=true, [":^P"]=true,
+    [":o("]=true, [":o)"]=true, [":oD"]=true, [":oP"]=true, [";-("]=true,
+    [";-)"]=true, [";-D"]=true, [";-P"]=true, [";^("]=true, [";^)"]=true,
+    [";^D"]=true, [";^P"]=true, [";o("]=true, [";o)"]=true, [";oD"]=true,
+    [";oP"]=true, ["B-("]=true, ["B-)"]=true, ["B-D"]=true, ["B-P"]=true,
+    ["B^("]=true, ["B^)"]=true, ["B^D"]=true, ["B^P"]=true, ["Bo("]=true,
+    ["Bo)"]=true, ["BoD"]=true, ["BoP"]=true, ["X-("]=true, ["X-)"]=true,
+    ["X-D"]=true, ["X-P"]=true, ["X^("]=true, ["X^)"]=true, ["X^D"]=true,
+    ["X^P"]=true, ["Xo("]=true, ["Xo)"]=true, ["XoD"]=true, ["XoP"]=true,
+}
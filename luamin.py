@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Minify Lua code to reduce the amount of code the Firefall client has to load
+and parse, for example for the files chatmaid inserts into ``Chat.lua``.
+
+Minifying removes comments and blank lines and compacts white space. License
+notices, which are the leading comments of a file up to the last paragraph
+mentioning a copyright or license, are kept once. Tree shaking additionally
+removes top level functions nothing refers to.
+
+Lines are never joined, so each remaining line keeps its original line
+number, which serves as source map to find the original location of errors.
+"""
+import argparse
+import bisect
+import json
+import logging
+import re
+import sys
+
+_log = logging.getLogger('luamin')
+
+# Token types returned by `_tokens()`.
+_COMMENT = 'comment'
+_NAME = 'name'
+_NUMBER = 'number'
+_OP = 'op'
+_STRING = 'string'
+
+_TOKEN_REGEX = re.compile(r"""
+    (?P<space>[ \t\r\n\f\v]+)
+    |(?P<comment>--\[(?P<commentLevel>=*)\[.*?\](?P=commentLevel)\]|--[^\n]*)
+    |(?P<string>\[(?P<stringLevel>=*)\[.*?\](?P=stringLevel)\]|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    |(?P<number>0[xX][0-9A-Fa-f.]*(?:[pP][+-]?[0-9]+)?|(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<op>\.\.\.|\.\.|==|~=|<=|>=|::|//|<<|>>|[-+*/%^\#&~|<>=(){}\[\];:,.])
+    """, re.VERBOSE | re.DOTALL)
+
+# Starts of long brackets and strings, which are errors unless they are
+# matched completely by _TOKEN_REGEX.
+_UNFINISHED_REGEX = re.compile(r'--\[=*\[|\[=*\[|["\']')
+_LONG_BRACKETS_REGEX = re.compile(r'(?:--)?\[(=*)\[.*\]\1\]$', re.DOTALL)
+
+_NAME_REGEX = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+_WORD_CHARACTERS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_')
+
+_KEYWORDS = frozenset([
+    'and', 'break', 'do', 'else', 'elseif', 'end', 'false', 'for', 'function', 'goto', 'if', 'in', 'local',
+    'nil', 'not', 'or', 'repeat', 'return', 'then', 'true', 'until', 'while',
+])
+
+# Keywords that open and close blocks; "while" and "for" are covered by
+# their "do".
+_BLOCK_OPENERS = frozenset(['do', 'function', 'if', 'repeat'])
+_BLOCK_CLOSERS = frozenset(['end', 'until'])
+
+_LICENSE_REGEX = re.compile(r'copyright|license', re.IGNORECASE)
+
+
+class LuaError(ValueError):
+    """
+    Error in Lua code that prevents minifying it, where ``lineNumber`` is
+    the original line number of the text line the error occurred in and
+    ``blockIndex`` the index of the block passed to `minifiedBlocks()`.
+    """
+    def __init__(self, lineNumber, message):
+        assert lineNumber >= 0
+        assert message is not None
+
+        self.lineNumber = lineNumber
+        self.message = message
+        self.blockIndex = None
+
+    def __str__(self):
+        return '%d: %s' % (self.lineNumber, self.message)
+
+
+class _Token(object):
+    def __init__(self, type, text, lineIndex, lineNumber):
+        self.type = type
+        self.text = text
+        self.lineIndex = lineIndex
+        self.lineNumber = lineNumber
+
+    def __repr__(self):
+        return '%s(%r, %r, %d, %d)' % (self.__class__.__name__, self.type, self.text, self.lineIndex, self.lineNumber)
+
+
+def _tokens(lines, lineNumbers):
+    """
+    List of the `_Token`s in ``lines`` except white space, where
+    ``lineIndex`` refers to the line in ``lines`` the token starts in and
+    ``lineNumber`` to the respective item of ``lineNumbers``.
+    """
+    text = '\n'.join(lines)
+    lineStartOffsets = [0]
+    for line in lines[:-1]:
+        lineStartOffsets.append(lineStartOffsets[-1] + len(line) + 1)
+    result = []
+    offset = 0
+    while offset < len(text):
+        match = _TOKEN_REGEX.match(text, offset)
+        lineIndex = bisect.bisect_right(lineStartOffsets, offset) - 1
+        isUnfinished = (match is None) or (
+            (match.lastgroup in (_COMMENT, _OP))
+            and (_UNFINISHED_REGEX.match(text, offset) is not None)
+            and (_LONG_BRACKETS_REGEX.match(match.group()) is None))
+        if isUnfinished:
+            raise LuaError(lineNumbers[lineIndex], 'cannot process unfinished string or unknown character: %r' % (
+                text[offset:offset + 10]))
+        if match.lastgroup != 'space':
+            result.append(_Token(match.lastgroup, match.group(), lineIndex, lineNumbers[lineIndex]))
+        offset = match.end()
+    return result
+
+
+def _isSeparated(previousToken, token):
+    """
+    ``True`` if ``token`` has to be separated from ``previousToken`` by a
+    space because otherwise they would be read as different tokens.
+    """
+    if (previousToken.text[-1] in _WORD_CHARACTERS) and (token.text[0] in _WORD_CHARACTERS):
+        result = True
+    elif previousToken.type == _NUMBER:
+        # Lua reads numbers greedily, so "1..x" would be a malformed number.
+        result = token.text[0] == '.'
+    elif previousToken.type == _OP:
+        match = _TOKEN_REGEX.match(previousToken.text + token.text)
+        result = (match.lastgroup != _OP) or (match.end() != len(previousToken.text))
+    else:
+        result = False
+    return result
+
+
+def _licenseLineCount(tokens):
+    """
+    Number of leading lines forming the license notice, which consists of
+    the paragraphs of comments before the first code up to the last one
+    mentioning a copyright or license.
+    """
+    result = 0
+    paragraphEndLineIndex = None
+    paragraphMentionsLicense = False
+    for token in tokens:
+        if token.type != _COMMENT:
+            break
+        if (paragraphEndLineIndex is not None) and (token.lineIndex > paragraphEndLineIndex):
+            # A blank line ends the paragraph.
+            if paragraphMentionsLicense:
+                result = paragraphEndLineIndex
+            paragraphMentionsLicense = False
+        paragraphMentionsLicense = paragraphMentionsLicense or (_LICENSE_REGEX.search(token.text) is not None)
+        paragraphEndLineIndex = token.lineIndex + token.text.count('\n') + 1
+    if paragraphMentionsLicense:
+        result = paragraphEndLineIndex
+    return result
+
+
+def _functionDefinitions(tokens):
+    """
+    List of ``(name, firstTokenIndex, endTokenIndex)`` for the top level
+    functions defined as ``function name()`` or ``local function name()``
+    in ``tokens``, where ``endTokenIndex`` is the index after their "end".
+    """
+    result = []
+    depth = 0
+    definition = None
+    for tokenIndex, token in enumerate(tokens):
+        if token.type == _NAME:
+            if (depth == 0) and (token.text == 'function'):
+                nextToken = tokens[tokenIndex + 1] if tokenIndex + 1 < len(tokens) else None
+                tokenAfterNext = tokens[tokenIndex + 2] if tokenIndex + 2 < len(tokens) else None
+                isNamed = (nextToken is not None) and (nextToken.type == _NAME) and (nextToken.text not in _KEYWORDS)
+                isPlainName = isNamed and (tokenAfterNext is not None) and (tokenAfterNext.text == '(')
+                isLocal = (tokenIndex >= 1) and (tokens[tokenIndex - 1].text == 'local')
+                if isPlainName:
+                    definition = (nextToken.text, tokenIndex - 1 if isLocal else tokenIndex)
+            if token.text in _BLOCK_OPENERS:
+                depth += 1
+            elif token.text in _BLOCK_CLOSERS:
+                if depth == 0:
+                    raise LuaError(token.lineNumber, '"%s" must match an open block' % token.text)
+                depth -= 1
+                if (depth == 0) and (definition is not None):
+                    name, firstTokenIndex = definition
+                    result.append((name, firstTokenIndex, tokenIndex + 1))
+                    definition = None
+    return result
+
+
+def _referencedNames(tokens):
+    """
+    Names referred to by ``tokens`` except keywords and fields accessed
+    using "." or ":".
+    """
+    result = set()
+    previousToken = None
+    for token in tokens:
+        if (token.type == _NAME) and (token.text not in _KEYWORDS):
+            if (previousToken is None) or (previousToken.text not in ('.', ':')):
+                result.add(token.text)
+        previousToken = token
+    return result
+
+
+def mentionedNames(lines):
+    """
+    Set of all words in ``lines`` that could be Lua names, including those
+    in comments and strings. This is a conservative estimate of the names
+    code that is not minified might refer to.
+    """
+    result = set()
+    for line in lines:
+        result.update(_NAME_REGEX.findall(line))
+    return result
+
+
+def _shakenTokenLists(tokenLists, definitionsList, rootNames):
+    """
+    Same as ``tokenLists`` but without the top level functions that are
+    neither referred to by ``rootNames``, by other top level code nor by
+    functions referred to themselves, where ``definitionsList`` holds the
+    `_functionDefinitions()` of each list of tokens.
+    """
+    nameToReferencedNamesMap = {}
+    reachableNames = set(rootNames)
+    for tokens, definitions in zip(tokenLists, definitionsList):
+        definedTokenIndices = set()
+        for name, firstTokenIndex, endTokenIndex in definitions:
+            # Recursive calls do not keep a function.
+            referencedNames = _referencedNames(tokens[firstTokenIndex:endTokenIndex]) - {name}
+            nameToReferencedNamesMap.setdefault(name, set()).update(referencedNames)
+            definedTokenIndices.update(range(firstTokenIndex, endTokenIndex))
+        topLevelTokens = [token for tokenIndex, token in enumerate(tokens) if tokenIndex not in definedTokenIndices]
+        reachableNames.update(_referencedNames(topLevelTokens))
+
+    namesToVisit = list(reachableNames)
+    while namesToVisit != []:
+        name = namesToVisit.pop()
+        for referencedName in nameToReferencedNamesMap.get(name, ()):
+            if referencedName not in reachableNames:
+                reachableNames.add(referencedName)
+                namesToVisit.append(referencedName)
+
+    result = []
+    for tokens, definitions in zip(tokenLists, definitionsList):
+        removedTokenIndices = set()
+        for name, firstTokenIndex, endTokenIndex in definitions:
+            if name not in reachableNames:
+                _log.info('  remove unreferenced function %s', name)
+                removedTokenIndices.update(range(firstTokenIndex, endTokenIndex))
+        result.append([token for tokenIndex, token in enumerate(tokens) if tokenIndex not in removedTokenIndices])
+    return result
+
+
+def _minifiedLines(tokens, lineNumbers):
+    """
+    ``(lineNumber, line)`` tuples for ``tokens`` without comments, where
+    each line consists of the tokens starting in the same original line.
+    """
+    result = []
+    lineIndex = None
+    lineParts = []
+    previousToken = None
+
+    def appendLines():
+        # Tokens spanning several lines continue in the following lines.
+        for partLineIndex, line in enumerate(''.join(lineParts).split('\n')):
+            result.append((lineNumbers[lineIndex + partLineIndex], line))
+
+    for token in tokens:
+        if token.type != _COMMENT:
+            if token.lineIndex != lineIndex:
+                if lineParts != []:
+                    appendLines()
+                lineIndex = token.lineIndex
+                lineParts = []
+            elif _isSeparated(previousToken, token):
+                lineParts.append(' ')
+            lineParts.append(token.text)
+            previousToken = token
+    if lineParts != []:
+        appendLines()
+    return result
+
+
+def minifiedBlocks(blocks, rootNames=None):
+    """
+    List of minified blocks for ``blocks``, each of which is a sequence of
+    ``(lineNumber, line)`` tuples of a Lua file, for example as included by
+    modtext. The resulting lines keep the line numbers of the lines they
+    stem from.
+
+    License notices are kept unless the same notice has already been kept
+    for a previous block. If ``rootNames`` is specified, top level
+    functions none of these names, the top level code or other kept
+    functions refer to are removed, considering all blocks together.
+    """
+    assert blocks is not None
+
+    tokenLists = []
+    lineNumbersList = []
+    definitionsList = []
+    for blockIndex, block in enumerate(blocks):
+        lines = [line for _, line in block]
+        lineNumbers = [lineNumber for lineNumber, _ in block]
+        try:
+            tokens = _tokens(lines, lineNumbers) if lines != [] else []
+            definitionsList.append(_functionDefinitions(tokens) if rootNames is not None else [])
+        except LuaError as error:
+            error.blockIndex = blockIndex
+            raise
+        tokenLists.append(tokens)
+        lineNumbersList.append(lineNumbers)
+    licenseLineCounts = [_licenseLineCount(tokens) for tokens in tokenLists]
+    if rootNames is not None:
+        tokenLists = _shakenTokenLists(tokenLists, definitionsList, rootNames)
+    result = []
+    keptLicenses = set()
+    for block, tokens, lineNumbers, licenseLineCount in zip(blocks, tokenLists, lineNumbersList, licenseLineCounts):
+        licenseLines = tuple(block[:licenseLineCount])
+        licenseText = '\n'.join(line for _, line in licenseLines)
+        if (licenseLines != ()) and (licenseText not in keptLicenses):
+            keptLicenses.add(licenseText)
+            minifiedBlock = list(licenseLines)
+        else:
+            minifiedBlock = []
+        minifiedBlock.extend(_minifiedLines(tokens, lineNumbers))
+        result.append(minifiedBlock)
+    return result
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='minify Lua code while keeping the original line numbers')
+    parser.add_argument('--shake', action='store_true',
+        help='remove top level functions the top level code and --keep functions do not refer to')
+    parser.add_argument('--keep', action='append', default=[], metavar='NAME',
+        help='name of a function to keep when shaking, for example one called from other files; '
+        'can be specified multiple times')
+    parser.add_argument('--map', metavar='PATH',
+        help='JSON file to write the original line number of each minified line to')
+    parser.add_argument('source', help='Lua file to minify')
+    parser.add_argument('target', help='minified Lua file to write')
+    args = parser.parse_args(arguments)
+
+    with open(args.source, 'r', encoding='utf-8') as sourceFile:
+        block = [(lineNumber, line.rstrip('\n\r')) for lineNumber, line in enumerate(sourceFile)]
+    try:
+        minifiedBlock = minifiedBlocks([block], args.keep if args.shake else None)[0]
+    except LuaError as error:
+        _log.error('%s:%d: %s', args.source, error.lineNumber + 1, error.message)
+        minifiedBlock = None
+    if minifiedBlock is not None:
+        _log.info('write %d of %d lines to "%s"', len(minifiedBlock), len(block), args.target)
+        with open(args.target, 'w', encoding='utf-8') as targetFile:
+            for _, line in minifiedBlock:
+                targetFile.write(line)
+                targetFile.write('\n')
+        if args.map is not None:
+            with open(args.map, 'w', encoding='utf-8') as mapFile:
+                json.dump([lineNumber + 1 for lineNumber, _ in minifiedBlock], mapFile)
+        result = 0
+    else:
+        result = 1
+    return result
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Serve modtext to other tools using JSON-RPC 2.0 so they can apply mod rules
+without paying for Python startup, parsing the rules and indexing the
+sources on each call.
+
+Requests and responses are JSON objects, one per line, exchanged either via
+stdin and stdout or via a local Unix socket. Parsed rules and indexed
+sources are kept in a cache that evicts the least recently used entries
+once their estimated size exceeds a limit. Entries whose files changed are
+reloaded automatically.
+
+Methods:
+
+* ``apply`` with the params ``rules``, ``source`` and ``target`` and the
+  optional ``mapped`` and ``report``, which results in
+  ``{"hasTargetChanged": ..., "seconds": ...}`` and possibly ``"report"``.
+* ``stats`` results in the number of cache entries, their estimated size,
+  hits, misses and evictions, and the same for the files cached for
+  ``@include`` as ``includes``.
+* ``shutdown`` stops the server.
+
+Relative paths, including those of ``@include``, are relative to the
+current folder of the server.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import modtext
+
+_log = logging.getLogger('modserve')
+
+_DEFAULT_CACHE_MEGABYTES = 256
+
+# Parsed rules take roughly this many times the size of their files.
+_RULES_SIZE_FACTOR = 4
+
+# Error codes defined by JSON-RPC 2.0.
+_PARSE_ERROR = -32700
+_INVALID_REQUEST = -32600
+_METHOD_NOT_FOUND = -32601
+_INVALID_PARAMS = -32602
+_INTERNAL_ERROR = -32603
+
+# Error codes for errors while applying rules.
+_MOD_ERROR = 1
+_ENVIRONMENT_ERROR = 2
+
+
+class _InvalidParamsError(ValueError):
+    pass
+
+
+def _fileStats(paths):
+    """
+    Tuple of ``(path, modificationTime, size)`` for each of ``paths``,
+    where missing files have ``None`` as time and size.
+    """
+    result = []
+    for path in paths:
+        try:
+            pathStat = os.stat(path)
+            result.append((path, pathStat.st_mtime_ns, pathStat.st_size))
+        except FileNotFoundError:
+            result.append((path, None, None))
+    return tuple(result)
+
+
+class _CacheEntry(object):
+    """
+    Cached ``value`` taking about ``size`` bytes that remains current as
+    long as the files described by ``fileStats`` do not change.
+    """
+    def __init__(self, value, size, fileStats):
+        assert size >= 0
+        assert fileStats is not None
+
+        self.value = value
+        self.size = size
+        self.fileStats = fileStats
+
+    def isCurrent(self):
+        return _fileStats(path for path, _, _ in self.fileStats) == self.fileStats
+
+
+class LruCache(object):
+    """
+    Cache of entries with an estimated size in bytes that evicts the least
+    recently used entries once their total size exceeds ``maxSize``. The
+    most recently added entry is always kept, even if it alone exceeds
+    ``maxSize``. Entries whose files changed are dropped on access.
+    """
+    def __init__(self, maxSize):
+        assert maxSize >= 0
+
+        self.maxSize = maxSize
+        self.size = 0
+        self.hitCount = 0
+        self.missCount = 0
+        self.evictionCount = 0
+        self._keyToEntryMap = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keyToEntryMap)
+
+    def get(self, key):
+        """
+        The value cached for ``key`` or ``None`` if there is none or its
+        files changed.
+        """
+        with self._lock:
+            entry = self._keyToEntryMap.get(key)
+            if (entry is not None) and not entry.isCurrent():
+                _log.info('reload changed %s', key)
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._keyToEntryMap.move_to_end(key)
+                self.hitCount += 1
+                result = entry.value
+            else:
+                self.missCount += 1
+                result = None
+        return result
+
+    def put(self, key, value, size, fileStats):
+        with self._lock:
+            if key in self._keyToEntryMap:
+                self._remove(key)
+            self._keyToEntryMap[key] = _CacheEntry(value, size, fileStats)
+            self.size += size
+            while (self.size > self.maxSize) and (len(self._keyToEntryMap) > 1):
+                evictedKey = next(iter(self._keyToEntryMap))
+                _log.info('evict %s', evictedKey)
+                self._remove(evictedKey)
+                self.evictionCount += 1
+
+    def _remove(self, key):
+        self.size -= self._keyToEntryMap.pop(key).size
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'size': self.size,
+            'maxSize': self.maxSize,
+            'hits': self.hitCount,
+            'misses': self.missCount,
+            'evictions': self.evictionCount,
+        }
+
+
+def _rulesSize(rulesPath, includedPaths):
+    result = 0
+    for path in [rulesPath] + list(includedPaths):
+        try:
+            result += os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+    return result * _RULES_SIZE_FACTOR
+
+
+def _sourceIndexSize(sourceIndex):
+    # Each line is referenced by the list of lines and possibly the index.
+    return sum(sys.getsizeof(line) + 16 for line in sourceIndex.lines)
+
+
+class ModServer(object):
+    """
+    Server applying mod rules on behalf of JSON-RPC requests, keeping
+    rules and indexed sources in a `LruCache` of ``maxCacheSize`` bytes and
+    applying up to ``workers`` requests concurrently.
+    """
+    def __init__(self, maxCacheSize, workers=None):
+        assert maxCacheSize >= 0
+
+        self.cache = LruCache(maxCacheSize)
+        self.hasStopped = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        # Locks of the targets currently being applied to and the number
+        # of requests using each of them.
+        self._targetPathToLockAndUserCountMap = {}
+        self._methodNameToMethodMap = {
+            'apply': self._applyMethod,
+            'shutdown': self._shutdownMethod,
+            'stats': self._statsMethod,
+        }
+
+    def _rules(self, rulesPath):
+        key = ('rules', rulesPath)
+        result = self.cache.get(key)
+        if result is None:
+            _log.info('read mods from "%s"', rulesPath)
+            # Take the stats of all files before parsing so changes while
+            # parsing result in outdated rules rather than wrong ones.
+            rulesStats = _fileStats([rulesPath])
+            fileStats = rulesStats + _fileStats(modtext.rulesIncludedPaths(rulesPath))
+            result = modtext.cachedRules(rulesPath)
+            self.cache.put(key, result, _rulesSize(rulesPath, result.includedPaths), fileStats)
+        return result
+
+    def _sourceIndex(self, rules, rulesPath, sourcePath):
+        # The index depends on the search terms of the rules, so it is only
+        # current for the same rules object.
+        key = ('source', rulesPath, sourcePath)
+        rulesAndSourceIndex = self.cache.get(key)
+        if (rulesAndSourceIndex is not None) and (rulesAndSourceIndex[0] is rules):
+            result = rulesAndSourceIndex[1]
+        else:
+            _log.info('index source "%s"', sourcePath)
+            fileStats = _fileStats([sourcePath])
+            result = rules.indexedSource(rules._sourceLines(sourcePath))
+            self.cache.put(key, (rules, result), _sourceIndexSize(result), fileStats)
+        return result
+
+    def _applied(self, rulesPath, sourcePath, targetPath, mapped, withReport):
+        startTime = time.perf_counter()
+        result = {}
+
+        def storeReport(report):
+            result['report'] = report.asDict()
+
+        reportHook = storeReport if withReport else None
+        rules = self._rules(rulesPath)
+        if mapped:
+            hasTargetChanged = rules.apply(sourcePath, targetPath, reportHook=reportHook, mapped=True)
+        else:
+            sourceIndex = self._sourceIndex(rules, rulesPath, sourcePath)
+            hasTargetChanged = rules.applyIndexed(sourceIndex, targetPath, reportHook)
+        result['hasTargetChanged'] = hasTargetChanged
+        result['seconds'] = time.perf_counter() - startTime
+        return result
+
+    async def _applyMethod(self, params):
+        rulesPath = _pathParam(params, 'rules')
+        sourcePath = _pathParam(params, 'source')
+        targetPath = _pathParam(params, 'target')
+        mapped = _boolParam(params, 'mapped')
+        withReport = _boolParam(params, 'report')
+        # Requests for the same target must not write it at the same time.
+        # The lock is dropped once no request uses it anymore.
+        lockAndUserCount = self._targetPathToLockAndUserCountMap.get(targetPath)
+        if lockAndUserCount is None:
+            lockAndUserCount = [asyncio.Lock(), 0]
+            self._targetPathToLockAndUserCountMap[targetPath] = lockAndUserCount
+        lockAndUserCount[1] += 1
+        try:
+            async with lockAndUserCount[0]:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._applied, rulesPath, sourcePath, targetPath, mapped, withReport)
+        finally:
+            lockAndUserCount[1] -= 1
+            if lockAndUserCount[1] == 0:
+                del self._targetPathToLockAndUserCountMap[targetPath]
+        return result
+
+    async def _statsMethod(self, params):
+        result = self.cache.stats()
+        result['includes'] = modtext.includeCacheStats()
+        return result
+
+    async def _shutdownMethod(self, params):
+        _log.info('shut down')
+        self.hasStopped = True
+        return None
+
+    async def response(self, requestText):
+        """
+        JSON-RPC response to ``requestText`` or ``None`` if the request is a
+        notification.
+        """
+        assert requestText is not None
+
+        # Valid JSON such as "null" can be parsed to ``None``, so parse
+        # errors need a flag of their own.
+        try:
+            request = json.loads(requestText)
+            hasParsedRequest = True
+        except ValueError as error:
+            hasParsedRequest = False
+            result = _errorResponse(None, _PARSE_ERROR, 'cannot parse request: %s' % error)
+        if not hasParsedRequest:
+            pass
+        elif not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            result = _errorResponse(None, _INVALID_REQUEST, 'request must be an object with a "method"')
+        else:
+            requestId = request.get('id')
+            method = self._methodNameToMethodMap.get(request['method'])
+            params = request.get('params', {})
+            if method is None:
+                result = _errorResponse(requestId, _METHOD_NOT_FOUND, 'method %r must be changed to one of: %s' % (
+                    request['method'], sorted(self._methodNameToMethodMap.keys())))
+            elif not isinstance(params, dict):
+                result = _errorResponse(requestId, _INVALID_PARAMS, 'params must be an object')
+            else:
+                try:
+                    result = {'jsonrpc': '2.0', 'id': requestId, 'result': await method(params)}
+                except _InvalidParamsError as error:
+                    result = _errorResponse(requestId, _INVALID_PARAMS, str(error))
+                except modtext.ModError as error:
+                    result = _errorResponse(requestId, _MOD_ERROR, str(error), {
+                        'lineNumber': error.lineNumber,
+                        'columnNumber': error.columnNumber,
+                    })
+                except EnvironmentError as error:
+                    result = _errorResponse(requestId, _ENVIRONMENT_ERROR, str(error))
+                except Exception as error:
+                    # Respond anyway so the client does not wait forever.
+                    _log.exception('cannot process request %r', requestId)
+                    result = _errorResponse(
+                        requestId, _INTERNAL_ERROR, 'cannot process request: %s: %s' % (type(error).__name__, error))
+            if 'id' not in request:
+                # Notifications get no response.
+                result = None
+        return result
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def _errorResponse(requestId, code, message, data=None):
+    error = {'code': code, 'message': message}
+    if data is not None:
+        error['data'] = data
+    return {'jsonrpc': '2.0', 'id': requestId, 'error': error}
+
+
+def _pathParam(params, name):
+    result = params.get(name)
+    if not isinstance(result, str) or (result == ''):
+        raise _InvalidParamsError('param "%s" must be a path' % name)
+    return os.path.abspath(result)
+
+
+def _boolParam(params, name):
+    result = params.get(name, False)
+    if not isinstance(result, bool):
+        raise _InvalidParamsError('param "%s" must be true or false' % name)
+    return result
+
+
+def _responseLine(response):
+    return json.dumps(response, sort_keys=True) + '\n'
+
+
+async def _serveStdio(server):
+    loop = asyncio.get_running_loop()
+    requestQueue = asyncio.Queue()
+
+    def readRequests():
+        # A daemon thread reads stdin so that a blocking read does not
+        # prevent the server from shutting down.
+        for requestText in sys.stdin:
+            loop.call_soon_threadsafe(requestQueue.put_nowait, requestText)
+        loop.call_soon_threadsafe(requestQueue.put_nowait, None)
+
+    async def respond(requestText):
+        response = await server.response(requestText)
+        if response is not None:
+            sys.stdout.write(_responseLine(response))
+            sys.stdout.flush()
+
+    threading.Thread(target=readRequests, name='modserve-stdin', daemon=True).start()
+    pendingTasks = set()
+    requestText = await requestQueue.get()
+    while (requestText is not None) and not server.hasStopped:
+        if requestText.strip() != '':
+            task = asyncio.ensure_future(respond(requestText))
+            pendingTasks.add(task)
+            task.add_done_callback(pendingTasks.discard)
+            # Let the request start so a shutdown takes effect right away.
+            await asyncio.sleep(0)
+        if not server.hasStopped:
+            requestText = await requestQueue.get()
+    if pendingTasks:
+        await asyncio.wait(pendingTasks)
+
+
+async def _serveUnixSocket(server, socketPath):
+    stopped = asyncio.Event()
+    connectionTaskToWriterMap = {}
+
+    async def handleConnection(reader, writer):
+        connectionTaskToWriterMap[asyncio.current_task()] = writer
+        pendingTasks = set()
+
+        async def respond(requestText):
+            response = await server.response(requestText)
+            if response is not None:
+                writer.write(_responseLine(response).encode('utf-8'))
+                await writer.drain()
+            if server.hasStopped:
+                stopped.set()
+
+        try:
+            requestData = await reader.readline()
+            while (requestData != b'') and not server.hasStopped:
+                if requestData.strip() != b'':
+                    task = asyncio.ensure_future(respond(requestData.decode('utf-8')))
+                    pendingTasks.add(task)
+                    task.add_done_callback(pendingTasks.discard)
+                requestData = await reader.readline()
+            if pendingTasks:
+                await asyncio.wait(pendingTasks)
+        finally:
+            writer.close()
+            del connectionTaskToWriterMap[asyncio.current_task()]
+
+    unixServer = await asyncio.start_unix_server(handleConnection, socketPath)
+    _log.info('serve on "%s"', socketPath)
+    try:
+        await stopped.wait()
+    finally:
+        unixServer.close()
+        # Closing the connections ends their pending reads, so they finish
+        # instead of being cancelled.
+        connectionTasks = list(connectionTaskToWriterMap.keys())
+        for writer in connectionTaskToWriterMap.values():
+            writer.close()
+        if connectionTasks:
+            await asyncio.wait(connectionTasks)
+        await unixServer.wait_closed()
+        os.remove(socketPath)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='serve modtext using JSON-RPC via stdin/stdout or a Unix socket')
+    parser.add_argument('--socket', metavar='PATH', help='Unix socket to serve on instead of stdin and stdout')
+    parser.add_argument('--cache-megabytes', type=float, default=_DEFAULT_CACHE_MEGABYTES, metavar='SIZE',
+        help='maximum estimated size of cached rules and sources (default: %(default)s)')
+    parser.add_argument('--workers', type=int, metavar='COUNT',
+        help='number of requests to apply concurrently (default: depends on the number of CPUs)')
+    args = parser.parse_args(arguments)
+
+    server = ModServer(int(args.cache_megabytes * 1024 * 1024), args.workers)
+    try:
+        if args.socket is not None:
+            asyncio.run(_serveUnixSocket(server, args.socket))
+        else:
+            asyncio.run(_serveStdio(server))
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('modtext').setLevel(logging.WARNING)
+    sys.exit(main())
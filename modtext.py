@@ -2,49 +2,153 @@
 """
 Mod text file according to a mod description.
 """
-import ast
-import fnmatch
+import bisect
+import contextlib
+import itertools
+import hashlib
 import logging
 import os
-import tokenize
-from io import BytesIO
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+
+# Modules only some features need, such as fnmatch, json, luamin, mmap,
+# pickle, shutil and concurrent.futures, are imported where they are used
+# to keep the start of the command line interface fast.
+
+__version__ = '0.1'
 
 _log = logging.getLogger('modtext')
 
 _UTF8BOM = b'\xff\xbb\xbf'
 
+# Size of the buffer for writing targets and number of source lines to
+# encode at once.
+_WRITE_BUFFER_SIZE = 1024 * 1024
+_WRITE_CHUNK_LINE_COUNT = 4096
+
+# Function to normalize lines and glob search terms before matching them, the
+# same way `fnmatch.fnmatch()` uses `os.path.normcase()`: on Windows globs
+# ignore case and treat "/" like "\\". Elsewhere nothing changes, which is
+# ``None``.
+_globNormcase = os.path.normcase if os.path.normcase('A/') != 'A/' else None
+
+# Total number of characters in the lines of included files that are kept in
+# memory to share them between mods and rules.
+_INCLUDE_CACHE_SIZE = 64 * 1024 * 1024
+
 
 def _cleanedLine(line):
     return line.rstrip('\n\r\t ')
 
 
+# Token types returned by `_tokens()`.
+_ENDMARKER = 'endmarker'
+_NAME = 'name'
+_OP = 'op'
+_STRING = 'string'
+
+_Token = namedtuple('_Token', ['type', 'string', 'start', 'end'])
+
+# Strings are matched before names so string prefixes such as "r" are not
+# taken for names.
+_TOKEN_REGEX = re.compile(r"""
+    (?P<space>\s+)
+    |(?P<string>[bBfFrRuU]{0,2}(?:
+        \"\"\"(?:[^\\]|\\.)*?\"\"\"|'''(?:[^\\]|\\.)*?'''|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'))
+    |(?P<name>[^\W\d]\w*)
+    |(?P<op>.)
+    """, re.VERBOSE | re.DOTALL)
+
+_ESCAPE_REGEX = re.compile(
+    r'\\(x[0-9A-Fa-f]{2}|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|N\{[^}]*\}|[0-7]{1,3}|.)', re.DOTALL)
+
+_ESCAPE_TO_TEXT_MAP = {
+    '\n': '',
+    '\\': '\\',
+    "'": "'",
+    '"': '"',
+    'a': '\a',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+}
+
+
 def _tokens(lineNumber, line):
+    """
+    Tokens in the directive ``line``, which is located at the 0 based
+    ``lineNumber``. The token locations are compatible with the ones of the
+    ``tokenize`` module, so rows start with 1 and columns with 0.
+    """
     assert lineNumber >= 0
     assert line is not None
 
-    def absoluteLocation(location, lineNumberToAdd):
-        assert location is not None
-        assert len(location) == 2
-        assert lineNumberToAdd >= 0
-        result = (location[0] + lineNumberToAdd, location[1])
-        return result
-        
     result = []
-    for toky in tokenize.tokenize(BytesIO(line.encode('utf-8')).readline):
-        if toky.type != tokenize.ENCODING:
-            result.append(tokenize.TokenInfo(
-                type=toky.type, string=toky.string,
-                start=absoluteLocation(toky.start, lineNumber),
-                end=absoluteLocation(toky.end, lineNumber),
-                line=toky.line))
+    row = lineNumber + 1
+    for match in _TOKEN_REGEX.finditer(line):
+        tokenType = match.lastgroup
+        if tokenType != 'space':
+            tokenText = match.group()
+            start = (row, match.start())
+            if (tokenType == _OP) and (tokenText in ('"', "'")):
+                raise ModError(start, 'string must end with %s' % tokenText)
+            if (tokenType == _STRING) and (tokenText.lstrip('bBfFrRuU') in ('""', "''")) and line.startswith(tokenText[-1], match.end()):
+                # Three quotes start a triple quoted string not ending in this line.
+                raise ModError(start, 'string must end with %s' % (tokenText[-1] * 3))
+            result.append(_Token(tokenType, tokenText, start, (row, match.end())))
+    result.append(_Token(_ENDMARKER, '', (row, len(line)), (row, len(line))))
     return result
 
 
-def _unquotedString(quotedString):
-    assert quotedString is not None
-    assert len(quotedString) >= 2
+def _unquotedString(stringToken):
+    """
+    Text of the Python string literal in ``stringToken``. Like with
+    `ast.literal_eval()`, the literal can be triple quoted and use the
+    prefixes "r" and "u". Byte and formatted strings are rejected.
+    """
+    assert stringToken is not None
+    assert stringToken.type == _STRING
 
-    return ast.literal_eval(quotedString)
+    quotedString = stringToken.string
+    unprefixedString = quotedString.lstrip('bBfFrRuU')
+    prefix = quotedString[:len(quotedString) - len(unprefixedString)].lower()
+    if ('b' in prefix) or ('f' in prefix) or (prefix in ('ru', 'ur')) or (len(set(prefix)) < len(prefix)):
+        raise ModError(stringToken.start, 'string prefix "%s" must be removed or changed to "r" or "u"' % prefix)
+    quoteLength = 3 if unprefixedString[:3] in ('"""', "'''") else 1
+    text = unprefixedString[quoteLength:-quoteLength]
+
+    def unescapedText(match):
+        escape = match.group(1)
+        firstEscapeCharacter = escape[0]
+        if firstEscapeCharacter in 'xuUN':
+            if len(escape) == 1:
+                raise ModError(stringToken.start, 'truncated escape \\%s must be completed' % escape)
+            if firstEscapeCharacter == 'N':
+                import unicodedata
+                try:
+                    result = unicodedata.lookup(escape[2:-1])
+                except KeyError:
+                    raise ModError(stringToken.start, 'unknown Unicode character name in escape \\%s must be changed' % escape)
+            else:
+                result = chr(int(escape[1:], 16))
+        elif firstEscapeCharacter in '01234567':
+            result = chr(int(escape, 8))
+        else:
+            result = _ESCAPE_TO_TEXT_MAP.get(escape, '\\' + escape)
+        return result
+
+    if 'r' in prefix:
+        result = text
+    else:
+        result = _ESCAPE_REGEX.sub(unescapedText, text)
+    return result
 
 
 class ModError(ValueError):
@@ -66,21 +170,507 @@ class ModError(ValueError):
         return '%d;%d: %s' % (self.lineNumber, self.columnNumber, self.message)
 
 
+class _TermMatcher(object):
+    """
+    Matcher for the glob and contains search terms of many finders that
+    examines each line only once.
+
+    A single prefilter searches each line for any of the literal parts the
+    terms require, see `_literalSearchTerm()`. Only lines found this way are
+    candidates that are matched against the terms, and each term is only
+    matched if the line contains its literal part. If a term has no literal
+    part, such as the glob ``*``, every line is a candidate. Exact search
+    terms are left to `_LineIndex`. The expressions are compiled on first
+    use and are not pickled, so cached rules load quickly.
+    """
+    def __init__(self, finders):
+        assert finders is not None
+
+        self.matchKeys = []
+        self._literals = []
+        self._termPatterns = []
+        for finder in finders:
+            matchKey = finder.matchKey
+            kind, searchTerm = matchKey
+            if (kind != 'exact') and (matchKey not in self.matchKeys):
+                if kind == 'glob':
+                    termPattern = searchTerm
+                else:
+                    assert kind == 'contains', 'kind=%r' % kind
+                    # Containing the literal is enough.
+                    termPattern = None
+                self.matchKeys.append(matchKey)
+                self._literals.append(_literalSearchTerm(matchKey))
+                self._termPatterns.append(termPattern)
+        if (self._literals != []) and ('' not in self._literals):
+            # Try longer literals first so the alternation does not stop at
+            # a shorter literal that is a prefix of them.
+            self.prefilterPattern = '|'.join(
+                re.escape(literal) for literal in sorted(set(self._literals), key=len, reverse=True))
+        else:
+            self.prefilterPattern = None
+        self._prefilter = None
+        self._literalsAndMatches = None
+
+    def __getstate__(self):
+        result = dict(self.__dict__)
+        result['_prefilter'] = None
+        result['_literalsAndMatches'] = None
+        return result
+
+    @property
+    def prefilter(self):
+        """
+        Function that searches a line for any of the literal parts of the
+        terms, or ``None`` if every line is a candidate.
+        """
+        if (self._prefilter is None) and (self.prefilterPattern is not None):
+            self._prefilter = re.compile(self.prefilterPattern).search
+        return self._prefilter
+
+    @property
+    def literalsAndMatches(self):
+        """
+        List of ``(literal, match)`` for each of the `matchKeys`, where
+        ``match`` is ``None`` if containing ``literal`` is enough to match.
+        """
+        if self._literalsAndMatches is None:
+            self._literalsAndMatches = [
+                (literal, _compiledGlobMatch(termPattern) if termPattern is not None else None)
+                for literal, termPattern in zip(self._literals, self._termPatterns)]
+        return self._literalsAndMatches
+
+
+class _LineIndex(object):
+    """
+    Index of source lines to find the line numbers matching a finder without
+    scanning the whole source for each finder.
+
+    Exact lines are resolved using a map from each distinct line to the
+    sorted line numbers it occurs at. Glob and contains search terms known
+    to ``termMatcher`` are matched in the same single pass that builds the
+    index. Other terms are matched against all lines once per distinct
+    term, and the result is cached for other finders using the same term.
+
+    If ``exactSearchTerms`` is specified, only lines equal to one of them
+    are indexed. If ``lines`` is not a list but an iterator, the lines are
+    not retained so the index only takes memory proportional to the number
+    of matching lines; all finders then have to be known in advance using
+    ``termMatcher`` and ``exactSearchTerms``.
+    """
+    def __init__(self, lines, termMatcher=None, exactSearchTerms=None):
+        assert lines is not None
+
+        self.lines = lines if isinstance(lines, list) else None
+        self.lineCount = 0
+        self._lineToLineNumbersMap = {}
+        if (termMatcher is not None) and (termMatcher.matchKeys != []):
+            prefilter = termMatcher.prefilter
+            literalsAndMatches = termMatcher.literalsAndMatches
+            self._matchKeyToLineNumbersMap = {matchKey: [] for matchKey in termMatcher.matchKeys}
+            lineNumbersList = [self._matchKeyToLineNumbersMap[matchKey] for matchKey in termMatcher.matchKeys]
+        else:
+            literalsAndMatches = None
+            self._matchKeyToLineNumbersMap = {}
+        for lineNumber, line in enumerate(lines):
+            if (exactSearchTerms is None) or (line in exactSearchTerms):
+                lineNumbers = self._lineToLineNumbersMap.get(line)
+                if lineNumbers is None:
+                    self._lineToLineNumbersMap[line] = [lineNumber]
+                else:
+                    lineNumbers.append(lineNumber)
+            if (literalsAndMatches is not None) and ((prefilter is None) or (prefilter(line) is not None)):
+                for termIndex, (literal, match) in enumerate(literalsAndMatches):
+                    if (literal in line) and ((match is None) or (match(line) is not None)):
+                        lineNumbersList[termIndex].append(lineNumber)
+            self.lineCount += 1
+
+    def __len__(self):
+        return self.lineCount
+
+    def lineNumbers(self, finder):
+        """
+        Sorted list of line numbers matching ``finder``.
+        """
+        assert finder is not None
+
+        matchKey = finder.matchKey
+        kind, searchTerm = matchKey
+        if kind == 'exact':
+            result = self._lineToLineNumbersMap.get(searchTerm, [])
+        else:
+            result = self._matchKeyToLineNumbersMap.get(matchKey)
+            if result is None:
+                assert self.lines is not None, 'finder must be known in advance for streamed index: %r' % (matchKey,)
+                match = finder.compiledMatch()
+                result = [lineNumber for lineNumber, line in enumerate(self.lines) if match(line)]
+                self._matchKeyToLineNumbersMap[matchKey] = result
+        return result
+
+
+def _literalSearchTerm(matchKey):
+    """
+    Longest part of the search term in ``matchKey`` that every line matching
+    it has to contain literally, possibly ``''``.
+    """
+    kind, searchTerm = matchKey
+    if kind == 'glob':
+        if _globNormcase is None:
+            # Only consider the part before the first character set; parts
+            # of "[...]" are no literals.
+            literals = re.split(r'[*?]', searchTerm.split('[', 1)[0])
+            result = max(literals, key=len)
+        else:
+            # Lines contain the literal parts only after normalizing them.
+            result = ''
+    else:
+        result = searchTerm
+    return result
+
+
+def _compiledGlobMatch(searchTerm):
+    """
+    Function that takes a line and returns a match if the line matches the
+    glob ``searchTerm`` in the same way as `fnmatch.fnmatch()`.
+    """
+    import fnmatch
+
+    normcase = _globNormcase
+    if normcase is None:
+        result = re.compile(fnmatch.translate(searchTerm)).match
+    else:
+        match = re.compile(fnmatch.translate(normcase(searchTerm))).match
+        result = lambda line: match(normcase(line))
+    return result
+
+
+class _MappedLineIndex(object):
+    """
+    Index of the lines in the bytes of a memory mapped source, which are
+    only decoded using ``encoding`` if they are candidates to match a
+    finder.
+
+    The index only consists of the start offsets of all lines. To find the
+    lines matching a finder, the source bytes are searched for the longest
+    literal part of its search term, and only the lines containing it are
+    decoded and matched against the whole search term. Consequently
+    ``encoding`` must encode ASCII characters as single bytes the same way
+    ASCII does, for example 'utf-8' or 'cp1252'.
+
+    Unlike `_LineIndex`, lines are separated by linefeeds only.
+    """
+    def __init__(self, data, encoding='utf-8'):
+        assert data is not None
+        assert encoding is not None
+
+        if '\n'.encode(encoding) != b'\n':
+            raise ModError(0, 'encoding %s must be ASCII compatible to map source' % encoding)
+        self.data = data
+        self.encoding = encoding
+        self.lines = None
+        self.lineOffsets = array('Q')
+        self._matchKeyToLineNumbersMap = {}
+        dataSize = len(data)
+        lineOffset = 0
+        while lineOffset < dataSize:
+            self.lineOffsets.append(lineOffset)
+            lineOffset = data.find(b'\n', lineOffset) + 1
+            if lineOffset == 0:
+                lineOffset = dataSize
+        self.endsWithNewline = (dataSize == 0) or (data[dataSize - 1:dataSize] == b'\n')
+        firstLineEndOffset = data.find(b'\n')
+        isCrLf = (firstLineEndOffset >= 1) and (data[firstLineEndOffset - 1:firstLineEndOffset] == b'\r')
+        self.newline = b'\r\n' if isCrLf else b'\n'
+
+    def __len__(self):
+        return len(self.lineOffsets)
+
+    def lineOffset(self, lineNumber):
+        """
+        Offset of the first byte in line ``lineNumber``, or the size of the
+        data for the line after the last one.
+        """
+        assert 0 <= lineNumber <= len(self)
+        return self.lineOffsets[lineNumber] if lineNumber < len(self) else len(self.data)
+
+    def line(self, lineNumber):
+        """
+        Cleaned and decoded text of line ``lineNumber``.
+        """
+        assert 0 <= lineNumber < len(self)
+        lineBytes = self.data[self.lineOffset(lineNumber):self.lineOffset(lineNumber + 1)]
+        return _cleanedLine(str(lineBytes, self.encoding))
+
+    def _candidateLineNumbers(self, literal):
+        if literal != '':
+            result = []
+            literalBytes = literal.encode(self.encoding)
+            offset = self.data.find(literalBytes)
+            while offset != -1:
+                lineNumber = bisect.bisect_right(self.lineOffsets, offset) - 1
+                result.append(lineNumber)
+                offset = self.data.find(literalBytes, self.lineOffset(lineNumber + 1))
+        else:
+            result = range(len(self))
+        return result
+
+    def lineNumbers(self, finder):
+        """
+        Sorted list of line numbers matching ``finder``.
+        """
+        assert finder is not None
+
+        matchKey = finder.matchKey
+        result = self._matchKeyToLineNumbersMap.get(matchKey)
+        if result is None:
+            match = finder.compiledMatch()
+            result = [
+                lineNumber for lineNumber in self._candidateLineNumbers(_literalSearchTerm(matchKey))
+                if match(self.line(lineNumber))]
+            self._matchKeyToLineNumbersMap[matchKey] = result
+        return result
+
+
+@contextlib.contextmanager
+def _mappedData(path):
+    """
+    Context manager for the read only memory mapped bytes of the file at
+    ``path``. Empty files cannot be mapped and result in ``b''``.
+    """
+    assert path is not None
+
+    import mmap
+
+    with open(path, 'rb') as mappedFile:
+        if os.fstat(mappedFile.fileno()).st_size > 0:
+            result = mmap.mmap(mappedFile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield result
+            finally:
+                result.close()
+        else:
+            yield b''
+
+
+def _shardMatches(sharedMemoryName, startOffset, endOffset, encoding, finders):
+    """
+    Tuple ``(lineOffsets, newline, endsWithNewline, matchKeyToLineNumbersMap)``
+    for the lines between ``startOffset`` and ``endOffset`` of the source in
+    the shared memory block named ``sharedMemoryName``, where offsets and
+    line numbers are relative to the start of the shard.
+    """
+    from multiprocessing import shared_memory
+
+    sharedMemory = shared_memory.SharedMemory(sharedMemoryName)
+    try:
+        shardData = bytes(sharedMemory.buf[startOffset:endOffset])
+    finally:
+        sharedMemory.close()
+    shardIndex = _MappedLineIndex(shardData, encoding)
+    matchKeyToLineNumbersMap = {finder.matchKey: shardIndex.lineNumbers(finder) for finder in finders}
+    return shardIndex.lineOffsets, shardIndex.newline, shardIndex.endsWithNewline, matchKeyToLineNumbersMap
+
+
+class _ShardedLineIndex(_MappedLineIndex):
+    """
+    Same as `_MappedLineIndex` but for the bytes of a source in the shared
+    memory block ``sharedMemory``, which is split into ``shardCount`` shards
+    of about equal size starting at line boundaries.
+
+    The shards are indexed and matched against all ``finders`` in parallel
+    processes. Their line numbers are then merged in the order of the
+    shards, so the result is the same as without shards.
+    """
+    def __init__(self, sharedMemory, dataSize, encoding, finders, shardCount):
+        assert sharedMemory is not None
+        assert 0 <= dataSize <= sharedMemory.size
+        assert encoding is not None
+        assert finders is not None
+        assert shardCount >= 1
+
+        import concurrent.futures
+
+        if '\n'.encode(encoding) != b'\n':
+            raise ModError(0, 'encoding %s must be ASCII compatible to map source' % encoding)
+        self.data = sharedMemory.buf[:dataSize]
+        self.encoding = encoding
+        self.lines = None
+        shardOffsets = self._shardOffsets(shardCount)
+        matchKeyToFinderMap = {finder.matchKey: finder for finder in finders}
+        _log.info('  match %d shards in parallel', len(shardOffsets) - 1)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(len(shardOffsets) - 1) as executor:
+                shardResults = list(executor.map(
+                    _shardMatches, itertools.repeat(sharedMemory.name), shardOffsets[:-1], shardOffsets[1:],
+                    itertools.repeat(encoding), itertools.repeat(list(matchKeyToFinderMap.values()))))
+        except BaseException:
+            # Release the data so the shared memory can be closed.
+            self.close()
+            raise
+        self._shardStartOffsets = shardOffsets[:-1]
+        self._shardLineOffsets = []
+        self._shardFirstLineNumbers = []
+        self._matchKeyToLineNumbersMap = {matchKey: [] for matchKey in matchKeyToFinderMap}
+        self.lineCount = 0
+        for shardLineOffsets, _, _, matchKeyToLineNumbersMap in shardResults:
+            self._shardLineOffsets.append(shardLineOffsets)
+            self._shardFirstLineNumbers.append(self.lineCount)
+            for matchKey, lineNumbers in matchKeyToLineNumbersMap.items():
+                self._matchKeyToLineNumbersMap[matchKey].extend(
+                    self.lineCount + lineNumber for lineNumber in lineNumbers)
+            self.lineCount += len(shardLineOffsets)
+        self.newline = shardResults[0][1]
+        self.endsWithNewline = shardResults[-1][2]
+
+    def _shardOffsets(self, shardCount):
+        """
+        Offsets at which the shards start followed by the size of the data.
+        Each shard starts after a linefeed, so small sources result in fewer
+        shards than requested.
+        """
+        dataSize = len(self.data)
+        result = [0]
+        for shardNumber in range(1, shardCount):
+            shardOffset = max(result[-1], dataSize * shardNumber // shardCount)
+            while (0 < shardOffset < dataSize) and (self.data[shardOffset - 1] != ord('\n')):
+                shardOffset += 1
+            if result[-1] < shardOffset < dataSize:
+                result.append(shardOffset)
+        result.append(dataSize)
+        if dataSize == 0:
+            # Empty sources still need a shard to detect their newline.
+            result = [0, 0]
+        return result
+
+    def __len__(self):
+        return self.lineCount
+
+    def lineOffset(self, lineNumber):
+        assert 0 <= lineNumber <= len(self)
+        if lineNumber < len(self):
+            shardIndex = bisect.bisect_right(self._shardFirstLineNumbers, lineNumber) - 1
+            result = self._shardStartOffsets[shardIndex] + \
+                self._shardLineOffsets[shardIndex][lineNumber - self._shardFirstLineNumbers[shardIndex]]
+        else:
+            result = len(self.data)
+        return result
+
+    def lineNumbers(self, finder):
+        assert finder is not None
+        assert finder.matchKey in self._matchKeyToLineNumbersMap, \
+            'finder must be known in advance for sharded index: %r' % (finder.matchKey,)
+        return self._matchKeyToLineNumbersMap[finder.matchKey]
+
+    def close(self):
+        self.data.release()
+
+
+@contextlib.contextmanager
+def _sharedData(path):
+    """
+    Context manager for a tuple ``(sharedMemory, dataSize)`` with the
+    content of the file at ``path`` read into a new shared memory block,
+    which is removed again when leaving the ``with`` block.
+    """
+    assert path is not None
+
+    from multiprocessing import shared_memory
+
+    with open(path, 'rb') as sharedFile:
+        dataSize = os.fstat(sharedFile.fileno()).st_size
+        # Shared memory blocks cannot be empty.
+        sharedMemory = shared_memory.SharedMemory(create=True, size=max(1, dataSize))
+        try:
+            with sharedMemory.buf[:dataSize] as sharedView:
+                sharedFile.readinto(sharedView)
+            yield sharedMemory, dataSize
+        finally:
+            sharedMemory.close()
+            sharedMemory.unlink()
+
+
+class _TargetFile(object):
+    """
+    Binary file to write a target to that only replaces an existing target
+    if the content actually differs, so unchanged targets keep their
+    modification time.
+
+    The data are written to a temporary file next to the target while their
+    digest is computed. When leaving the ``with`` block, the temporary file
+    either atomically replaces the target or is removed again, and
+    ``hasChanged`` tells which of the two happened. With ``dryRun``, the
+    temporary file is always removed, so ``hasChanged`` only tells whether
+    the target would have been replaced.
+    """
+    def __init__(self, targetPath, dryRun=False):
+        assert targetPath is not None
+
+        self.targetPath = targetPath
+        self.dryRun = dryRun
+        self.hasChanged = None
+        self._temporaryPath = '%s.%d.tmp' % (targetPath, os.getpid())
+        self._temporaryFile = open(self._temporaryPath, 'wb', buffering=_WRITE_BUFFER_SIZE)
+        self._digest = hashlib.sha256()
+        self._byteCount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, errorType, error, traceback):
+        self._temporaryFile.close()
+        if errorType is None:
+            self.hasChanged = not self._hasSameContentAsTarget()
+            if self.dryRun:
+                os.remove(self._temporaryPath)
+            elif self.hasChanged:
+                if os.path.exists(self.targetPath):
+                    import shutil
+                    shutil.copymode(self.targetPath, self._temporaryPath)
+                os.replace(self._temporaryPath, self.targetPath)
+            else:
+                _log.info('  preserve unchanged target "%s"', self.targetPath)
+                os.remove(self._temporaryPath)
+        else:
+            try:
+                os.remove(self._temporaryPath)
+            except EnvironmentError as removeError:
+                _log.warning('cannot remove temporary file "%s": %s', self._temporaryPath, removeError)
+
+    def write(self, data):
+        self._digest.update(data)
+        self._temporaryFile.write(data)
+        self._byteCount += len(data)
+
+    def _hasSameContentAsTarget(self):
+        try:
+            with open(self.targetPath, 'rb') as targetFile:
+                if os.fstat(targetFile.fileno()).st_size == self._byteCount:
+                    targetDigest = hashlib.sha256()
+                    for data in iter(lambda: targetFile.read(_WRITE_BUFFER_SIZE), b''):
+                        targetDigest.update(data)
+                    result = targetDigest.digest() == self._digest.digest()
+                else:
+                    result = False
+        except FileNotFoundError:
+            result = False
+        return result
+
+
 class BaseFinder(object):
     def __init__(self, keyword, tokens):
-        assert (tokens[0].type, tokens[0].string) == (tokenize.OP, '@'), 'tokens[0]=' + str(tokens[0])
-        assert (tokens[1].type, tokens[1].string) == (tokenize.NAME, keyword)
+        assert (tokens[0].type, tokens[0].string) == (_OP, '@'), 'tokens[0]=' + str(tokens[0])
+        assert (tokens[1].type, tokens[1].string) == (_NAME, keyword)
 
         self._searchTerm = None
         self._isGlob = False
         self._isLast = False
         self._isContains = False
         for token in tokens[2:]:
-            if token.type == tokenize.NAME:
+            if token.type == _NAME:
                 if token.string == 'contains':
                     if self._isContains:
                         raise ModError(token.start, 'duplicate "contains" must be removed')
-                    self._isGlob = True
+                    self._isContains = True
                 elif token.string == 'glob':
                     if self._isGlob:
                         raise ModError(token.start, 'duplicate "glob" must be removed')
@@ -91,41 +681,70 @@ class BaseFinder(object):
                     self._isLast = True
                 else:
                     raise ModError(token.start, 'cannot process unknown keyword "%s"' % token.string)
-            elif token.type == tokenize.STRING:
+            elif token.type == _STRING:
                 if self._searchTerm is None:
-                    self._searchTerm = _unquotedString(token.string)
+                    self._searchTerm = _unquotedString(token)
                     if self._searchTerm.rstrip() != self._searchTerm:
                         raise ModError(token.start,
                             'trailing white space in search term must be removed because trailing white space in input is automatically discarded and consequently can never be found')
                 else:
                     raise ModError(token.start, 'duplicate search term must be removed')
-            elif token.type != tokenize.ENDMARKER:
+            elif token.type != _ENDMARKER:
                 raise ModError(token.start, 'cannot process unknown keyword "%s"' % token.string)
         if self._searchTerm is None:
             raise ModError(tokens[0].start, 'search term must be specified')
         if self._isContains and self._isGlob:
             self._searchTerm = '*' + self._searchTerm + '*'
 
+    @property
+    def matchKey(self):
+        """
+        Key to cache the line numbers matching the search term of this
+        finder; finders with equal keys always match the same lines.
+        """
+        if self._isGlob:
+            result = ('glob', self._searchTerm)
+        elif self._isContains:
+            result = ('contains', self._searchTerm)
+        else:
+            result = ('exact', self._searchTerm)
+        return result
+
+    def compiledMatch(self):
+        """
+        Function that takes a line and returns ``True`` if the line matches
+        the search term. Exact search terms are handled by `_LineIndex`
+        directly and do not need this.
+        """
+        if self._isGlob:
+            result = _compiledGlobMatch(self._searchTerm)
+        elif self._isContains:
+            searchTerm = self._searchTerm
+            result = lambda line: searchTerm in line
+        else:
+            searchTerm = self._searchTerm
+            result = lambda line: line == searchTerm
+        return result
+
     def foundAt(self, lines, startLineNumber=0):
         assert lines is not None
         assert startLineNumber >= 0
 
-        result = None
-        lineIndex = startLineNumber
-        lineCount = len(lines)
-        _log.info('  find starting at %d: %r', lineIndex + 1, self._searchTerm)
-        while (lineIndex < lineCount) and ((result is None) or self._isLast):
-            lineToExamine = lines[lineIndex]
-            _log.debug('    examine %d: %r', lineIndex + 1, lineToExamine)
-            if self._isGlob:
-                found = fnmatch.fnmatch(lineToExamine, self._searchTerm)
-            elif self._isContains:
-                found = self._searchTerm in lineToExamine
+        if not isinstance(lines, (_LineIndex, _MappedLineIndex)):
+            lines = _LineIndex(lines)
+        _log.info('  find starting at %d: %r', startLineNumber + 1, self._searchTerm)
+        lineNumbers = lines.lineNumbers(self)
+        if self._isLast:
+            if (lineNumbers != []) and (lineNumbers[-1] >= startLineNumber):
+                result = lineNumbers[-1]
+            else:
+                result = None
+        else:
+            lineNumberIndex = bisect.bisect_left(lineNumbers, startLineNumber)
+            if lineNumberIndex < len(lineNumbers):
+                result = lineNumbers[lineNumberIndex]
             else:
-                found = (self._searchTerm == lineToExamine)
-            if found:
-                result = lineIndex
-            lineIndex += 1
+                result = None
         if result is None:
             raise ModError(startLineNumber, 'cannot find search term: %s' % self._searchTerm)
         _log.info('    found in line %d: %r', result + 1, self._searchTerm)
@@ -156,16 +775,193 @@ class ModOptions(object):
         if key in self._keyToValuesMap:
             self._keyToValuesMap[key] = value
         else:
-            raise ModError('option name %s must be changed to one of: %s' % (key, sorted(self._keyToValuesMap.keys())))
+            raise ModError(0, 'option name %s must be changed to one of: %s' % (key, sorted(self._keyToValuesMap.keys())))
 
     def getOption(self, key):
         assert key is not None
-        result = self.get(self._keyToValuesMap[key])
+        result = self._keyToValuesMap.get(key)
         if result is None:
-            raise ModError('option name %s must be changed to one of: %s' % (key, sorted(self._keyToValuesMap.keys())))
+            raise ModError(0, 'option name %s must be changed to one of: %s' % (key, sorted(self._keyToValuesMap.keys())))
         return result
 
 
+def _includedPathAndIsMinified(tokens):
+    """
+    ``(path, isMinified)`` specified by the ``@include`` directive
+    consisting of ``tokens``, where ``isMinified`` tells whether the path is
+    preceded by ``minified``.
+    """
+    assert (tokens[0].type, tokens[0].string) == (_OP, '@')
+    assert (tokens[1].type, tokens[1].string) == (_NAME, 'include')
+    isMinified = (tokens[2].type, tokens[2].string) == (_NAME, 'minified')
+    pathToIncludeToken = tokens[3] if isMinified else tokens[2]
+    if pathToIncludeToken.type != _STRING:
+        raise ModError(pathToIncludeToken.start, 'after @include a string containing the path to include must be specified (found: %r)' % pathToIncludeToken.string)
+    tokenAfterPath = tokens[4] if isMinified else tokens[3]
+    if tokenAfterPath.type != _ENDMARKER:
+        raise ModError(tokenAfterPath.start, 'unexpected text after @include "..." must be removed')
+    return _unquotedString(pathToIncludeToken), isMinified
+
+
+def rulesIncludedPaths(rulesPath):
+    """
+    Paths of all files included by the rules in ``rulesPath`` in the order
+    of their first ``@include``. Unlike `ModRules.includedPaths` this only
+    scans the ``@include`` directives, so the included files do not have to
+    exist yet, for example because they are generated by a build.
+    """
+    assert rulesPath is not None
+
+    result = []
+    isAtMod = False
+    with open(rulesPath, 'r', encoding='utf-8') as rulesFile:
+        for lineNumber, line in enumerate(rulesFile):
+            line = _cleanedLine(line)
+            if line.startswith('@mod'):
+                isAtMod = True
+            elif not line.startswith('@'):
+                isAtMod = False
+            elif isAtMod and line.startswith('@include'):
+                includedPath, _ = _includedPathAndIsMinified(_tokens(lineNumber, line))
+                if includedPath not in result:
+                    result.append(includedPath)
+    return result
+
+
+class _IncludeCache(object):
+    """
+    Process wide cache of the text lines of included files, so a file
+    included by several mods or rules is only read once and its lines are
+    held in memory only once.
+
+    The lines of each file are stored as an immutable block, which is a
+    tuple of ``(lineNumber, line)`` tuples with interned lines, so equal
+    lines of different files share their text, too. Blocks are reread once
+    the size or modification time of their file changes.
+
+    The size of a block is the number of characters in its cleaned lines,
+    which excludes line endings and trailing white space as well as the
+    memory for the tuples and string objects. Lines shared by several
+    blocks count for each of them. If the total size of the cached blocks
+    exceeds ``maxSize``, the least recently used blocks are evicted; mods
+    still using them keep them until they are discarded.
+    """
+    def __init__(self, maxSize):
+        assert maxSize >= 0
+
+        self.maxSize = maxSize
+        self.size = 0
+        self.hitCount = 0
+        self.missCount = 0
+        self.evictionCount = 0
+        self._pathToStatAndBlockMap = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pathToStatAndBlockMap)
+
+    def textLines(self, path):
+        """
+        Block of cleaned ``(lineNumber, line)`` tuples of the file at
+        ``path``.
+        """
+        assert path is not None
+
+        absolutePath = os.path.abspath(path)
+        pathStat = os.stat(absolutePath)
+        fileStat = (pathStat.st_size, pathStat.st_mtime_ns)
+        with self._lock:
+            statAndBlock = self._pathToStatAndBlockMap.get(absolutePath)
+            if (statAndBlock is not None) and (statAndBlock[0] == fileStat):
+                self._pathToStatAndBlockMap.move_to_end(absolutePath)
+                self.hitCount += 1
+                result = statAndBlock[1]
+            else:
+                result = None
+        if result is None:
+            # Included lines become part of the mod rules, so they use the
+            # same encoding as the rules file rather than the "encoding"
+            # option, which only applies to sources and targets.
+            with open(absolutePath, 'r', encoding='utf-8') as includeFile:
+                pathStat = os.fstat(includeFile.fileno())
+                result = tuple(
+                    (lineNumber, sys.intern(_cleanedLine(line))) for lineNumber, line in enumerate(includeFile))
+            self._put(absolutePath, (pathStat.st_size, pathStat.st_mtime_ns), result)
+        return result
+
+    def sharedBlock(self, path, block):
+        """
+        The cached block of the file at ``path`` if it is equal to
+        ``block``, otherwise ``block`` with interned lines, which is cached
+        for ``path`` from now on. This is for blocks that did not come from
+        `textLines()`, for example because they were unpickled by
+        `cachedRules()`; the caller has to make sure that ``block`` holds
+        the current lines of ``path``.
+        """
+        assert path is not None
+        assert block is not None
+
+        absolutePath = os.path.abspath(path)
+        pathStat = os.stat(absolutePath)
+        fileStat = (pathStat.st_size, pathStat.st_mtime_ns)
+        with self._lock:
+            statAndBlock = self._pathToStatAndBlockMap.get(absolutePath)
+            if (statAndBlock is not None) and (statAndBlock[0] == fileStat) and (statAndBlock[1] == block):
+                self._pathToStatAndBlockMap.move_to_end(absolutePath)
+                self.hitCount += 1
+                result = statAndBlock[1]
+            else:
+                result = None
+        if result is None:
+            result = tuple((lineNumber, sys.intern(line)) for lineNumber, line in block)
+            self._put(absolutePath, fileStat, result)
+        return result
+
+    def _put(self, absolutePath, fileStat, block):
+        blockSize = sum(len(line) for _, line in block)
+        with self._lock:
+            self.missCount += 1
+            if absolutePath in self._pathToStatAndBlockMap:
+                self._remove(absolutePath)
+            self._pathToStatAndBlockMap[absolutePath] = (fileStat, block, blockSize)
+            self.size += blockSize
+            while (self.size > self.maxSize) and (len(self._pathToStatAndBlockMap) > 1):
+                self._remove(next(iter(self._pathToStatAndBlockMap)))
+                self.evictionCount += 1
+
+    def _remove(self, absolutePath):
+        _, _, blockSize = self._pathToStatAndBlockMap.pop(absolutePath)
+        self.size -= blockSize
+
+    def clear(self):
+        with self._lock:
+            self._pathToStatAndBlockMap.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            result = {
+                'entries': len(self._pathToStatAndBlockMap),
+                'size': self.size,
+                'maxSize': self.maxSize,
+                'hits': self.hitCount,
+                'misses': self.missCount,
+                'evictions': self.evictionCount,
+            }
+        return result
+
+
+_includeCache = _IncludeCache(_INCLUDE_CACHE_SIZE)
+
+
+def includeCacheStats():
+    """
+    Number of files whose lines are cached for ``@include``, the total
+    number of characters in their lines, hits, misses and evictions.
+    """
+    return _includeCache.stats()
+
+
 class Mod(object):
     def __init__(self, modLines, textLines):
         assert modLines is not None
@@ -174,19 +970,23 @@ class Mod(object):
         assert firstLine.startswith('@mod'), 'firstLine=%r' % firstLine
         assert textLines is not None
 
+        startTime = time.perf_counter()
         self._finders = []
         self._textLines = list(textLines)
+        self._includedTextBlocks = []
+        self._isMinifiedBlocks = []
+        self.includedPaths = []
 
         # Extract mod description.
         modLineNumber, modLine = modLines[0]
         modTokens = _tokens(modLineNumber, modLine)
         _log.debug(modTokens)
-        assert (modTokens[0].type, modTokens[0].string) == (tokenize.OP, '@')
-        assert (modTokens[1].type, modTokens[1].string) == (tokenize.NAME, 'mod')
-        self.description = _unquotedString(modTokens[2].string)
-        if modTokens[2].type != tokenize.STRING:
-            raise ModError(modLineNumber, 'after @mod a string to describe the mod must be specified (found: %r)' % self.description)
-        if modTokens[3].type != tokenize.ENDMARKER:
+        assert (modTokens[0].type, modTokens[0].string) == (_OP, '@')
+        assert (modTokens[1].type, modTokens[1].string) == (_NAME, 'mod')
+        if modTokens[2].type != _STRING:
+            raise ModError(modLineNumber, 'after @mod a string to describe the mod must be specified (found: %r)' % modTokens[2].string)
+        self.description = _unquotedString(modTokens[2])
+        if modTokens[3].type != _ENDMARKER:
             raise ModError(modLineNumber, 'unexpected text after @mod "..." must be removed')
         _log.info('declare mod %s', self.description)
 
@@ -203,32 +1003,163 @@ class Mod(object):
                 
             else:
                 raise ModError(lineNumber, 'unknown mod statement: %s' % line)
-        if self._textLines == []:
+        if (self._textLines == []) and not any(self._includedTextBlocks):
             raise ModError(modLineNumber, '@mod must be followed by text lines or @include: %s' % self.description)
+        self.parseSeconds = time.perf_counter() - startTime
 
     def _includeTextLines(self, tokens):
-        assert (tokens[0].type, tokens[0].string) == (tokenize.OP, '@')
-        assert (tokens[1].type, tokens[1].string) == (tokenize.NAME, 'include')
-        pathToIncludeToken = tokens[2]
-        if pathToIncludeToken.type != tokenize.STRING:
-            raise ModError(modLineNumber, 'after @include a string containing the path to include must be specified (found: %r)' % pathToIncludeToken.string)
-        if tokens[3].type != tokenize.ENDMARKER:
-            raise ModError(modLineNumber, 'unexpected text after @include "..." must be removed')
-        pathToInclude = _unquotedString(pathToIncludeToken.string)
+        pathToInclude, isMinified = _includedPathAndIsMinified(tokens)
         _log.info('  read include "%s"', pathToInclude)
-        # TODO: Make encoding an option.
-        with open(pathToInclude, 'r', encoding='utf-8') as includeFile:
-            for lineNumber, line in enumerate(includeFile):
-                line = _cleanedLine(line)
-                self._textLines.append((lineNumber, line))
-        
-        
+        self.includedPaths.append(pathToInclude)
+        self._includedTextBlocks.append(_includeCache.textLines(pathToInclude))
+        self._isMinifiedBlocks.append(isMinified)
+
+    @property
+    def hasMinifiedIncludes(self):
+        return any(self._isMinifiedBlocks)
+
+    def shareIncludedBlocks(self):
+        """
+        Share the blocks of the includes that are not minified with other
+        mods and rules using `_includeCache`, for example after unpickling
+        the mod.
+        """
+        for blockIndex, (includedPath, block, isMinified) in enumerate(zip(
+                self.includedPaths, self._includedTextBlocks, self._isMinifiedBlocks)):
+            if not isMinified:
+                self._includedTextBlocks[blockIndex] = _includeCache.sharedBlock(includedPath, block)
+
+    def unminifiedTextLines(self):
+        """
+        The ``(lineNumber, line)`` tuples of the mod's own text lines and of
+        the includes that are not minified.
+        """
+        result = list(self._textLines)
+        for block, isMinified in zip(self._includedTextBlocks, self._isMinifiedBlocks):
+            if not isMinified:
+                result.extend(block)
+        return result
+
+    def pathsAndBlocksToMinify(self):
+        """
+        List of ``(includedPath, block)`` for the includes to minify.
+        """
+        return [
+            (includedPath, block)
+            for includedPath, block, isMinified in zip(
+                self.includedPaths, self._includedTextBlocks, self._isMinifiedBlocks)
+            if isMinified]
+
+    def setMinifiedBlocks(self, minifiedBlocks):
+        """
+        Replace the blocks of the includes to minify by ``minifiedBlocks``
+        in the order of `pathsAndBlocksToMinify()`.
+        """
+        minifiedBlockIndices = [
+            blockIndex for blockIndex, isMinified in enumerate(self._isMinifiedBlocks) if isMinified]
+        assert len(minifiedBlocks) == len(minifiedBlockIndices)
+        for blockIndex, minifiedBlock in zip(minifiedBlockIndices, minifiedBlocks):
+            self._includedTextBlocks[blockIndex] = tuple(minifiedBlock)
+
+    def minifiedLineLocations(self):
+        """
+        List of ``(textLineIndex, includedPath, lineNumber)`` for the lines
+        in `textLines` stemming from minified includes, where ``lineNumber``
+        is the line number in the included file.
+        """
+        result = []
+        textLineIndex = len(self._textLines)
+        for includedPath, block, isMinified in zip(
+                self.includedPaths, self._includedTextBlocks, self._isMinifiedBlocks):
+            if isMinified:
+                result.extend(
+                    (textLineIndex + blockLineIndex, includedPath, lineNumber)
+                    for blockLineIndex, (lineNumber, _) in enumerate(block))
+            textLineIndex += len(block)
+        return result
+
+    @property
+    def finders(self):
+        return self._finders
+
+    @property
+    def textLines(self):
+        """
+        The ``(lineNumber, line)`` tuples to insert, consisting of the text
+        lines of the mod followed by the lines of all included files.
+        """
+        if self._includedTextBlocks == []:
+            result = self._textLines
+        else:
+            result = list(itertools.chain(self._textLines, *self._includedTextBlocks))
+        return result
+
     def modded(self, lines):
         assert lines is not None
         lineToInsertTextAt = 0
         for finder in self._finders:
             lineToInsertTextAt = finder.foundAt(lines, lineToInsertTextAt)
-        return (lineToInsertTextAt, self._textLines)
+        return (lineToInsertTextAt, self.textLines)
+
+
+class ApplyReport(object):
+    """
+    Report on applying `ModRules` to a source, which `ModRules.apply()`
+    passes to its ``reportHook``. Times are in seconds, line numbers start
+    with 1. ``hasTargetChanged`` tells whether the target was replaced.
+
+    The ``candidateMatches`` of a mod are the number of source lines
+    matching the search term of each of its finders, summed over the
+    finders, so a line matching two finders counts twice. This tells how
+    many lines a finder had to choose from, not how many lines were
+    scanned.
+    """
+    def __init__(self, sourcePath, targetPath):
+        assert sourcePath is not None
+        assert targetPath is not None
+
+        self.sourcePath = sourcePath
+        self.targetPath = targetPath
+        self.sourceLineCount = 0
+        self.readSeconds = 0.0
+        self.writeSeconds = 0.0
+        self.hasTargetChanged = None
+        self.mods = []
+        self._modIdToModReportMap = {}
+
+    def addMod(self, mod, lineNumberToInsertAt, resolveSeconds, candidateMatches):
+        assert mod is not None
+        assert id(mod) not in self._modIdToModReportMap
+
+        modReport = {
+            'description': mod.description,
+            'parseSeconds': mod.parseSeconds,
+            'resolveSeconds': resolveSeconds,
+            'candidateMatches': candidateMatches,
+            'lineNumber': lineNumberToInsertAt + 1,
+            'bytesWritten': 0,
+        }
+        self.mods.append(modReport)
+        self._modIdToModReportMap[id(mod)] = modReport
+
+    def addBytesWritten(self, mod, byteCount):
+        assert byteCount >= 0
+        self._modIdToModReportMap[id(mod)]['bytesWritten'] += byteCount
+
+    def asDict(self):
+        return {
+            'sourcePath': self.sourcePath,
+            'targetPath': self.targetPath,
+            'sourceLineCount': self.sourceLineCount,
+            'readSeconds': self.readSeconds,
+            'writeSeconds': self.writeSeconds,
+            'hasTargetChanged': self.hasTargetChanged,
+            'mods': [dict(modReport) for modReport in self.mods],
+        }
+
+    def asJson(self, indent=2):
+        import json
+        return json.dumps(self.asDict(), indent=indent, sort_keys=True)
 
 
 class ModRules(object):
@@ -240,6 +1171,7 @@ class ModRules(object):
         AT_TEXT = 'text'
 
         self.mods = []
+        self.options = ModOptions()
         self._modLines = []
         self._textLines = []
         state = AT_HEADER
@@ -280,6 +1212,48 @@ class ModRules(object):
         self._possiblyAppendMod()
         self._modLines = None
         self._textLines = None
+        self.hasMinifiedIncludes = any(mod.hasMinifiedIncludes for mod in self.mods)
+        if self.hasMinifiedIncludes:
+            self._minifyIncludes()
+        finders = [finder for mod in self.mods for finder in mod.finders]
+        self._termMatcher = _TermMatcher(finders)
+        self._exactSearchTerms = set(
+            finder.matchKey[1] for finder in finders if finder.matchKey[0] == 'exact')
+
+    @property
+    def includedPaths(self):
+        """
+        Paths of all files included by the mods, in the order of their first
+        ``@include``.
+        """
+        result = []
+        for mod in self.mods:
+            for includedPath in mod.includedPaths:
+                if includedPath not in result:
+                    result.append(includedPath)
+        return result
+
+    def _minifyIncludes(self):
+        """
+        Minify the files included using ``@include minified`` and remove
+        their top level functions neither the other text lines of these
+        rules nor the minified code refer to.
+        """
+        import luamin
+
+        rootNames = luamin.mentionedNames(
+            line for mod in self.mods for _, line in mod.unminifiedTextLines())
+        pathsAndBlocks = [pathAndBlock for mod in self.mods for pathAndBlock in mod.pathsAndBlocksToMinify()]
+        _log.info('minify %d includes', len(pathsAndBlocks))
+        try:
+            minifiedBlocks = luamin.minifiedBlocks([block for _, block in pathsAndBlocks], rootNames)
+        except luamin.LuaError as error:
+            includedPath, _ = pathsAndBlocks[error.blockIndex]
+            raise ModError(error.lineNumber, 'cannot minify "%s": %s' % (includedPath, error.message))
+        for mod in self.mods:
+            minifiedBlockCount = len(mod.pathsAndBlocksToMinify())
+            mod.setMinifiedBlocks(minifiedBlocks[:minifiedBlockCount])
+            minifiedBlocks = minifiedBlocks[minifiedBlockCount:]
 
     def _possiblyAppendMod(self):
         if self._modLines != []:
@@ -307,79 +1281,666 @@ class ModRules(object):
             result = None
         return result
 
-    def apply(self, sourcePath, targetPath):
+    def _sourceLines(self, sourcePath):
+        """
+        Generator for the cleaned lines of ``sourcePath``.
+        """
         assert sourcePath is not None
-        assert targetPath is not None
 
-        # TODO: Take encoding option into account.
-        _log.info('read source "%s"', sourcePath)
-        with open(sourcePath, 'r', encoding='utf-8') as sourceFile:
-            sourceLines = []
+        with open(sourcePath, 'r', encoding=self.options.getOption('encoding')) as sourceFile:
             for line in sourceFile:
-                sourceLines.append(_cleanedLine(line))
-        _log.info('  read %d lines', len(sourceLines))
+                yield _cleanedLine(line)
+
+    def _lineNumberToModdedLinesMap(self, sourceIndex, report=None):
+        """
+        Map of line numbers in ``sourceIndex`` to the ``(mod, moddedLines)``
+        to insert before them.
+        """
+        assert sourceIndex is not None
 
-        lineNumberToModdedLinesMap = {}
+        result = {}
         for mod in self.mods:
-            lineNumberToInsertAt, moddedLines = mod.modded(sourceLines)
-            if lineNumberToInsertAt not in lineNumberToModdedLinesMap:
-                lineNumberToModdedLinesMap[lineNumberToInsertAt] = mod, moddedLines
+            if report is not None:
+                startTime = time.perf_counter()
+            lineNumberToInsertAt, moddedLines = mod.modded(sourceIndex)
+            if report is not None:
+                candidateMatches = sum(len(sourceIndex.lineNumbers(finder)) for finder in mod.finders)
+                report.addMod(mod, lineNumberToInsertAt, time.perf_counter() - startTime, candidateMatches)
+            if lineNumberToInsertAt not in result:
+                result[lineNumberToInsertAt] = mod, moddedLines
             else:
-                existingMod, _ = lineNumberToModdedLinesMap[lineNumberToInsertAt]
-                raise ModError(lineNumberToModdedLinesMap,
+                existingMod, _ = result[lineNumberToInsertAt]
+                if lineNumberToInsertAt >= len(sourceIndex):
+                    lineToInsertAt = 'end of source'
+                elif sourceIndex.lines is not None:
+                    lineToInsertAt = sourceIndex.lines[lineNumberToInsertAt]
+                elif isinstance(sourceIndex, _MappedLineIndex):
+                    lineToInsertAt = sourceIndex.line(lineNumberToInsertAt)
+                else:
+                    lineToInsertAt = 'line %d' % (lineNumberToInsertAt + 1)
+                raise ModError(lineNumberToInsertAt,
                     'only one modification must match the line but currently "%s" and "%s" do: %r' % (
-                    existingMod.description, mod.description, sourceLines[lineNumberToInsertAt]))
+                    existingMod.description, mod.description, lineToInsertAt))
+        return result
+
+    def _writeTarget(self, targetPath, sourceLines, lineNumberToModdedLinesMap, report=None, dryRun=False):
+        """
+        Write ``targetPath`` in chunks of encoded lines and return ``True``
+        if its content changed.
+        """
+        assert targetPath is not None
+        assert sourceLines is not None
+        assert lineNumberToModdedLinesMap is not None
 
         _log.info('write modfied target "%s"', targetPath)
         lineCommentPrefix = self._lineCommentPrefix(targetPath)
         if lineCommentPrefix is not None:
             _log.info('  add mod comments using "%s"', lineCommentPrefix)
+        encoding = self.options.getOption('encoding')
+        linesToWrite = []
+
+        def possiblyAddModdedLines(lineNumberToWrite):
+            modAndModdedLines = lineNumberToModdedLinesMap.get(lineNumberToWrite)
+            if modAndModdedLines is not None:
+                mod, moddedLines = modAndModdedLines
+                _log.info('  insert %d modded lines at %d for: %s',
+                    len(moddedLines), lineNumberToWrite + 1, mod.description)
+                moddedBlockLines = self._moddedBlockLines(mod, moddedLines, lineCommentPrefix)
+                linesToWrite.extend(moddedBlockLines)
+                if report is not None:
+                    report.addBytesWritten(
+                        mod, len(''.join(line + os.linesep for line in moddedBlockLines).encode(encoding)))
 
-        with open(targetPath, 'w', encoding='utf-8') as targetFile:
+        def encodedLinesToWrite():
+            result = ''.join(line + os.linesep for line in linesToWrite).encode(encoding)
+            del linesToWrite[:]
+            return result
+
+        lineCount = 0
+        with _TargetFile(targetPath, dryRun) as targetFile:
             for lineNumberToWrite, lineToWrite in enumerate(sourceLines):
-                modAndModdedLines = lineNumberToModdedLinesMap.get(lineNumberToWrite)
-                if modAndModdedLines is not None:
-                    mod, moddedLines = modAndModdedLines
+                possiblyAddModdedLines(lineNumberToWrite)
+                linesToWrite.append(lineToWrite)
+                lineCount += 1
+                if len(linesToWrite) >= _WRITE_CHUNK_LINE_COUNT:
+                    targetFile.write(encodedLinesToWrite())
+            # Mods found after the last line are appended at the end.
+            possiblyAddModdedLines(lineCount)
+            targetFile.write(encodedLinesToWrite())
+        _log.info('  wrote %d lines', lineCount)
+        return targetFile.hasChanged
+
+    def _writeMappedTarget(self, targetPath, sourceIndex, lineNumberToModdedLinesMap, report=None, dryRun=False):
+        """
+        Write ``targetPath`` by copying the unmodified ranges of the mapped
+        ``sourceIndex`` as they are and splicing in the modded lines, which
+        use the same encoding and newline as the source. Return ``True``
+        if the content of the target changed.
+        """
+        assert targetPath is not None
+        assert sourceIndex is not None
+        assert lineNumberToModdedLinesMap is not None
+
+        _log.info('write modfied target "%s" from mapped source', targetPath)
+        lineCommentPrefix = self._lineCommentPrefix(targetPath)
+        if lineCommentPrefix is not None:
+            _log.info('  add mod comments using "%s"', lineCommentPrefix)
+        newline = sourceIndex.newline
+        with _TargetFile(targetPath, dryRun) as targetFile:
+            with memoryview(sourceIndex.data) as sourceView:
+                copiedOffset = 0
+                for lineNumberToInsertAt in sorted(lineNumberToModdedLinesMap):
+                    mod, moddedLines = lineNumberToModdedLinesMap[lineNumberToInsertAt]
                     _log.info('  insert %d modded lines at %d for: %s',
-                        len(moddedLines), lineNumberToWrite + 1, mod.description)
-                    if lineCommentPrefix is not None:
-                        targetFile.write('%s mod begin: %s\n' % (lineCommentPrefix, mod.description))
-                    for moddedLocationAndLine in moddedLines:
-                        assert len(moddedLocationAndLine) == 2, 'moddedLocationAndLine=%r' % moddedLocationAndLine
-                        _, moddedLine = moddedLocationAndLine
-                        targetFile.write(moddedLine)
-                        targetFile.write('\n')
-                    if lineCommentPrefix is not None:
-                        targetFile.write('%s mod end: %s\n' % (lineCommentPrefix, mod.description))
-                targetFile.write(lineToWrite)
-                targetFile.write('\n')
-        _log.info('  wrote %d lines', len(sourceLines))
+                        len(moddedLines), lineNumberToInsertAt + 1, mod.description)
+                    offsetToInsertAt = sourceIndex.lineOffset(lineNumberToInsertAt)
+                    targetFile.write(sourceView[copiedOffset:offsetToInsertAt])
+                    copiedOffset = offsetToInsertAt
+                    if (lineNumberToInsertAt == len(sourceIndex)) and not sourceIndex.endsWithNewline:
+                        targetFile.write(newline)
+                    moddedBytes = b''.join(
+                        lineToWrite.encode(sourceIndex.encoding) + newline
+                        for lineToWrite in self._moddedBlockLines(mod, moddedLines, lineCommentPrefix))
+                    targetFile.write(moddedBytes)
+                    if report is not None:
+                        report.addBytesWritten(mod, len(moddedBytes))
+                targetFile.write(sourceView[copiedOffset:])
+        _log.info('  wrote %d lines', len(sourceIndex))
+        return targetFile.hasChanged
+
+    def _writeSourceMap(self, targetPath, lineNumberToModdedLinesMap, dryRun=False):
+        """
+        Write ``targetPath`` + ``'.map'`` with a JSON list of
+        ``[targetLineNumber, includedPath, lineNumber]`` for each line of the
+        target stemming from a minified include, so errors reported for the
+        target can be traced back to the original line of the included
+        file. Line numbers start with 1.
+        """
+        import json
+
+        assert targetPath is not None
+        assert lineNumberToModdedLinesMap is not None
+
+        sourceMapPath = targetPath + '.map'
+        _log.info('write source map "%s"', sourceMapPath)
+        modCommentLineCount = 1 if self._lineCommentPrefix(targetPath) is not None else 0
+        insertedLineCount = 0
+        sourceMap = []
+        for lineNumberToInsertAt in sorted(lineNumberToModdedLinesMap):
+            mod, moddedLines = lineNumberToModdedLinesMap[lineNumberToInsertAt]
+            firstTargetLineNumber = lineNumberToInsertAt + insertedLineCount + modCommentLineCount
+            for textLineIndex, includedPath, lineNumber in mod.minifiedLineLocations():
+                sourceMap.append([firstTargetLineNumber + textLineIndex + 1, includedPath, lineNumber + 1])
+            insertedLineCount += len(moddedLines) + 2 * modCommentLineCount
+        with _TargetFile(sourceMapPath, dryRun) as sourceMapFile:
+            sourceMapFile.write(json.dumps(sourceMap).encode('utf-8'))
+
+    def _moddedBlockLines(self, mod, moddedLines, lineCommentPrefix):
+        """
+        Lines to insert for ``mod``, possibly enclosed in comments.
+        """
+        result = []
+        if lineCommentPrefix is not None:
+            result.append('%s mod begin: %s' % (lineCommentPrefix, mod.description))
+        for moddedLocationAndLine in moddedLines:
+            assert len(moddedLocationAndLine) == 2, 'moddedLocationAndLine=%r' % moddedLocationAndLine
+            _, moddedLine = moddedLocationAndLine
+            result.append(moddedLine)
+        if lineCommentPrefix is not None:
+            result.append('%s mod end: %s' % (lineCommentPrefix, mod.description))
+        return result
+
+    def apply(self, sourcePath, targetPath, streamed=False, reportHook=None, mapped=False, dryRun=False, shards=1):
+        """
+        Write ``targetPath`` with the lines of ``sourcePath`` modded by all
+        mods of these rules.
+
+        If ``streamed`` is ``True``, the source is never held in memory as a
+        whole. Instead it is read twice: a first pass only keeps the line
+        numbers of lines matching any of the finders, which is enough to
+        resolve all mods; a second pass copies the source to the target and
+        inserts the modded lines as it goes by. This allows to mod
+        arbitrarily large sources with memory proportional to the number of
+        matching lines only.
+
+        If ``mapped`` is ``True``, the source is memory mapped and processed
+        as bytes in the encoding of the rules' options. Only lines that are
+        candidates to match a finder are decoded, and the target is written
+        by copying the unmodified parts of the source as they are. Unlike
+        the other modes, this preserves trailing white space and newlines of
+        the source. It suits large sources with few finders because each
+        distinct search term scans the source once.
+
+        If ``shards`` is greater than 1, the source is processed as bytes
+        like with ``mapped`` but read once into shared memory and split into
+        that many shards. The lines of each shard are matched against all
+        finders in a separate process, so very large sources are resolved
+        using multiple CPUs. The mods are then resolved in their order as
+        usual, so the result and conflicts found are the same as without
+        shards.
+
+        If ``reportHook`` is specified, it is called with an `ApplyReport`
+        containing the time spent on each mod, the number of candidate
+        matches of its finders, where it was inserted and how many bytes it
+        added.
+
+        The target is only replaced if its content changed, which the
+        result tells with ``True`` or ``False``. Unchanged targets keep
+        their modification time, so later build steps depending on them
+        can be skipped. With ``dryRun``, the target is never replaced and
+        the result only tells whether it would have changed.
+        """
+        assert sourcePath is not None
+        assert targetPath is not None
+        assert not (streamed and mapped)
+        assert shards >= 1
+        assert not (streamed and (shards > 1))
+
+        if reportHook is not None:
+            report = ApplyReport(sourcePath, targetPath)
+            startTime = time.perf_counter()
+        else:
+            report = None
+
+        def applySource(sourceIndex, sourceLines):
+            _log.info('  read %d lines', len(sourceIndex))
+            if report is not None:
+                report.sourceLineCount = len(sourceIndex)
+                report.readSeconds = time.perf_counter() - startTime
+            return self._applyIndexed(sourceIndex, sourceLines, targetPath, report, reportHook, dryRun)
+
+        _log.info('read source "%s"', sourcePath)
+        if shards > 1:
+            finders = [finder for mod in self.mods for finder in mod.finders]
+            with _sharedData(sourcePath) as (sharedMemory, dataSize):
+                sourceIndex = _ShardedLineIndex(
+                    sharedMemory, dataSize, self.options.getOption('encoding'), finders, shards)
+                try:
+                    result = applySource(sourceIndex, None)
+                finally:
+                    sourceIndex.close()
+        elif mapped:
+            with _mappedData(sourcePath) as sourceData:
+                result = applySource(_MappedLineIndex(sourceData, self.options.getOption('encoding')), None)
+        elif streamed:
+            result = applySource(
+                _LineIndex(self._sourceLines(sourcePath), self._termMatcher, self._exactSearchTerms),
+                self._sourceLines(sourcePath))
+        else:
+            sourceLines = list(self._sourceLines(sourcePath))
+            result = applySource(_LineIndex(sourceLines, self._termMatcher), sourceLines)
+        return result
+
+    def indexedSource(self, sourceLines):
+        """
+        Index of ``sourceLines`` to apply these rules to using
+        `applyIndexed()`. The index can be reused as long as the source and
+        these rules do not change.
+        """
+        assert sourceLines is not None
+        return _LineIndex(list(sourceLines), self._termMatcher)
+
+    def applyIndexed(self, sourceIndex, targetPath, reportHook=None):
+        """
+        Same as `apply()` but for a source kept in memory and indexed using
+        `indexedSource()`. Return ``True`` if the target changed.
+        """
+        assert sourceIndex is not None
+        assert sourceIndex.lines is not None
+        assert targetPath is not None
+
+        if reportHook is not None:
+            report = ApplyReport('<indexed>', targetPath)
+            report.sourceLineCount = len(sourceIndex)
+        else:
+            report = None
+        return self._applyIndexed(sourceIndex, sourceIndex.lines, targetPath, report, reportHook)
+
+    def _applyIndexed(self, sourceIndex, sourceLines, targetPath, report, reportHook, dryRun=False):
+        lineNumberToModdedLinesMap = self._lineNumberToModdedLinesMap(sourceIndex, report)
+        if report is not None:
+            startTime = time.perf_counter()
+        if isinstance(sourceIndex, _MappedLineIndex):
+            result = self._writeMappedTarget(targetPath, sourceIndex, lineNumberToModdedLinesMap, report, dryRun)
+        else:
+            result = self._writeTarget(targetPath, sourceLines, lineNumberToModdedLinesMap, report, dryRun)
+        if self.hasMinifiedIncludes:
+            self._writeSourceMap(targetPath, lineNumberToModdedLinesMap, dryRun)
+        if report is not None:
+            report.writeSeconds = time.perf_counter() - startTime
+            report.hasTargetChanged = result
+            reportHook(report)
+        return result
+
+
+# Version of the format of cached rules, which has to be incremented
+# whenever the attributes of `ModRules` or the objects it holds change,
+# including the meaning of their values.
+_RULES_CACHE_FORMAT = 5
+
+
+def _fileFingerprint(path):
+    """
+    ``(size, modificationTime, sha256)`` of the file at ``path``.
+    """
+    with open(path, 'rb') as fileToHash:
+        data = fileToHash.read()
+        pathStat = os.fstat(fileToHash.fileno())
+    return pathStat.st_size, pathStat.st_mtime_ns, hashlib.sha256(data).hexdigest()
+
+
+def _isUnchangedFile(path, fingerprint):
+    """
+    ``True`` if the file at ``path`` still has ``fingerprint``. The content
+    is only hashed if the size is the same but the modification time
+    differs.
+    """
+    size, modificationTime, digest = fingerprint
+    try:
+        pathStat = os.stat(path)
+        if pathStat.st_size != size:
+            result = False
+        elif pathStat.st_mtime_ns == modificationTime:
+            result = True
+        else:
+            result = _fileFingerprint(path)[2] == digest
+    except FileNotFoundError:
+        result = False
+    return result
+
+
+def _rulesCachePath(rulesPath):
+    rulesFolder, rulesName = os.path.split(os.path.abspath(rulesPath))
+    return os.path.join(rulesFolder, '__pycache__', '%s.modtext-%s.pickle' % (rulesName, __version__))
+
+
+def _loadedRules(rulesPath, cachePath):
+    """
+    Rules loaded from ``cachePath`` or ``None`` if there is no cache for
+    ``rulesPath`` or the rules or any of their includes changed.
+    """
+    import pickle
+
+    result = None
+    try:
+        with open(cachePath, 'rb') as cacheFile:
+            header = pickle.load(cacheFile)
+            isCurrent = (header['format'] == _RULES_CACHE_FORMAT) and (header['version'] == __version__)
+            if isCurrent:
+                for path, absolutePath, fingerprint in header['files']:
+                    if (os.path.abspath(path) != absolutePath) or not _isUnchangedFile(absolutePath, fingerprint):
+                        _log.info('  ignore outdated cache because of changed "%s"', path)
+                        isCurrent = False
+                        break
+            if isCurrent:
+                result = pickle.load(cacheFile)
+    except FileNotFoundError:
+        pass
+    except (EnvironmentError, EOFError, ImportError, AttributeError, KeyError, TypeError, ValueError,
+            pickle.UnpicklingError) as error:
+        _log.warning('ignore broken rules cache "%s": %s', cachePath, error)
+    return result
+
+
+def _writeRulesCache(rules, cachePath, fileFingerprints):
+    import pickle
+
+    header = {
+        'format': _RULES_CACHE_FORMAT,
+        'version': __version__,
+        'files': fileFingerprints,
+    }
+    temporaryCachePath = '%s.%d.tmp' % (cachePath, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+        with open(temporaryCachePath, 'wb') as cacheFile:
+            pickle.dump(header, cacheFile, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(rules, cacheFile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryCachePath, cachePath)
+    except EnvironmentError as error:
+        _log.warning('cannot write rules cache "%s": %s', cachePath, error)
+
+
+def cachedRules(rulesPath, cachePath=None):
+    """
+    `ModRules` read from ``rulesPath``, which are loaded from a compiled
+    form in ``cachePath`` unless the rules or any of the files they include
+    changed since the cache was written, including luamin for rules using
+    ``@include minified``. Otherwise the rules are parsed and the cache is
+    written for the next time. The cache defaults to a file in a
+    ``__pycache__`` folder next to the rules.
+
+    Like ``*.pyc`` files, the cache must only be writable by those trusted
+    to change the rules.
+    """
+    assert rulesPath is not None
+
+    if cachePath is None:
+        cachePath = _rulesCachePath(rulesPath)
+    result = _loadedRules(rulesPath, cachePath)
+    if result is None:
+        # Take the fingerprint before parsing so changes while parsing
+        # result in an outdated cache rather than a wrong one.
+        rulesFingerprint = _fileFingerprint(rulesPath)
+        result = ModRules(rulesPath)
+        fileFingerprints = [(rulesPath, os.path.abspath(rulesPath), rulesFingerprint)]
+        for includedPath in result.includedPaths:
+            fileFingerprints.append((includedPath, os.path.abspath(includedPath), _fileFingerprint(includedPath)))
+        if result.hasMinifiedIncludes:
+            # Minified includes also change with the minifier.
+            import luamin
+            luaminPath = os.path.abspath(luamin.__file__)
+            fileFingerprints.append((luaminPath, luaminPath, _fileFingerprint(luaminPath)))
+        _writeRulesCache(result, cachePath, fileFingerprints)
+    else:
+        _log.info('  load compiled rules from "%s"', cachePath)
+        # Unpickled included lines are neither interned nor shared with
+        # other rules yet.
+        for mod in result.mods:
+            mod.shareIncludedBlocks()
+    return result
+
+
+class ApplyResult(object):
+    """
+    Result of applying the rules in ``rulesPath`` to ``sourcePath`` as part
+    of `applyMany()`. If this failed, ``error`` holds the `ModError`,
+    `EnvironmentError` or other `ValueError` such as a `UnicodeDecodeError`
+    that prevented it. ``includedPaths`` holds the
+    paths of the files the rules include. ``hasTargetChanged`` tells
+    whether the target was replaced, or is ``None`` if the job failed. If
+    reports were requested, ``report`` holds the `ApplyReport.asDict()` of
+    the job.
+    """
+    def __init__(self, rulesPath, sourcePath, targetPath, error=None):
+        assert rulesPath is not None
+        assert sourcePath is not None
+        assert targetPath is not None
+
+        self.rulesPath = rulesPath
+        self.sourcePath = sourcePath
+        self.targetPath = targetPath
+        self.error = error
+        self.includedPaths = []
+        self.hasTargetChanged = None
+        self.report = None
+
+    @property
+    def hasSucceeded(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '%s(%r, %r, %r, error=%r)' % (
+            self.__class__.__name__, self.rulesPath, self.sourcePath, self.targetPath, self.error)
+
+
+# Rules available to the current worker process of `applyMany()`.
+_workerRulesPathToRulesMap = {}
+
+# Errors that make a single job of `applyMany()` fail: besides `ModError`,
+# broken files can result in `ValueError`s such as `UnicodeDecodeError`.
+_JOB_ERRORS = (ValueError, EnvironmentError)
+
+
+def _initWorker(rulesPathToRulesMap):
+    global _workerRulesPathToRulesMap
+    _workerRulesPathToRulesMap = rulesPathToRulesMap
+
+
+def _appliedJob(job, streamed=False, withReport=False, mapped=False, dryRun=False, shards=1):
+    rulesPath, sourcePath, targetPath = job
+    rules = _workerRulesPathToRulesMap[rulesPath]
+    result = ApplyResult(rulesPath, sourcePath, targetPath)
+    result.includedPaths = rules.includedPaths
+
+    def storeReport(report):
+        result.report = report.asDict()
+
+    try:
+        result.hasTargetChanged = rules.apply(
+            sourcePath, targetPath, streamed, storeReport if withReport else None, mapped, dryRun, shards)
+    except _JOB_ERRORS as error:
+        _log.error('cannot apply "%s" to "%s": %s', rulesPath, sourcePath, error)
+        result.error = error
+    return result
+
+
+def applyMany(jobs, workers=None, streamed=False, withReports=False, mapped=False, cached=False, dryRun=False,
+        shards=1):
+    """
+    Apply many rules to many sources and return an `ApplyResult` for each
+    job in ``jobs``, which are ``(rulesPath, sourcePath, targetPath)``
+    tuples.
+
+    Each distinct rules file is read only once, using `cachedRules()` if
+    ``cached`` is ``True``. The jobs are spread over a pool of ``workers``
+    processes, which defaults to the number of CPUs. Failing jobs do not
+    stop the other jobs; instead their error is stored in their result. If
+    ``withReports`` is ``True``, each successful result also holds a report
+    as described in `ModRules.apply()`, which also describes ``streamed``,
+    ``mapped``, ``dryRun`` and ``shards``.
+    """
+    assert jobs is not None
+    assert (workers is None) or (workers >= 1)
+
+    jobs = list(jobs)
+    rulesPathToRulesMap = {}
+    rulesPathToErrorMap = {}
+    for rulesPath, _, _ in jobs:
+        if (rulesPath not in rulesPathToRulesMap) and (rulesPath not in rulesPathToErrorMap):
+            _log.info('read mods from "%s"', rulesPath)
+            try:
+                rulesPathToRulesMap[rulesPath] = cachedRules(rulesPath) if cached else ModRules(rulesPath)
+            except _JOB_ERRORS as error:
+                _log.error('cannot read mods from "%s": %s', rulesPath, error)
+                rulesPathToErrorMap[rulesPath] = error
+
+    result = [ApplyResult(rulesPath, sourcePath, targetPath, rulesPathToErrorMap.get(rulesPath))
+        for rulesPath, sourcePath, targetPath in jobs]
+    jobIndicesToApply = [jobIndex for jobIndex, applyResult in enumerate(result) if applyResult.hasSucceeded]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobIndicesToApply))
+    if workers <= 1:
+        _initWorker(rulesPathToRulesMap)
+        for jobIndex in jobIndicesToApply:
+            result[jobIndex] = _appliedJob(jobs[jobIndex], streamed, withReports, mapped, dryRun, shards)
+    else:
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_initWorker, initargs=(rulesPathToRulesMap,)) as executor:
+            futureToJobIndexMap = {
+                executor.submit(_appliedJob, jobs[jobIndex], streamed, withReports, mapped, dryRun, shards): jobIndex
+                for jobIndex in jobIndicesToApply}
+            for future in concurrent.futures.as_completed(futureToJobIndexMap):
+                result[futureToJobIndexMap[future]] = future.result()
+    return result
+
+
+def _hasGlobPattern(path):
+    return any(character in path for character in '*?[')
+
+
+def _commandLineJobs(rulesPath, sourcePathOrPattern, targetPath):
+    """
+    ``(rulesPath, sourcePath, targetPath)`` jobs for the command line
+    arguments. If the source is a glob pattern or the target is an existing
+    folder, the target is a folder and each matching source is written to
+    it using its own name.
+    """
+    if _hasGlobPattern(sourcePathOrPattern):
+        import glob
+
+        sourcePaths = sorted(glob.glob(sourcePathOrPattern))
+        if sourcePaths == []:
+            raise EnvironmentError('no source matches pattern "%s"' % sourcePathOrPattern)
+        isTargetFolder = True
+    else:
+        sourcePaths = [sourcePathOrPattern]
+        isTargetFolder = os.path.isdir(targetPath)
+    if isTargetFolder:
+        if not os.path.isdir(targetPath):
+            raise EnvironmentError('target folder must exist: "%s"' % targetPath)
+        result = [
+            (rulesPath, sourcePath, os.path.join(targetPath, os.path.basename(sourcePath)))
+            for sourcePath in sourcePaths]
+    else:
+        result = [(rulesPath, sourcePathOrPattern, targetPath)]
+    return result
+
+
+def _writeReports(reportPath, applyResults):
+    import json
+
+    reports = [applyResult.report for applyResult in applyResults if applyResult.report is not None]
+    if reportPath == '-':
+        json.dump(reports, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        _log.info('write report to "%s"', reportPath)
+        with open(reportPath, 'w', encoding='utf-8') as reportFile:
+            json.dump(reports, reportFile, indent=2, sort_keys=True)
+
+
+def _errorMessage(error):
+    """
+    Message for ``error`` to log on the command line; errors other than
+    the expected `_JOB_ERRORS` also name their type.
+    """
+    if isinstance(error, _JOB_ERRORS):
+        result = str(error)
+    else:
+        result = '%s: %s' % (type(error).__name__, error)
+    return result
+
+
+def main(arguments=None):
+    """
+    Apply the rules passed on the command line and return the exit code: 0
+    on success, 1 if ``--check`` found targets that would change and 2 on
+    errors.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='modtext', description='mod text files according to mod rules')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('--check', action='store_true',
+        help='only check whether targets are up to date without changing them; '
+        'targets that would change result in exit code 1')
+    parser.add_argument('--jobs', type=int, default=1, metavar='COUNT',
+        help='number of processes to apply rules to many sources with (default: %(default)s)')
+    parser.add_argument('--shards', type=int, default=1, metavar='COUNT',
+        help='number of processes to match the lines of each source with; '
+        'suits very large sources and implies processing them as bytes like --mapped (default: %(default)s)')
+    parser.add_argument('--report', metavar='PATH',
+        help='JSON file to write a report on each applied source to; use "-" for stdout')
+    parser.add_argument('--no-cache', dest='cached', action='store_false',
+        help='always parse the rules instead of reading them from __pycache__')
+    sourceModeGroup = parser.add_mutually_exclusive_group()
+    sourceModeGroup.add_argument('--streamed', action='store_true',
+        help='read sources twice instead of holding them in memory')
+    sourceModeGroup.add_argument('--mapped', action='store_true',
+        help='memory map sources and process them as bytes')
+    parser.add_argument('rules', help='file with the mod rules')
+    parser.add_argument('source', help='source file to mod or glob pattern for several sources, for example "*.lua"')
+    parser.add_argument('target', help='target file to write or folder to write the modded sources to')
+    args = parser.parse_args(arguments)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1 but is %d' % args.jobs)
+    if args.shards < 1:
+        parser.error('--shards must be at least 1 but is %d' % args.shards)
+    if args.streamed and (args.shards > 1):
+        parser.error('--streamed cannot be combined with --shards')
+
+    try:
+        jobs = _commandLineJobs(args.rules, args.source, args.target)
+        applyResults = applyMany(
+            jobs, args.jobs, args.streamed, args.report is not None, args.mapped, args.cached, args.check,
+            args.shards)
+        if args.report is not None:
+            _writeReports(args.report, applyResults)
+    except Exception as error:
+        # Report any error as one line, including unexpected ones such as a
+        # broken process pool, and keep the stack trace for debug logging.
+        _log.error('%s', _errorMessage(error))
+        _log.debug('stack trace:', exc_info=True)
+        applyResults = None
+    if applyResults is not None:
+        if not all(applyResult.hasSucceeded for applyResult in applyResults):
+            result = 2
+        elif args.check and any(applyResult.hasTargetChanged for applyResult in applyResults):
+            for applyResult in applyResults:
+                if applyResult.hasTargetChanged:
+                    _log.warning('target would change: "%s"', applyResult.targetPath)
+            result = 1
+        else:
+            result = 0
+    else:
+        result = 2
+    return result
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-
-    modPath = r'C:\Users\teflonlove\workspace\chatmaid\ChatOptions_mod.lua'
-    sourcePath = r'C:\Program Files (x86)\Red 5 Studios\Firefall\system\gui\components\MainUI\Panels\R5Chat\ChatOptions.lua'
-    targetPath = r'C:\temp\ChatOptions.lua'
-
-#    modPath = r'C:\Users\teflonlove\workspace\chatmaid\R5Chat_mod.lua'
-#    sourcePath = r'C:\Program Files (x86)\Red 5 Studios\Firefall\system\gui\components\MainUI\Panels\R5Chat\R5Chat.lua'
-#    targetPath = r'C:\temp\R5Chat.lua'
-
-    _log.info('read mods from "%s"', modPath)
-#    with open(modPath, 'r', encoding='utf-8') as modFile:
-#        rules = ModRules(modFile)
-    rules = ModRules(modPath)
-    rules.apply(sourcePath, targetPath)
-
-##        def appendMod(lineNumber, linesToAppend):
-##            assert linesToAppend != []
-##            # Remove last empty line (if any).
-##            if linesToAppend[:-1] == '':
-##                linesToAppend = linesToAppend[:-1]
-##            mods.append(linesToAppend)
-##                
-##        for lineNumber, line in enumerate(modFile):
-##            line = line.rstrip('\n\r\t ')
-##            print(lineNumber, line)
+    sys.exit(main())
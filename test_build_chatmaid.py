@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for build_chatmaid.
+"""
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+
+import build_chatmaid
+
+# Names of the outputs `_joinedText()` wrote since the last test started.
+_writtenNames = []
+
+
+def _joinedText(inputPaths, outputPath, separator):
+    _writtenNames.append(os.path.basename(outputPath))
+    texts = []
+    for inputPath in inputPaths:
+        with open(inputPath, 'r', encoding='utf-8') as inputFile:
+            texts.append(inputFile.read())
+    with open(outputPath, 'w', encoding='utf-8') as outputFile:
+        outputFile.write(separator.join(texts))
+    return True
+
+
+_MANIFEST = {'variables': {'Folder': 'manifest', 'Path': '${Folder}/Chat.lua'}}
+
+
+class ManifestVariablesTest(unittest.TestCase):
+    def test_can_use_manifest_defaults(self):
+        variables = build_chatmaid._manifestVariables(_MANIFEST, {}, {})
+        self.assertEqual(variables['Folder'], 'manifest')
+        self.assertEqual(variables['Path'], 'manifest/Chat.lua')
+
+    def test_can_override_manifest_by_environment(self):
+        variables = build_chatmaid._manifestVariables(_MANIFEST, {}, {'Folder': 'environment'})
+        self.assertEqual(variables['Folder'], 'environment')
+        self.assertEqual(variables['Path'], 'environment/Chat.lua')
+
+    def test_can_override_environment_by_definition(self):
+        variables = build_chatmaid._manifestVariables(
+            _MANIFEST, {'Folder': 'definition'}, {'Folder': 'environment', 'Path': 'environment.lua'})
+        self.assertEqual(variables['Folder'], 'definition')
+        self.assertEqual(variables['Path'], 'environment.lua')
+
+
+
+class ChatmaidTablesTest(unittest.TestCase):
+    def test_has_current_chatmaid_tables(self):
+        # If this fails, run build_chatmaid.py and commit chatmaid_tables.lua.
+        tablesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chatmaid_tables.lua')
+        with open(tablesPath, 'r', encoding='utf-8', newline='') as tablesFile:
+            self.assertEqual(tablesFile.read(), '\n'.join(build_chatmaid._chatmaidTablesLuaLines()) + '\n')
+
+    def test_can_quote_lua_strings(self):
+        self.assertEqual(build_chatmaid._luaString('a"b\\c'), '"a\\"b\\\\c"')
+        self.assertEqual(build_chatmaid._luaString('\u00e4\n'), '"\\195\\164\\10"')
+
+
+class _StepsTestCase(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        del _writtenNames[:]
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as fileToWrite:
+            fileToWrite.write(text)
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as fileToRead:
+            return fileToRead.read()
+
+    def _step(self, outputName, inputNames, separator='+'):
+        inputPaths = [self._path(inputName) for inputName in inputNames]
+        outputPath = self._path(outputName)
+        return build_chatmaid._BuildStep(
+            'join %s' % outputName, _joinedText, (inputPaths, outputPath, separator), inputPaths, [outputPath])
+
+    def _linkedSteps(self, *steps):
+        build_chatmaid._linkDependencies(steps)
+        return list(steps)
+
+
+class BuildCacheTest(_StepsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cachePath = self._path('build_cache.json')
+        self._write(self._path('a.txt'), 'a')
+
+    def _build(self, separator='+'):
+        buildCache = build_chatmaid._BuildCache(self.cachePath)
+        result = build_chatmaid._runSteps(
+            self._linkedSteps(self._step('b.txt', ['a.txt'], separator), self._step('c.txt', ['b.txt'])),
+            buildCache, 1)
+        buildCache.write()
+        return result
+
+    def test_can_skip_unchanged_steps(self):
+        self.assertEqual(self._build(), 2)
+        del _writtenNames[:]
+        self.assertEqual(self._build(), 0)
+        self.assertEqual(_writtenNames, [])
+
+    def test_can_rebuild_changed_input(self):
+        self._build()
+        del _writtenNames[:]
+        self._write(self._path('a.txt'), 'changed')
+        self.assertEqual(self._build(), 2)
+        self.assertEqual(_writtenNames, ['b.txt', 'c.txt'])
+        self.assertEqual(self._read(self._path('c.txt')), 'changed')
+
+    def test_can_rebuild_changed_arguments(self):
+        # Changing the manifest results in steps with other arguments. The
+        # output of b.txt is the same though, so c.txt remains current.
+        self._build()
+        del _writtenNames[:]
+        self._build(separator='-')
+        self.assertEqual(_writtenNames, ['b.txt'])
+
+    def test_can_rebuild_missing_output(self):
+        self._build()
+        del _writtenNames[:]
+        os.remove(self._path('c.txt'))
+        self._build()
+        self.assertEqual(_writtenNames, ['c.txt'])
+
+    def test_can_ignore_broken_cache(self):
+        self._build()
+        for brokenCacheText in ('', '{"broken', '[]', '{"%s": {}}' % self._path('b.txt').replace('\\', '\\\\')):
+            with self.subTest(brokenCacheText=brokenCacheText):
+                self._write(self.cachePath, brokenCacheText)
+                del _writtenNames[:]
+                with self.assertLogs('build_chatmaid', 'WARNING'):
+                    self._build()
+                self.assertEqual(_writtenNames, ['b.txt', 'c.txt'])
+                del _writtenNames[:]
+                self._build()
+                self.assertEqual(_writtenNames, [])
+
+
+class StepsTest(_StepsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buildCache = build_chatmaid._BuildCache(self._path('build_cache.json'))
+        self._write(self._path('a.txt'), 'a')
+
+    def test_can_run_steps_after_their_dependencies(self):
+        steps = self._linkedSteps(
+            self._step('d.txt', ['b.txt', 'c.txt']), self._step('c.txt', ['b.txt']), self._step('b.txt', ['a.txt']))
+        self.assertEqual([step.dependencies for step in steps], [[steps[2], steps[1]], [steps[2]], []])
+        self.assertEqual(build_chatmaid._runSteps(steps, self.buildCache, 1), 3)
+        self.assertEqual(_writtenNames, ['b.txt', 'c.txt', 'd.txt'])
+        self.assertEqual(self._read(self._path('d.txt')), 'a+a')
+
+    def test_can_run_independent_steps_concurrently(self):
+        self._write(self._path('b.txt'), 'b')
+        steps = self._linkedSteps(
+            self._step('e.txt', ['c.txt', 'd.txt']), self._step('c.txt', ['a.txt']), self._step('d.txt', ['b.txt']))
+        self.assertEqual(build_chatmaid._runSteps(steps, self.buildCache, 2), 3)
+        self.assertEqual(self._read(self._path('e.txt')), 'a+b')
+
+    def test_fails_on_cycle(self):
+        with self.assertRaisesRegex(ValueError, 'cycle: join b.txt, join c.txt'):
+            self._linkedSteps(
+                self._step('b.txt', ['a.txt', 'c.txt']), self._step('c.txt', ['b.txt']), self._step('d.txt', ['a.txt']))
+
+    def test_fails_on_output_of_several_steps(self):
+        with self.assertRaisesRegex(ValueError, 'built by only one step'):
+            self._linkedSteps(self._step('b.txt', ['a.txt']), self._step('b.txt', ['a.txt'], '-'))
+
+    def test_fails_on_failing_step(self):
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                del _writtenNames[:]
+                steps = self._linkedSteps(
+                    self._step('c.txt', ['missing.txt']), self._step('d.txt', ['c.txt']),
+                    self._step('b.txt', ['a.txt']))
+                self.assertRaises(FileNotFoundError, build_chatmaid._runSteps, steps, self.buildCache, workers)
+                self.assertFalse(os.path.exists(self._path('d.txt')))
+                self.assertFalse(any(
+                    self.buildCache.isCurrent(step.outputPaths[0], step.digest()) for step in steps[:2]))
+
+
+class ArchiveTest(_StepsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memberPaths = [self._path('b.lua'), self._path('a.lua')]
+        for memberPath in self.memberPaths:
+            self._write(memberPath, 'print("%s")\n' % os.path.basename(memberPath) * 20)
+
+    def _archiveData(self, memberPaths, compressLevel=9):
+        return build_chatmaid._archiveData(memberPaths, compressLevel, (2014, 2, 8, 12, 0, 0))
+
+    def test_can_build_same_archive_twice(self):
+        archiveData = self._archiveData(self.memberPaths)
+        os.utime(self.memberPaths[0], (1000000000, 1000000000))
+        self.assertEqual(self._archiveData(list(reversed(self.memberPaths))), archiveData)
+        with zipfile.ZipFile(io.BytesIO(archiveData)) as archive:
+            self.assertEqual(archive.namelist(), ['a.lua', 'b.lua'])
+            self.assertEqual(archive.getinfo('a.lua').date_time, (2014, 2, 8, 12, 0, 0))
+            self.assertEqual(archive.read('b.lua').decode('utf-8'), self._read(self.memberPaths[0]))
+
+    def test_can_use_compress_level(self):
+        self.assertLess(len(self._archiveData(self.memberPaths)), len(self._archiveData(self.memberPaths, 0)))
+
+    def test_can_plan_compress_level_of_manifest(self):
+        manifest = {'addons': [{'name': 'some', 'archives': [
+            {'target': self._path('some.zip'), 'members': self.memberPaths}]}]}
+        for compressLevel, expectedCompressLevel in ((None, 9), (0, 0), (5, 5)):
+            with self.subTest(compressLevel=compressLevel):
+                if compressLevel is not None:
+                    manifest['addons'][0]['archives'][0]['compressLevel'] = compressLevel
+                archiveStep = build_chatmaid._plannedSteps(manifest, {})[0]
+                self.assertEqual(archiveStep.arguments[2], expectedCompressLevel)
+
+    def test_fails_on_broken_compress_level(self):
+        for compressLevel in (10, -1, '9', True):
+            with self.subTest(compressLevel=compressLevel):
+                manifest = {'addons': [{'name': 'some', 'archives': [
+                    {'target': self._path('some.zip'), 'members': self.memberPaths, 'compressLevel': compressLevel}]}]}
+                self.assertRaises(ValueError, build_chatmaid._plannedSteps, manifest, {})
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.rulesPath = self._path('rules.lua')
+        self.sourcePath = self._path('source.lua')
+        self.targetPath = self._path('target.lua')
+        self._write(self.rulesPath, '@mod "greet"\n@after "local x = 1"\nprint("hello")\n')
+        self._write(self.sourcePath, 'local x = 1\nreturn x\n')
+        buildCache = build_chatmaid._BuildCache(self._path('build_cache.json'))
+        self.watcher = build_chatmaid._Watcher([(self.rulesPath, self.sourcePath, self.targetPath)], buildCache)
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as fileToWrite:
+            fileToWrite.write(text)
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as fileToRead:
+            return fileToRead.read()
+
+    def test_can_update_changed_source(self):
+        self._write(self.sourcePath, 'local x = 1\nreturn x + 1\n')
+        self.assertEqual(self.watcher.update([self.sourcePath]), 1)
+        self.assertIn('print("hello")\n-- mod end: greet\nreturn x + 1\n', self._read(self.targetPath))
+
+    def test_can_keep_watching_broken_files(self):
+        for brokenPath in (self.rulesPath, self.sourcePath):
+            with self.subTest(brokenPath=brokenPath):
+                with open(brokenPath, 'rb') as brokenFile:
+                    data = brokenFile.read()
+                with open(brokenPath, 'wb') as brokenFile:
+                    # Half saved UTF-8 sequence.
+                    brokenFile.write(data + b'-- \xc3')
+                with self.assertLogs('build_chatmaid', 'ERROR') as logs:
+                    self.assertEqual(self.watcher.update([brokenPath]), 0)
+                self.assertIn('decode', logs.output[-1])
+                with open(brokenPath, 'wb') as brokenFile:
+                    brokenFile.write(data + b'-- \xc3\xa4\n')
+                self.assertEqual(self.watcher.update([brokenPath]), 1)
+                self.assertIn('-- \u00e4', self._read(self.targetPath))
+
+
+if __name__ == '__main__':
+    unittest.main()
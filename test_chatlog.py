@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for chatlog, checked against the test cases in test_chatmaid.lua.
+"""
+import json
+import os
+import re
+import tempfile
+import unittest
+
+import chatlog
+
+_TEST_CHATMAID_LUA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_chatmaid.lua')
+
+_LUA_STRING = r'(?:"(?:[^"\\]|\\.)*"|nil)'
+_ASSERT_SANITIZED_REGEX = re.compile(
+    r'^assertSanitized\((%s), (%s), settings, (%s), (%s)\)$' % ((_LUA_STRING,) * 4))
+_SETTING_REGEX = re.compile(r'^settings\.(\w+) = (true|false)$')
+_GUESSED_LANGUAGE_REGEX = re.compile(r'^assert\(GuessedLanguage\((%s)\) == (%s)\)$' % (_LUA_STRING, _LUA_STRING))
+_CLEANED_WHITESPACE_REGEX = re.compile(
+    r'^assertStringEquals\("[^"]*", cleanedWhitespace\((%s)\), (%s)\)$' % (_LUA_STRING, _LUA_STRING))
+
+
+def _luaValue(luaString):
+    if luaString == 'nil':
+        result = None
+    else:
+        result = json.loads(luaString)
+    return result
+
+
+def _luaTestLines():
+    with open(_TEST_CHATMAID_LUA_PATH, 'r', encoding='utf-8') as luaTestFile:
+        for line in luaTestFile:
+            yield line.strip()
+
+
+class LuaTestCasesTest(unittest.TestCase):
+    def test_can_sanitize_like_lua(self):
+        settings = {}
+        assertionCount = 0
+        for line in _luaTestLines():
+            settingMatch = _SETTING_REGEX.match(line)
+            if settingMatch is not None:
+                settings[settingMatch.group(1)] = (settingMatch.group(2) == 'true')
+            sanitizedMatch = _ASSERT_SANITIZED_REGEX.match(line)
+            if sanitizedMatch is not None:
+                channel, text, expectedMessage, expectedAction = (
+                    _luaValue(luaString) for luaString in sanitizedMatch.groups())
+                self.assertEqual(
+                    chatlog.sanitized(channel, text, settings), (expectedMessage, expectedAction), line)
+                assertionCount += 1
+        self.assertGreater(assertionCount, 0)
+
+    def test_can_guess_language_like_lua(self):
+        assertionCount = 0
+        for line in _luaTestLines():
+            match = _GUESSED_LANGUAGE_REGEX.match(line)
+            if match is not None:
+                text, expectedLanguage = (_luaValue(luaString) for luaString in match.groups())
+                self.assertEqual(chatlog.guessedLanguage(text), expectedLanguage, line)
+                assertionCount += 1
+        self.assertGreater(assertionCount, 0)
+        # Test from test_chatmaid.lua using string.char(128).
+        self.assertEqual(chatlog.guessedLanguage('\x80'), 'xx')
+
+    def test_can_clean_whitespace_like_lua(self):
+        assertionCount = 0
+        for line in _luaTestLines():
+            match = _CLEANED_WHITESPACE_REGEX.match(line)
+            if match is not None:
+                text, expectedText = (_luaValue(luaString) for luaString in match.groups())
+                self.assertEqual(chatlog.cleanedWhitespace(text), expectedText, line)
+                assertionCount += 1
+        self.assertGreater(assertionCount, 0)
+
+
+class SanitizedTest(unittest.TestCase):
+    def test_can_hide_single_character(self):
+        self.assertEqual(chatlog.sanitized('zone', '/', chatlog.DEFAULT_SETTINGS), (None, 'hide single character'))
+
+    def test_can_preserve_valid_single_character_and_digit(self):
+        self.assertEqual(chatlog.sanitized('zone', 'y', chatlog.DEFAULT_SETTINGS), ('y', None))
+        self.assertEqual(chatlog.sanitized('zone', '7', chatlog.DEFAULT_SETTINGS), ('7', None))
+
+    def test_can_preserve_squad_chat(self):
+        self.assertEqual(chatlog.sanitized('squad', 'водка', chatlog.DEFAULT_SETTINGS), ('водка', None))
+
+    def test_can_hide_common_non_english_word_only_as_whole_word(self):
+        settings = {'hideCommonNonEnglish': True}
+        self.assertEqual(chatlog.sanitized('zone', 'ich bin', settings), (None, 'hide common non english'))
+        self.assertEqual(chatlog.sanitized('zone', 'rich', settings), ('rich', None))
+        self.assertEqual(chatlog.sanitized('zone', 'ok, und?', settings), (None, 'hide common non english'))
+
+
+class SanitizeLogTest(unittest.TestCase):
+    def test_can_sanitize_log(self):
+        records = [
+            {'channel': 'zone', 'message': 'ty'},
+            {'channel': 'zone', 'message': 'no!!!'},
+            {'channel': 'army', 'message': 'ty'},
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            sourcePath = os.path.join(folder, 'source.jsonl')
+            targetPath = os.path.join(folder, 'target.jsonl')
+            with open(sourcePath, 'w', encoding='utf-8') as sourceFile:
+                for record in records:
+                    sourceFile.write(json.dumps(record) + '\n')
+            actionToCountMap = chatlog.sanitizeLog(sourcePath, targetPath, chunkSize=2)
+            with open(targetPath, 'r', encoding='utf-8') as targetFile:
+                sanitizedRecords = [json.loads(line) for line in targetFile]
+        self.assertEqual(
+            [(record['sanitized'], record['action']) for record in sanitizedRecords],
+            [(None, 'hide thanks'), ('no!', 'cleanup punctuation'), ('ty', None)])
+        self.assertEqual(actionToCountMap, {'hide thanks': 1, 'cleanup punctuation': 1, None: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 -- Test for chatmaid.
+require "./chatmaid_tables"
 require "./chatmaid"
 
 local function assertStringEquals(name, actual, expected)
@@ -17,11 +18,6 @@ local function assertSanitized(channel, utf8text, settings, expectedMessage, exp
     assertStringEquals("action", actualAction, expectedAction)
 end
 
-print("test bit8and")
-assertStringEquals("bit8and(0, 0)", bit8and(0, 0), 0)
-assertStringEquals("bit8and(0xff, 0xff)", bit8and(0xff, 0xff), 0xff)
-assertStringEquals("bit8and(0xff, 0x0f)", bit8and(0xff, 0x0f), 0x0f)
-
 print("test repr()")
 assertStringEquals("repr: string", repr("hugo"), "\"hugo\"")
 assertStringEquals("repr: string with escapes", repr("hugo\r\nsepp"), "\"hugo\\r\\nsepp\"")
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for luamin.
+"""
+import unittest
+
+import luamin
+
+_LICENSE = '-- Copyright (c) 2014 Someone\n-- Distributed under the MIT License.\n'
+
+
+def _block(text, firstLineNumber=0):
+    return [(firstLineNumber + lineIndex, line) for lineIndex, line in enumerate(text.split('\n'))]
+
+
+def _minifiedText(text, rootNames=None):
+    return '\n'.join(line for _, line in luamin.minifiedBlocks([_block(text)], rootNames)[0])
+
+
+class MinifiedBlocksTest(unittest.TestCase):
+    def test_can_remove_comments_and_blank_lines(self):
+        self.assertEqual(
+            _minifiedText('local x = 1 -- one\n\n--[[ some\nmore ]]\n    return  x\n'),
+            'local x=1\nreturn x')
+
+    def test_can_keep_tokens_apart(self):
+        self.assertEqual(_minifiedText('y = a - -b'), 'y=a- -b')
+        self.assertEqual(_minifiedText('y = 1 .. x'), 'y=1 ..x')
+        self.assertEqual(_minifiedText('y = t[ [[x]] ]'), 'y=t[ [[x]]]')
+        self.assertEqual(_minifiedText('if not x then return end'), 'if not x then return end')
+
+    def test_can_keep_strings(self):
+        self.assertEqual(_minifiedText('s = "a  -- b"'), 's="a  -- b"')
+
+    def test_can_keep_line_numbers(self):
+        minifiedBlock = luamin.minifiedBlocks([_block('-- comment\nlocal s = [[a\n  b]]\n\nreturn s', 10)])[0]
+        self.assertEqual(minifiedBlock, [(11, 'local s=[[a'), (12, '  b]]'), (14, 'return s')])
+
+    def test_can_keep_license_once(self):
+        text = _LICENSE + '\n-- TODO: something\nx = 1\n'
+        minifiedBlocks = luamin.minifiedBlocks([_block(text), _block(text)])
+        self.assertEqual([line for _, line in minifiedBlocks[0]], _LICENSE.split('\n')[:2] + ['x=1'])
+        self.assertEqual([line for _, line in minifiedBlocks[1]], ['x=1'])
+
+    def test_can_remove_unreferenced_functions(self):
+        text = (
+            'local function unused(x)\n    return used(x)\nend\n'
+            'function used(x)\n    if x then\n        return helper(x)\n    end\nend\n'
+            'function helper(x)\n    return helper(x)\nend\n'
+            'function alone()\nend\n'
+            'print(used)\n')
+        self.assertEqual(
+            _minifiedText(text, set()),
+            'function used(x)\nif x then\nreturn helper(x)\nend\nend\n'
+            'function helper(x)\nreturn helper(x)\nend\nprint(used)')
+        self.assertIn('function alone()', _minifiedText(text, {'alone'}))
+
+    def test_fails_on_unfinished_string(self):
+        with self.assertRaises(luamin.LuaError) as context:
+            luamin.minifiedBlocks([_block('x = 1\ns = "abc\n', 5)])
+        self.assertEqual(context.exception.lineNumber, 6)
+        self.assertEqual(context.exception.blockIndex, 0)
+
+    def test_fails_on_unfinished_long_comment(self):
+        self.assertRaises(luamin.LuaError, luamin.minifiedBlocks, [_block('--[[ comment\nx = 1')])
+
+    def test_fails_on_unmatched_end(self):
+        self.assertRaises(luamin.LuaError, luamin.minifiedBlocks, [_block('x = 1\nend')], set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for modserve.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import modserve
+
+
+class LruCacheTest(unittest.TestCase):
+    def test_can_evict_least_recently_used_entries(self):
+        cache = modserve.LruCache(10)
+        cache.put('a', 'A', 4, ())
+        cache.put('b', 'B', 4, ())
+        self.assertEqual(cache.get('a'), 'A')
+        cache.put('c', 'C', 4, ())
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual(cache.size, 8)
+        self.assertEqual(cache.evictionCount, 1)
+
+    def test_can_keep_single_oversized_entry(self):
+        cache = modserve.LruCache(10)
+        cache.put('a', 'A', 4, ())
+        cache.put('big', 'BIG', 20, ())
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('big'), 'BIG')
+
+    def test_can_drop_entry_of_changed_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'some.txt')
+            with open(path, 'w', encoding='utf-8') as someFile:
+                someFile.write('some')
+            cache = modserve.LruCache(10)
+            cache.put('some', 'SOME', 1, modserve._fileStats([path]))
+            self.assertEqual(cache.get('some'), 'SOME')
+            with open(path, 'w', encoding='utf-8') as someFile:
+                someFile.write('changed')
+            self.assertIsNone(cache.get('some'))
+            self.assertEqual(len(cache), 0)
+
+
+class ModServerTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.rulesPath = self._path('rules.lua')
+        self.sourcePath = self._path('source.lua')
+        self.targetPath = self._path('target.lua')
+        self._write(self.rulesPath, '@mod "greet"\n@after "local x = 1"\nprint("hello")\n')
+        self._write(self.sourcePath, 'local x = 1\nreturn x\n')
+        self.server = modserve.ModServer(1024 * 1024, 2)
+
+    def tearDown(self):
+        self.server.close()
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as fileToWrite:
+            fileToWrite.write(text)
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as fileToRead:
+            return fileToRead.read()
+
+    def _response(self, method, params=None, requestId=1):
+        request = {'jsonrpc': '2.0', 'id': requestId, 'method': method}
+        if params is not None:
+            request['params'] = params
+        return asyncio.run(self.server.response(json.dumps(request)))
+
+    def _applyParams(self):
+        return {'rules': self.rulesPath, 'source': self.sourcePath, 'target': self.targetPath}
+
+    def test_can_apply_rules(self):
+        response = self._response('apply', self._applyParams())
+        self.assertTrue(response['result']['hasTargetChanged'])
+        self.assertEqual(
+            self._read(self.targetPath),
+            'local x = 1\n-- mod begin: greet\nprint("hello")\n-- mod end: greet\nreturn x\n')
+
+    def test_can_reuse_cached_rules_and_source(self):
+        self._response('apply', self._applyParams())
+        response = self._response('apply', self._applyParams())
+        self.assertFalse(response['result']['hasTargetChanged'])
+        stats = self._response('stats')['result']
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_can_reload_changed_rules(self):
+        self._response('apply', self._applyParams())
+        # Ensure the modification time differs even on coarse file systems.
+        time.sleep(0.01)
+        self._write(self.rulesPath, '@mod "greet"\n@after "local x = 1"\nprint("bye")\n')
+        response = self._response('apply', self._applyParams())
+        self.assertTrue(response['result']['hasTargetChanged'])
+        self.assertIn('print("bye")', self._read(self.targetPath))
+
+    def test_can_reload_include_changed_while_parsing(self):
+        includePath = self._path('include.lua')
+        self._write(includePath, 'print("hello")\n')
+        self._write(self.rulesPath, '@mod "greet"\n@after "local x = 1"\n@include "%s"\n' % (
+            includePath.replace('\\', '\\\\')))
+        originalCachedRules = modserve.modtext.cachedRules
+
+        def cachedRulesAndChangeInclude(rulesPath):
+            result = originalCachedRules(rulesPath)
+            # Ensure the modification time differs even on coarse file systems.
+            time.sleep(0.01)
+            self._write(includePath, 'print("changed")\n')
+            return result
+
+        with mock.patch.object(modserve.modtext, 'cachedRules', cachedRulesAndChangeInclude):
+            self._response('apply', self._applyParams())
+        self._response('apply', self._applyParams())
+        self.assertIn('print("changed")', self._read(self.targetPath))
+
+    def test_fails_on_mod_error(self):
+        self._write(self.sourcePath, 'local y = 2\n')
+        response = self._response('apply', self._applyParams())
+        self.assertEqual(response['error']['code'], modserve._MOD_ERROR)
+
+    def test_can_drop_unused_target_locks(self):
+        self._response('apply', self._applyParams())
+        self.assertEqual(self.server._targetPathToLockAndUserCountMap, {})
+
+    def test_fails_on_unexpected_error(self):
+        with open(self.sourcePath, 'wb') as sourceFile:
+            sourceFile.write(b'local x = 1\n\xff\xfe\n')
+        with self.assertLogs('modserve', logging.ERROR):
+            response = self._response('apply', self._applyParams(), requestId=7)
+        self.assertEqual(response['id'], 7)
+        self.assertEqual(response['error']['code'], modserve._INTERNAL_ERROR)
+        self.assertIn('UnicodeDecodeError', response['error']['message'])
+        self.assertEqual(self.server._targetPathToLockAndUserCountMap, {})
+
+    def test_fails_on_broken_requests(self):
+        self.assertEqual(
+            asyncio.run(self.server.response('{'))['error']['code'], modserve._PARSE_ERROR)
+        for requestText in ('null', '[]', '42', '"apply"', '{"id": 1}'):
+            with self.subTest(requestText=requestText):
+                self.assertEqual(
+                    asyncio.run(self.server.response(requestText))['error']['code'], modserve._INVALID_REQUEST)
+        self.assertEqual(self._response('no_such_method')['error']['code'], modserve._METHOD_NOT_FOUND)
+        self.assertEqual(self._response('apply', {'rules': 1})['error']['code'], modserve._INVALID_PARAMS)
+
+
+if __name__ == '__main__':
+    unittest.main()
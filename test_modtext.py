@@ -0,0 +1,563 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for modtext.
+"""
+import ast
+import io
+import json
+import ntpath
+import os
+import pickle
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import modtext
+
+_MODDED_SOURCE = 'local x = 1\n-- mod begin: greet\nprint("hello")\n-- mod end: greet\nreturn x\n'
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.rulesPath = self._path('rules.lua')
+        self._write(self.rulesPath, '@mod "greet"\n@after "local x = 1"\nprint("hello")\n')
+        os.mkdir(self._path('sources'))
+        for name in ('a.lua', 'b.lua'):
+            self._write(self._path('sources', name), 'local x = 1\nreturn x\n')
+        self.sourcePath = self._path('sources', 'a.lua')
+        self.targetPath = self._path('target.lua')
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, *names):
+        return os.path.join(self._folder.name, *names)
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as fileToWrite:
+            fileToWrite.write(text)
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as fileToRead:
+            return fileToRead.read()
+
+    def test_can_apply_rules(self):
+        self.assertEqual(modtext.main(['--no-cache', self.rulesPath, self.sourcePath, self.targetPath]), 0)
+        self.assertEqual(self._read(self.targetPath), _MODDED_SOURCE)
+
+    def test_can_apply_rules_to_glob_pattern(self):
+        targetFolder = self._path('targets')
+        os.mkdir(targetFolder)
+        sourcePattern = self._path('sources', '*.lua')
+        self.assertEqual(modtext.main(['--no-cache', '--jobs', '2', self.rulesPath, sourcePattern, targetFolder]), 0)
+        self.assertEqual(sorted(os.listdir(targetFolder)), ['a.lua', 'b.lua'])
+        self.assertEqual(self._read(os.path.join(targetFolder, 'b.lua')), _MODDED_SOURCE)
+
+    def test_can_check_target(self):
+        self.assertEqual(modtext.main(['--no-cache', '--check', self.rulesPath, self.sourcePath, self.targetPath]), 1)
+        self.assertFalse(os.path.exists(self.targetPath))
+        modtext.main(['--no-cache', self.rulesPath, self.sourcePath, self.targetPath])
+        self.assertEqual(modtext.main(['--no-cache', '--check', self.rulesPath, self.sourcePath, self.targetPath]), 0)
+
+    def test_can_write_report(self):
+        reportPath = self._path('report.json')
+        modtext.main(['--no-cache', '--report', reportPath, self.rulesPath, self.sourcePath, self.targetPath])
+        with open(reportPath, 'r', encoding='utf-8') as reportFile:
+            reports = json.load(reportFile)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['mods'][0]['description'], 'greet')
+        self.assertEqual(reports[0]['mods'][0]['candidateMatches'], 1)
+
+    def test_can_count_candidate_matches_of_each_finder(self):
+        self._write(self.rulesPath, '@mod "greet"\n@after contains "x"\n@before "return x"\nprint("hello")\n')
+        reportPath = self._path('report.json')
+        modtext.main(['--no-cache', '--report', reportPath, self.rulesPath, self.sourcePath, self.targetPath])
+        with open(reportPath, 'r', encoding='utf-8') as reportFile:
+            reports = json.load(reportFile)
+        # "return x" is a candidate for both finders.
+        self.assertEqual(reports[0]['mods'][0]['candidateMatches'], 3)
+
+    def test_can_apply_rules_with_shards(self):
+        lines = ['local value_%d = %d' % (lineNumber, lineNumber) for lineNumber in range(1000)]
+        self._write(self.sourcePath, '\n'.join(lines) + '\n')
+        self._write(self.rulesPath,
+            '@mod "first"\n@after "local value_10 = 10"\n-- first\n\n'
+            '@mod "last"\n@before last glob "local value_9?? = *"\n-- last\n')
+        mappedTargetPath = self._path('mapped.lua')
+        modtext.main(['--no-cache', '--mapped', self.rulesPath, self.sourcePath, mappedTargetPath])
+        self.assertEqual(modtext.main(['--no-cache', '--shards', '3', self.rulesPath, self.sourcePath, self.targetPath]), 0)
+        self.assertEqual(self._read(self.targetPath), self._read(mappedTargetPath))
+        self.assertIn('-- mod end: last\nlocal value_999 = 999\n', self._read(self.targetPath))
+
+    def test_fails_on_conflict_with_shards(self):
+        self._write(self.rulesPath,
+            '@mod "one"\n@after "local x = 1"\n-- one\n\n@mod "two"\n@before "return x"\n-- two\n')
+        self.assertEqual(modtext.main(['--no-cache', '--shards', '2', self.rulesPath, self.sourcePath, self.targetPath]), 2)
+
+    def test_fails_on_broken_source(self):
+        self._write(self.sourcePath, 'local y = 2\n')
+        self.assertEqual(modtext.main(['--no-cache', self.rulesPath, self.sourcePath, self.targetPath]), 2)
+
+    def test_fails_on_pattern_matching_nothing(self):
+        sourcePattern = self._path('sources', '*.txt')
+        self.assertEqual(modtext.main(['--no-cache', self.rulesPath, sourcePattern, self._folder.name]), 2)
+
+    def test_fails_on_undecodable_source(self):
+        with open(self.sourcePath, 'wb') as sourceFile:
+            sourceFile.write(b'local x = 1\n\xff\xfe\n')
+        with self.assertLogs('modtext', 'ERROR'):
+            self.assertEqual(modtext.main(['--no-cache', self.rulesPath, self.sourcePath, self.targetPath]), 2)
+
+    def test_fails_on_unwritable_report(self):
+        reportPath = self._path('no_such_folder', 'report.json')
+        with self.assertLogs('modtext', 'ERROR') as logs:
+            self.assertEqual(
+                modtext.main(['--no-cache', '--report', reportPath, self.rulesPath, self.sourcePath, self.targetPath]),
+                2)
+        self.assertIn(reportPath, logs.output[-1])
+
+    def test_fails_on_unexpected_error(self):
+        with mock.patch.object(modtext, 'applyMany', side_effect=RuntimeError('broken pool')):
+            with self.assertLogs('modtext', 'ERROR') as logs:
+                self.assertEqual(modtext.main(['--no-cache', self.rulesPath, self.sourcePath, self.targetPath]), 2)
+        self.assertEqual(logs.output, ['ERROR:modtext:RuntimeError: broken pool'])
+
+
+class TokensTest(unittest.TestCase):
+    def _assertUnquotedLikeLiteralEval(self, quotedString):
+        tokens = modtext._tokens(0, '@mod %s' % quotedString)
+        self.assertEqual([token.type for token in tokens], ['op', 'name', 'string', 'endmarker'])
+        self.assertEqual(modtext._unquotedString(tokens[2]), ast.literal_eval(quotedString))
+
+    def test_can_unquote_like_literal_eval(self):
+        for quotedString in (
+                '"x"', "'x'", '"a\\"b"', '"tab\\tnewline\\n"', '"\\x41\\u00e4\\U0001F600\\101"', '"back\\\\slash"',
+                '"\\N{BULLET}"', '"\\N{latin small letter a with diaeresis}"', 'r"x"', 'r"\\d+\\N"', 'R"a\\"b"',
+                'u"x"', 'U"\\t"', '"""x"""', "'''it's'''", '"""a "quoted" b"""', 'r"""\\n"""', '""'):
+            with self.subTest(quotedString=quotedString):
+                self._assertUnquotedLikeLiteralEval(quotedString)
+
+    def test_fails_on_unsupported_strings(self):
+        for quotedString in ('b"x"', 'f"x"', 'rb"x"', '"\\x4"', '"\\N{NO SUCH CHARACTER}"', '"\\N"'):
+            with self.subTest(quotedString=quotedString):
+                tokens = modtext._tokens(2, '@mod %s' % quotedString)
+                with self.assertRaises(modtext.ModError) as context:
+                    modtext._unquotedString(tokens[2])
+                self.assertEqual((context.exception.lineNumber, context.exception.columnNumber), (3, 5))
+
+    def test_fails_on_unfinished_string(self):
+        for line in ('@mod "x', '@mod """x"', '@mod r"x'):
+            with self.subTest(line=line):
+                self.assertRaises(modtext.ModError, modtext._tokens, 0, line)
+
+
+class TermMatcherTest(unittest.TestCase):
+    def _indexedLineNumbers(self, rulesText, lines):
+        rules = modtext.ModRules(io.StringIO(rulesText))
+        sourceIndex = modtext._LineIndex(lines, rules._termMatcher)
+        return [sourceIndex.lineNumbers(finder) for mod in rules.mods for finder in mod.finders]
+
+    def test_can_match_glob_contains_terms(self):
+        lines = ['local a = 1', 'print(a)', 'local b = a * 2', 'print(b)']
+        self.assertEqual(
+            self._indexedLineNumbers(
+                '@mod "a"\n@after glob contains "a*2"\n-- a\n\n@mod "b"\n@after glob contains "print(?)"\n-- b\n',
+                lines),
+            [[2], [1, 3]])
+
+    def test_can_match_mixed_glob_and_contains_terms(self):
+        lines = ['local value = 1', 'local values = {}', 'return value', 'local other = 2']
+        self.assertEqual(
+            self._indexedLineNumbers(
+                '@mod "a"\n@after contains "value"\n-- a\n\n'
+                '@mod "b"\n@after glob "local value*"\n-- b\n\n'
+                '@mod "c"\n@after glob "*"\n-- c\n\n'
+                '@mod "d"\n@after glob "local [ov]*"\n-- d\n',
+                lines),
+            [[0, 1, 2], [0, 1], [0, 1, 2, 3], [0, 1, 3]])
+
+    def test_can_match_contains_term_literally(self):
+        # "contains" used to be treated like "glob", so the term had to
+        # match the whole line and "*" and "?" were wildcards.
+        lines = ['x = a*b + 1', 'a*b', 'x = ab + 1', 'x = a + b', 'y = a?b']
+        rulesText = '@mod "a"\n@after contains "a*b"\n-- a\n\n@mod "b"\n@after contains "a?b"\n-- b\n'
+        self.assertEqual(self._indexedLineNumbers(rulesText, lines), [[0, 1], [4]])
+        rules = modtext.ModRules(io.StringIO(rulesText))
+        self.assertEqual(
+            [[line for line in lines if mod.finders[0].compiledMatch()(line)] for mod in rules.mods],
+            [['x = a*b + 1', 'a*b'], ['y = a?b']])
+
+    def test_can_match_globs_like_fnmatch_on_windows(self):
+        lines = ['local x = 1', 'require "lib/Chat"', 'LOCAL X = 2']
+        rulesText = '@mod "a"\n@after glob "local x = *"\n-- a\n\n@mod "b"\n@after glob "require \\"lib\\\\chat*"\n-- b\n'
+        with mock.patch.object(modtext, '_globNormcase', ntpath.normcase):
+            indexedLineNumbers = self._indexedLineNumbers(rulesText, lines)
+            rules = modtext.ModRules(io.StringIO(rulesText))
+            mappedIndex = modtext._MappedLineIndex('\n'.join(lines).encode('utf-8'))
+            mappedLineNumbers = [mappedIndex.lineNumbers(mod.finders[0]) for mod in rules.mods]
+        self.assertEqual(indexedLineNumbers, [[0, 2], [1]])
+        self.assertEqual(mappedLineNumbers, [[0, 2], [1]])
+        with mock.patch.object(modtext, '_globNormcase', None):
+            self.assertEqual(self._indexedLineNumbers(rulesText, lines), [[0], []])
+
+    def test_can_match_same_lines_as_single_finders(self):
+        lines = ['x%d = "%s"' % (lineNumber, 'ab' * (lineNumber % 5)) for lineNumber in range(50)]
+        rulesText = ''.join(
+            '@mod "%d"\n@after %s\n-- %d\n\n' % (modIndex, finderText, modIndex)
+            for modIndex, finderText in enumerate(
+                ['glob "x1*"', 'contains "abab"', 'glob contains "b?a"', 'glob "x[23]? = *"', 'contains "x4"']))
+        rules = modtext.ModRules(io.StringIO(rulesText))
+        finders = [finder for mod in rules.mods for finder in mod.finders]
+        expectedLineNumbers = [
+            [lineNumber for lineNumber, line in enumerate(lines) if finder.compiledMatch()(line)]
+            for finder in finders]
+        self.assertEqual(self._indexedLineNumbers(rulesText, lines), expectedLineNumbers)
+
+    def test_can_match_with_unpickled_matcher(self):
+        rules = modtext.ModRules(io.StringIO(
+            '@mod "a"\n@after contains "value"\n-- a\n\n@mod "b"\n@after glob "local v*"\n-- b\n'))
+        lines = ['local value = 1', 'return value', 'local other = 2']
+        # Compile the expressions before pickling to make sure they are not pickled.
+        modtext._LineIndex(lines, rules._termMatcher)
+        termMatcher = pickle.loads(pickle.dumps(rules._termMatcher, pickle.HIGHEST_PROTOCOL))
+        sourceIndex = modtext._LineIndex(lines, termMatcher)
+        self.assertEqual([sourceIndex.lineNumbers(mod.finders[0]) for mod in rules.mods], [[0, 1], [0]])
+
+
+def _pickledAttributeNames(value, classNameToAttributeNamesMap):
+    if type(value).__module__ == 'modtext':
+        state = value.__getstate__() if '__getstate__' in type(value).__dict__ else vars(value)
+        classNameToAttributeNamesMap.setdefault(type(value).__name__, set()).update(state.keys())
+        _pickledAttributeNames(list(state.values()), classNameToAttributeNamesMap)
+    elif isinstance(value, dict):
+        _pickledAttributeNames(list(value.values()), classNameToAttributeNamesMap)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _pickledAttributeNames(item, classNameToAttributeNamesMap)
+    return classNameToAttributeNamesMap
+
+
+class RulesCacheFormatTest(unittest.TestCase):
+    def test_has_format_matching_pickled_attributes(self):
+        rules = modtext.ModRules(io.StringIO(
+            '@mod "a"\n@after glob "x*"\n@before contains "y"\nz\n\n@mod "b"\n@after "q"\n@before last "w"\nv\n'))
+        classNameToAttributeNamesMap = {
+            className: sorted(attributeNames)
+            for className, attributeNames in _pickledAttributeNames(rules, {}).items()}
+        # If this fails, increment _RULES_CACHE_FORMAT so existing caches
+        # are not loaded into objects that lack attributes, and update the
+        # expected attributes.
+        finderAttributeNames = ['_isContains', '_isGlob', '_isLast', '_searchTerm']
+        self.assertEqual((modtext._RULES_CACHE_FORMAT, classNameToAttributeNamesMap), (5, {
+            'AfterFinder': finderAttributeNames,
+            'BeforeFinder': finderAttributeNames,
+            'Mod': [
+                '_finders', '_includedTextBlocks', '_isMinifiedBlocks', '_textLines', 'description', 'includedPaths',
+                'parseSeconds'],
+            'ModOptions': ['_keyToValuesMap'],
+            'ModRules': [
+                '_exactSearchTerms', '_modLines', '_termMatcher', '_textLines', 'hasMinifiedIncludes', 'mods',
+                'options'],
+            '_TermMatcher': [
+                '_literals', '_literalsAndMatches', '_prefilter', '_termPatterns', 'matchKeys', 'prefilterPattern'],
+        }))
+
+
+class ApplyTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.sourcePath = self._path('source.lua')
+        self.rules = modtext.ModRules(io.StringIO(
+            '@mod "first"\n@after "local x = 1"\nx = x + 1\n\n'
+            '@mod "last"\n@before last glob "return *"\nprint(x)\n'))
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _writeSource(self, data):
+        with open(self.sourcePath, 'wb') as sourceFile:
+            sourceFile.write(data)
+
+    def _appliedData(self, targetName, **keywords):
+        targetPath = self._path(targetName)
+        self.rules.apply(self.sourcePath, targetPath, **keywords)
+        with open(targetPath, 'rb') as targetFile:
+            return targetFile.read()
+
+    def test_can_apply_rules_streamed(self):
+        self._writeSource(b'local x = 1\nlocal y = 2\nreturn x\nreturn y\n')
+        streamedData = self._appliedData('streamed.lua', streamed=True)
+        self.assertEqual(streamedData, self._appliedData('default.lua'))
+        self.assertIn(b'print(x)', streamedData)
+
+    def test_can_keep_unchanged_target(self):
+        self._writeSource(b'local x = 1\nlocal y = 2\nreturn x\n')
+        targetPath = self._path('target.lua')
+        for keywords in ({}, {'mapped': True}, {'streamed': True}):
+            with self.subTest(keywords=keywords):
+                self.rules.apply(self.sourcePath, targetPath, **keywords)
+                os.utime(targetPath, ns=(1000000000, 1000000000))
+                self.assertFalse(self.rules.apply(self.sourcePath, targetPath, **keywords))
+                self.assertEqual(os.stat(targetPath).st_mtime_ns, 1000000000)
+        self.assertEqual(sorted(os.listdir(self._folder.name)), ['source.lua', 'target.lua'])
+
+    def test_can_apply_dry_run(self):
+        self._writeSource(b'local x = 1\nlocal y = 2\nreturn x\n')
+        targetPath = self._path('target.lua')
+        self.assertTrue(self.rules.apply(self.sourcePath, targetPath, dryRun=True))
+        self.assertFalse(os.path.exists(targetPath))
+        with open(targetPath, 'wb') as targetFile:
+            targetFile.write(b'old')
+        os.utime(targetPath, ns=(1000000000, 1000000000))
+        self.assertTrue(self.rules.apply(self.sourcePath, targetPath, mapped=True, dryRun=True))
+        with open(targetPath, 'rb') as targetFile:
+            self.assertEqual(targetFile.read(), b'old')
+        self.assertEqual(os.stat(targetPath).st_mtime_ns, 1000000000)
+        self.assertEqual(sorted(os.listdir(self._folder.name)), ['source.lua', 'target.lua'])
+
+    def test_can_count_bytes_written_with_any_line_separator(self):
+        sourceLines = [b'local x = 1', b'local y = 2', b'return x']
+        for lineSeparator, keywords in (('\n', {}), ('\r\n', {}), ('\r\n', {'mapped': True})):
+            with self.subTest(lineSeparator=lineSeparator, keywords=keywords):
+                newline = lineSeparator.encode('ascii')
+                self._writeSource(b''.join(line + newline for line in sourceLines))
+                reports = []
+                with mock.patch.object(modtext.os, 'linesep', lineSeparator):
+                    targetData = self._appliedData(
+                        'target.lua', reportHook=lambda report: reports.append(report.asDict()), **keywords)
+                bytesWritten = sum(modReport['bytesWritten'] for modReport in reports[0]['mods'])
+                self.assertEqual(bytesWritten, len(targetData) - sum(len(line + newline) for line in sourceLines))
+
+    def _assertMappedLikeDefault(self, sourceData, newline=b'\n', endsWithNewline=True):
+        self._writeSource(sourceData)
+        # Unlike the default mode, the mapped mode keeps the newlines of the source.
+        expectedData = self._appliedData('default.lua').replace(os.linesep.encode('ascii'), newline)
+        if not endsWithNewline:
+            expectedData = expectedData[:-len(newline)]
+        self.assertEqual(self._appliedData('mapped.lua', mapped=True), expectedData)
+
+    def test_can_apply_rules_mapped(self):
+        self._assertMappedLikeDefault(b'local x = 1\nlocal y = 2\nreturn x\n')
+
+    def test_can_apply_rules_mapped_with_crlf(self):
+        self._assertMappedLikeDefault(b'local x = 1\r\nlocal y = 2\r\nreturn x\r\n', b'\r\n')
+
+    def test_can_apply_rules_mapped_without_final_newline(self):
+        self._assertMappedLikeDefault(b'local x = 1\nlocal y = 2\nreturn x', endsWithNewline=False)
+        self._assertMappedLikeDefault(b'local x = 1\r\nlocal y = 2\r\nreturn x', b'\r\n', endsWithNewline=False)
+
+    def test_can_append_mapped_to_source_without_final_newline(self):
+        self.rules = modtext.ModRules(io.StringIO('@mod "end"\n@after "return x"\nprint(x)\n'))
+        self._assertMappedLikeDefault(b'local x = 1\nreturn x')
+
+    def test_can_apply_rules_mapped_to_empty_source(self):
+        self.rules = modtext.ModRules(io.StringIO('@mod "start"\nx = 1\n'))
+        self._assertMappedLikeDefault(b'')
+        self.assertEqual(self._appliedData('mapped.lua', mapped=True), b'-- mod begin: start\nx = 1\n-- mod end: start\n')
+
+
+class ApplyManyTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.rulesPath = self._path('rules.lua')
+        with open(self.rulesPath, 'w', encoding='utf-8') as rulesFile:
+            rulesFile.write('@mod "greet"\n@after "local x = 1"\nprint("hello")\n')
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _jobs(self, sourceDataList):
+        result = []
+        for sourceIndex, sourceData in enumerate(sourceDataList):
+            sourcePath = self._path('source_%d.lua' % sourceIndex)
+            with open(sourcePath, 'wb') as sourceFile:
+                sourceFile.write(sourceData)
+            result.append((self.rulesPath, sourcePath, self._path('target_%d.lua' % sourceIndex)))
+        return result
+
+    def test_can_fail_single_job_with_undecodable_source(self):
+        jobs = self._jobs([b'local x = 1\n', b'local x = 1\n\xff\xfe\n', b'local x = 1\n'])
+        for workers in (1, 2):
+            applyResults = modtext.applyMany(jobs, workers)
+            self.assertEqual([applyResult.hasSucceeded for applyResult in applyResults], [True, False, True])
+            self.assertIsInstance(applyResults[1].error, UnicodeDecodeError)
+
+    def test_can_fail_jobs_with_undecodable_rules(self):
+        jobs = self._jobs([b'local x = 1\n'])
+        with open(self.rulesPath, 'wb') as rulesFile:
+            rulesFile.write(b'@mod "\xff"\n@after "local x = 1"\nprint("hello")\n')
+        applyResults = modtext.applyMany(jobs)
+        self.assertIsInstance(applyResults[0].error, UnicodeDecodeError)
+
+
+class RulesCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.includePath = self._path('include.lua')
+        self._write(self.includePath, 'print("included")\n')
+        self.rulesPath = self._path('rules.lua')
+        self._write(self.rulesPath, '@mod "greet"\n@after "local x = 1"\n@include "%s"\n' % (
+            self.includePath.replace('\\', '\\\\')))
+        self.cachePath = self._path(os.path.join('__pycache__', 'rules.pickle'))
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as fileToWrite:
+            fileToWrite.write(text)
+
+    def _cachedRules(self):
+        return modtext.cachedRules(self.rulesPath, self.cachePath)
+
+    def _assertCacheIsCurrent(self):
+        self.assertIsNotNone(modtext._loadedRules(self.rulesPath, self.cachePath))
+
+    def test_can_load_rules_from_cache(self):
+        self._cachedRules()
+        self._assertCacheIsCurrent()
+        self.assertEqual(self._cachedRules().mods[0].description, 'greet')
+
+    def test_can_rebuild_cache_of_changed_rules(self):
+        self._cachedRules()
+        self._write(self.rulesPath, '@mod "greet again"\n@after "local x = 1"\nprint("hello")\n')
+        self.assertIsNone(modtext._loadedRules(self.rulesPath, self.cachePath))
+        self.assertEqual(self._cachedRules().mods[0].description, 'greet again')
+        self._assertCacheIsCurrent()
+
+    def test_can_rebuild_cache_of_changed_include(self):
+        self._cachedRules()
+        self._write(self.includePath, 'print("changed include")\n')
+        self.assertIsNone(modtext._loadedRules(self.rulesPath, self.cachePath))
+        self.assertEqual(self._cachedRules().mods[0].textLines[-1], (0, 'print("changed include")'))
+        self._assertCacheIsCurrent()
+
+    def test_can_ignore_and_rewrite_broken_cache(self):
+        self._cachedRules()
+        with open(self.cachePath, 'rb') as cacheFile:
+            cacheData = cacheFile.read()
+        for brokenCacheData in (cacheData[:len(cacheData) // 2], cacheData[:10], b'', b'broken', b'\x80\x05K\x01.'):
+            with self.subTest(brokenCacheData=brokenCacheData[:10]):
+                with open(self.cachePath, 'wb') as cacheFile:
+                    cacheFile.write(brokenCacheData)
+                self.assertEqual(self._cachedRules().mods[0].description, 'greet')
+                self._assertCacheIsCurrent()
+
+    def test_can_share_included_lines_of_cached_rules(self):
+        parsedRules = self._cachedRules()
+        loadedRules = self._cachedRules()
+        self.assertIsNot(loadedRules, parsedRules)
+        self.assertIs(loadedRules.mods[0].textLines[-1], parsedRules.mods[0].textLines[-1])
+
+
+class IncludeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.includePath = os.path.join(self._folder.name, 'include.lua')
+        with open(self.includePath, 'w', encoding='utf-8') as includeFile:
+            includeFile.write('print("included")\n')
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def test_can_share_included_lines_between_mods(self):
+        rulesPath = os.path.join(self._folder.name, 'rules.lua')
+        with open(rulesPath, 'w', encoding='utf-8') as rulesFile:
+            for modName in ('a', 'b'):
+                rulesFile.write('@mod "%s"\n@after "%s"\n@include "%s"\n\n' % (
+                    modName, modName, self.includePath.replace('\\', '\\\\')))
+        rules = modtext.ModRules(rulesPath)
+        self.assertEqual(rules.mods[1].textLines[-1], (0, 'print("included")'))
+        self.assertIs(rules.mods[0].textLines[-1], rules.mods[1].textLines[-1])
+
+    def test_can_reread_changed_include(self):
+        includeCache = modtext._IncludeCache(1024)
+        self.assertEqual(includeCache.textLines(self.includePath), ((0, 'print("included")'),))
+        with open(self.includePath, 'w', encoding='utf-8') as includeFile:
+            includeFile.write('print("changed")\n-- more\n')
+        self.assertEqual(includeCache.textLines(self.includePath), ((0, 'print("changed")'), (1, '-- more')))
+        self.assertEqual(len(includeCache), 1)
+        self.assertEqual(includeCache.missCount, 2)
+
+    def test_can_evict_least_recently_used_include(self):
+        otherIncludePath = os.path.join(self._folder.name, 'other.lua')
+        with open(otherIncludePath, 'w', encoding='utf-8') as includeFile:
+            includeFile.write('print("other")\n')
+        includeCache = modtext._IncludeCache(20)
+        includeCache.textLines(self.includePath)
+        includeCache.textLines(otherIncludePath)
+        self.assertEqual(len(includeCache), 1)
+        self.assertEqual(includeCache.evictionCount, 1)
+
+    def test_can_measure_size_in_characters(self):
+        with open(self.includePath, 'w', encoding='utf-8') as includeFile:
+            includeFile.write('print("\u00e4")  \r\n-- end\r\n')
+        includeCache = modtext._IncludeCache(1024)
+        includeCache.textLines(self.includePath)
+        self.assertEqual(includeCache.size, len('print("\u00e4")') + len('-- end'))
+
+    def test_can_intern_shared_block(self):
+        includeCache = modtext._IncludeCache(1024)
+        line = ''.join(['print("', 'included")'])
+        sharedBlock = includeCache.sharedBlock(self.includePath, ((0, line),))
+        self.assertIs(sharedBlock[0][1], sys.intern('print("included")'))
+        self.assertIs(includeCache.textLines(self.includePath), sharedBlock)
+        self.assertIs(includeCache.sharedBlock(self.includePath, ((0, line),)), sharedBlock)
+
+
+class MinifiedIncludeTest(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.includePath = self._path('include.lua')
+        self._write(self.includePath,
+            '-- Some helpers.\n\nfunction greeting()\n    return "hello"\nend\n\n'
+            'function unused()\n    return greeting()\nend\n')
+        self.rulesPath = self._path('rules.lua')
+        self._write(self.rulesPath,
+            '@mod "greet"\n@after "local x = 1"\n@include minified "%s"\n\n'
+            '@mod "print"\n@before "return x"\nprint(greeting())\n' % self.includePath.replace('\\', '\\\\'))
+        self.sourcePath = self._path('source.lua')
+        self._write(self.sourcePath, 'local x = 1\nx = x + 1\nreturn x\n')
+        self.targetPath = self._path('target.lua')
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self._folder.name, name)
+
+    def _write(self, path, text):
+        with open(path, 'w', encoding='utf-8') as fileToWrite:
+            fileToWrite.write(text)
+
+    def test_can_apply_rules_with_minified_include(self):
+        modtext.ModRules(self.rulesPath).apply(self.sourcePath, self.targetPath)
+        with open(self.targetPath, 'r', encoding='utf-8') as targetFile:
+            self.assertEqual(targetFile.read(),
+                'local x = 1\n-- mod begin: greet\n\nfunction greeting()\nreturn"hello"\nend\n-- mod end: greet\n'
+                'x = x + 1\n-- mod begin: print\nprint(greeting())\n-- mod end: print\nreturn x\n')
+        with open(self.targetPath + '.map', 'r', encoding='utf-8') as sourceMapFile:
+            self.assertEqual(json.load(sourceMapFile), [
+                [4, self.includePath, 3], [5, self.includePath, 4], [6, self.includePath, 5]])
+
+    def test_fails_on_broken_minified_include(self):
+        self._write(self.includePath, 'x = 1\ns = "abc\n')
+        with self.assertRaises(modtext.ModError) as context:
+            modtext.ModRules(self.rulesPath)
+        self.assertEqual(context.exception.lineNumber, 1)
+        self.assertIn(self.includePath, context.exception.message)
+
+
+if __name__ == '__main__':
+    unittest.main()